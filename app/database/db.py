@@ -1,15 +1,79 @@
+import os
 import sqlite3
+import threading
 from pathlib import Path
 from typing import Dict
 
 # DB ngay tại root project: .../biometric_auth_ai/biometric.db
+# Dữ liệu định danh/gallery: Users, embeddings, templates, crops, Meta, OTP (đọc mỗi lần verify)
 DB_PATH = (Path(__file__).resolve().parents[2] / "biometric.db")
 
+# DB audit/telemetry: AuthLogs, MetricsRollup (ghi liên tục). Không đặt = dùng chung DB_PATH.
+# Tách file -> burst ghi log không tranh WAL/checkpoint với các lần đọc gallery.
+AUDIT_DB_PATH = os.environ.get("AUDIT_DB_PATH") or None
+
+GALLERY_MMAP_BYTES = int(os.environ.get("GALLERY_MMAP_MB", "256")) * 1024 * 1024
+GALLERY_CACHE_KB = int(os.environ.get("GALLERY_CACHE_MB", "64")) * 1024
+
+
+def audit_db_path():
+    return AUDIT_DB_PATH or DB_PATH
+
+
+def audit_is_separate() -> bool:
+    return AUDIT_DB_PATH is not None and Path(AUDIT_DB_PATH).resolve() != Path(DB_PATH).resolve()
+
 
 def get_conn():
+    """
+    Connection gallery mới (ghi, job/tool). Đường đọc nóng dùng get_read_conn.
+    """
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON;")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    return conn
+
+
+_read_local = threading.local()
+
+
+def _reset_read_conns():
+    global _read_local
+    _read_local = threading.local()
+
+
+# Connection SQLite không được dùng qua fork (uvicorn/gunicorn worker, process pool)
+os.register_at_fork(after_in_child=_reset_read_conns)
+
+
+def get_read_conn():
+    """
+    Connection gallery chỉ đọc, giữ lâu theo thread: mmap file + page cache lớn còn nóng
+    giữa các request. SQLite chỉ bỏ page cache khi file gallery có ghi mới (ít khi
+    AuthLogs nằm ở AUDIT_DB_PATH riêng). Đổi DB_PATH -> mở connection mới.
+    """
+    conn = getattr(_read_local, "conn", None)
+    if conn is None or _read_local.path != DB_PATH:
+        conn = sqlite3.connect(DB_PATH)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = ON;")
+        conn.execute(f"PRAGMA mmap_size = {GALLERY_MMAP_BYTES};")
+        conn.execute(f"PRAGMA cache_size = -{GALLERY_CACHE_KB};")
+        conn.execute("PRAGMA temp_store = MEMORY;")
+        _read_local.conn, _read_local.path = conn, DB_PATH
+    return conn
+
+
+def get_audit_conn():
+    """
+    Connection audit: chủ yếu append -> synchronous=NORMAL (WAL vẫn an toàn khi crash,
+    chỉ có thể mất vài log cuối khi mất điện), checkpoint thưa hơn, cache nhỏ.
+    """
+    conn = sqlite3.connect(audit_db_path(), timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute("PRAGMA wal_autocheckpoint = 4000;")
     return conn
 
 
@@ -22,6 +86,7 @@ _AUTHLOGS_EXTRA_COLS: Dict[str, str] = {
     "IsBonaFide": "INTEGER",      # lab: 0/1/NULL
     "AttackType": "TEXT",         # lab
     "DurationMs": "INTEGER",
+    "MatchUserId": "INTEGER",     # services/dedup: tài khoản trùng mặt (log reject không có UserId)
     # Ip/DeviceInfo/Geo đã có sẵn trong schema gốc
 }
 
@@ -53,6 +118,66 @@ def _ensure_users_columns(conn: sqlite3.Connection):
 
 
 
+AUDIT_SCHEMA = """
+    PRAGMA journal_mode=WAL;
+
+    CREATE TABLE IF NOT EXISTS AuthLogs(
+      LogId       INTEGER PRIMARY KEY AUTOINCREMENT,
+      UserId      INTEGER{user_fk},
+      Similarity  REAL,
+      Decision    TEXT NOT NULL CHECK (Decision IN ('ALLOW','STEP_UP','DENY','ENROLL')),
+      PadResult   TEXT,
+      Purpose     TEXT,   -- LOGIN / PAYMENT / ENROLL
+      Ip          TEXT,
+      DeviceInfo  TEXT,
+      Geo         TEXT,
+      At          INTEGER NOT NULL
+    );
+
+    -- Rollup metrics từ AuthLogs (services/metrics_rollup), Grain = 60 (phút) / 3600 (giờ)
+    CREATE TABLE IF NOT EXISTS MetricsRollup(
+      Grain       INTEGER NOT NULL,
+      BucketStart INTEGER NOT NULL,   -- epoch s, chia hết cho Grain
+      Purpose     TEXT NOT NULL,
+      Total       INTEGER NOT NULL,
+      Allow       INTEGER NOT NULL,
+      StepUp      INTEGER NOT NULL,
+      Deny        INTEGER NOT NULL,
+      Enroll      INTEGER NOT NULL,
+      PadPassed   INTEGER NOT NULL,
+      PadTotal    INTEGER NOT NULL,   -- số log có PadPassed
+      SimCount    INTEGER NOT NULL,
+      SimSum      REAL NOT NULL,
+      SimHist     BLOB NOT NULL,      -- int64 little-endian / bin
+      DurHist     BLOB NOT NULL,
+      PRIMARY KEY (Grain, BucketStart, Purpose)
+    );
+
+    -- high-water mark của rollup nằm cùng DB với AuthLogs (cùng transaction)
+    CREATE TABLE IF NOT EXISTS Meta(
+      Key         TEXT PRIMARY KEY,
+      Value       TEXT
+    );
+
+    -- Nonce của challenge ký (services/nonce_ledger) đã dùng, giữ tới khi token hết hạn
+    CREATE TABLE IF NOT EXISTS ConsumedNonces(
+      Nonce       TEXT PRIMARY KEY,
+      ExpiresAt   INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS IX_ConsumedNonces_ExpiresAt ON ConsumedNonces(ExpiresAt);
+
+    -- Token bucket dùng chung giữa các worker (services/rate_limit, RATE_LIMIT_BACKEND=sqlite).
+    -- FullAt: lúc bucket tự đầy lại -> từ đó dòng không còn mang state, xóa được.
+    CREATE TABLE IF NOT EXISTS RateBuckets(
+      Key         TEXT PRIMARY KEY,
+      Tokens      REAL NOT NULL,
+      UpdatedAt   REAL NOT NULL,
+      FullAt      REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS IX_RateBuckets_FullAt ON RateBuckets(FullAt);
+"""
+
+
 def init_db():
     schema = """
     PRAGMA journal_mode=WAL;
@@ -75,7 +200,7 @@ def init_db():
       Vector       BLOB NOT NULL,
       Dim          INTEGER NOT NULL,
       ModelVersion TEXT NOT NULL,
-      L2Norm       REAL NOT NULL,
+      L2Norm       REAL NOT NULL,   -- norm trước chuẩn hóa (Vector lưu unit-norm)
       CreatedAt    INTEGER NOT NULL
     );
 
@@ -85,24 +210,81 @@ def init_db():
       Vector       BLOB NOT NULL,
       Dim          INTEGER NOT NULL,
       ModelVersion TEXT NOT NULL,
-      L2Norm       REAL NOT NULL,
+      L2Norm       REAL NOT NULL,   -- norm trước chuẩn hóa (Vector lưu unit-norm)
       CreatedAt    INTEGER NOT NULL,
       PRIMARY KEY (UserId, Pose)
     );
 
-    CREATE TABLE IF NOT EXISTS AuthLogs(
-      LogId       INTEGER PRIMARY KEY AUTOINCREMENT,
-      UserId      INTEGER REFERENCES Users(UserId) ON DELETE SET NULL,
-      Similarity  REAL,
-      Decision    TEXT NOT NULL CHECK (Decision IN ('ALLOW','STEP_UP','DENY','ENROLL')),
-      PadResult   TEXT,
-      Purpose     TEXT,   -- LOGIN / PAYMENT / ENROLL
-      Ip          TEXT,
-      DeviceInfo  TEXT,
-      Geo         TEXT,
+    -- Template bổ sung theo pose (adaptation), 1 ma trận / user / model
+    CREATE TABLE IF NOT EXISTS PoseTemplates(
+      UserId       INTEGER NOT NULL REFERENCES Users(UserId) ON DELETE CASCADE,
+      ModelVersion TEXT NOT NULL,
+      Dim          INTEGER NOT NULL,
+      Poses        TEXT NOT NULL,   -- pose của từng dòng, vd. 'front,left,front'
+      Matrix       BLOB NOT NULL,   -- N bản ghi codec nối liền (queries.encode_matrix)
+      UpdatedAt    INTEGER NOT NULL,
+      PRIMARY KEY (UserId, ModelVersion)
+    );
+
+    -- Key/value trạng thái hệ thống (ActiveModelVersion, MigratingModelVersion, ...)
+    CREATE TABLE IF NOT EXISTS Meta(
+      Key         TEXT PRIMARY KEY,
+      Value       TEXT
+    );
+
+    -- Ảnh mặt đã align 112x112 lúc enroll, mã hóa AES-GCM (opt-in, xem services/crop_store)
+    CREATE TABLE IF NOT EXISTS EnrollmentCrops(
+      UserId      INTEGER NOT NULL REFERENCES Users(UserId) ON DELETE CASCADE,
+      Pose        TEXT NOT NULL CHECK (Pose IN ('front','left','right')),
+      Blob        BLOB NOT NULL,
+      CreatedAt   INTEGER NOT NULL,
+      PRIMARY KEY (UserId, Pose)
+    );
+
+    -- Embedding tính lại bằng model mới, chờ switch (Pose='mean' cho UserEmbeddings)
+    CREATE TABLE IF NOT EXISTS EmbeddingsStaging(
+      UserId       INTEGER NOT NULL REFERENCES Users(UserId) ON DELETE CASCADE,
+      Pose         TEXT NOT NULL CHECK (Pose IN ('front','left','right','mean')),
+      ModelVersion TEXT NOT NULL,
+      Vector       BLOB NOT NULL,
+      Dim          INTEGER NOT NULL,
+      L2Norm       REAL NOT NULL,   -- norm trước chuẩn hóa (Vector lưu unit-norm)
+      CreatedAt    INTEGER NOT NULL,
+      PRIMARY KEY (ModelVersion, UserId, Pose)
+    );
+
+    -- Nhật ký invalidation cho cache xác thực (services/auth_cache).
+    -- UserId/Email NULL cả hai = flush toàn bộ.
+    CREATE TABLE IF NOT EXISTS CacheInvalidations(
+      Seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+      UserId      INTEGER,
+      Email       TEXT,
       At          INTEGER NOT NULL
     );
 
+    -- Token đã thu hồi (services/revocation). Seq tăng dần để worker đồng bộ tăng dần;
+    -- dòng hết hạn được prune (token hết hạn đã bị verify từ chối).
+    CREATE TABLE IF NOT EXISTS RevokedTokens(
+      Seq         INTEGER PRIMARY KEY AUTOINCREMENT,
+      Jti         TEXT NOT NULL UNIQUE,
+      ExpiresAt   INTEGER NOT NULL,
+      RevokedAt   INTEGER NOT NULL,
+      Reason      TEXT
+    );
+    CREATE INDEX IF NOT EXISTS IX_RevokedTokens_ExpiresAt ON RevokedTokens(ExpiresAt);
+
+    -- Cặp tài khoản cùng khuôn mặt (services/dedup lúc đăng ký, tools/dedup_faces theo lô).
+    -- UserId là tài khoản mới hơn; Source = 'register' | 'batch'.
+    CREATE TABLE IF NOT EXISTS FaceDuplicates(
+      UserId       INTEGER NOT NULL REFERENCES Users(UserId) ON DELETE CASCADE,
+      MatchUserId  INTEGER NOT NULL REFERENCES Users(UserId) ON DELETE CASCADE,
+      Similarity   REAL NOT NULL,
+      Source       TEXT NOT NULL,
+      CreatedAt    INTEGER NOT NULL,
+      PRIMARY KEY (UserId, MatchUserId)
+    );
+    CREATE INDEX IF NOT EXISTS IX_FaceDuplicates_Match ON FaceDuplicates(MatchUserId);
+
     CREATE TABLE IF NOT EXISTS OtpChallenges(
       OtpId       TEXT PRIMARY KEY,
       UserId      INTEGER NOT NULL REFERENCES Users(UserId) ON DELETE CASCADE,
@@ -115,6 +297,13 @@ def init_db():
     """
     with get_conn() as conn:
         conn.executescript(schema)
-        _ensure_authlogs_columns(conn)
         _ensure_users_columns(conn)
+
+    # Bảng audit: cùng file (mặc định) hoặc file riêng. Khác file thì không có FK sang Users.
+    user_fk = "" if audit_is_separate() else " REFERENCES Users(UserId) ON DELETE SET NULL"
+    with get_audit_conn() as conn:
+        conn.executescript(AUDIT_SCHEMA.replace("{user_fk}", user_fk))
+        _ensure_authlogs_columns(conn)
     print(f"[DB] Using database at: {DB_PATH}")
+    if audit_is_separate():
+        print(f"[DB] Using audit database at: {AUDIT_DB_PATH}")
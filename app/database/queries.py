@@ -3,9 +3,12 @@ import os
 import hmac
 import base64
 import hashlib
+import struct
+from typing import Dict, Iterable, List, Sequence, Tuple
+
 import numpy as np
 
-from .db import get_conn
+from .db import get_audit_conn, get_conn, get_read_conn
 
 
 # ---------- PASSWORD UTILS ----------
@@ -42,6 +45,294 @@ def _verify_password(password: str, salt_b64: str, hash_b64: str) -> bool:
     )
     return hmac.compare_digest(dk, expected)
 
+# ---------- EMBEDDING CODEC ----------
+#
+# BLOB Vector = [1 byte codec][payload], little-endian:
+#   CODEC_F32: float32 x Dim                    (1 + 4*Dim bytes)
+#   CODEC_F16: float16 x Dim                    (1 + 2*Dim bytes)
+#   CODEC_I8 : float32 scale + int8 x Dim       (5 + Dim bytes), v ~= q * scale
+# BLOB không có header, dài đúng 4*Dim bytes = định dạng cũ (float32 thô).
+#
+# Sai số cosine so với float32 (vector đã L2-normalize, Dim=D):
+#   f16: |Δcos| <= 2 * 2^-11 ~ 1e-3   (thực tế ~1e-4)
+#   i8 : |Δcos| <= 2 * sqrt(D) * max|v| / 254; SFace-128 (max|v| ~ 0.3) -> <= 0.03,
+#        thực tế ~1e-3. tools/migrate_embeddings.py in ra sai số đo được.
+
+CODEC_F32 = 1
+CODEC_F16 = 2
+CODEC_I8 = 3
+
+CODECS = {"f32": CODEC_F32, "f16": CODEC_F16, "i8": CODEC_I8}
+
+# Codec dùng khi ghi embedding mới
+EMBEDDING_CODEC = os.environ.get("EMBEDDING_CODEC", "f16")
+
+
+def _codec_id(codec: str | int | None) -> int:
+    if codec is None:
+        codec = EMBEDDING_CODEC
+    if isinstance(codec, int):
+        return codec
+    if codec not in CODECS:
+        raise ValueError(f"UnknownEmbeddingCodec:{codec}")
+    return CODECS[codec]
+
+
+def _blob_size(codec: int, dim: int) -> int:
+    if codec == CODEC_F32:
+        return 1 + 4 * dim
+    if codec == CODEC_F16:
+        return 1 + 2 * dim
+    if codec == CODEC_I8:
+        return 5 + dim
+    raise ValueError(f"UnknownEmbeddingCodec:{codec}")
+
+
+def encode_vector(vec: np.ndarray, codec: str | int | None = None) -> bytes:
+    """
+    Mã hóa vector float -> BLOB có header codec.
+    """
+    cid = _codec_id(codec)
+    v = np.asarray(vec, dtype=np.float32).reshape(-1)
+    if cid == CODEC_F32:
+        return bytes([cid]) + v.astype("<f4", copy=False).tobytes()
+    if cid == CODEC_F16:
+        return bytes([cid]) + v.astype("<f2").tobytes()
+    amax = float(np.max(np.abs(v))) if v.size else 0.0
+    scale = amax / 127.0 if amax > 0 else 1.0
+    q = np.clip(np.rint(v / scale), -127, 127).astype(np.int8)
+    return bytes([cid]) + struct.pack("<f", scale) + q.tobytes()
+
+
+def blob_codec(blob: bytes, dim: int) -> int | None:
+    """
+    Codec của BLOB, None nếu là float32 thô định dạng cũ.
+    """
+    n = len(blob)
+    if n and blob[0] in (CODEC_F32, CODEC_F16, CODEC_I8) and n == _blob_size(blob[0], dim):
+        return blob[0]
+    return None
+
+
+def decode_vector(blob: bytes, dim: int) -> np.ndarray:
+    """
+    BLOB -> vector float32 (Dim,). float32 (mới/cũ) trả view zero-copy.
+    """
+    cid = blob_codec(blob, dim)
+    if cid is None:
+        arr = np.frombuffer(blob, dtype="<f4")
+        if dim <= 0 or dim > arr.size:
+            dim = arr.size
+        return arr[:dim]
+    if cid == CODEC_F32:
+        return np.frombuffer(blob, dtype="<f4", count=dim, offset=1)
+    if cid == CODEC_F16:
+        return np.frombuffer(blob, dtype="<f2", count=dim, offset=1).astype(np.float32)
+    (scale,) = struct.unpack_from("<f", blob, 1)
+    return np.frombuffer(blob, dtype=np.int8, count=dim, offset=5).astype(np.float32) * np.float32(scale)
+
+
+def _decode_records(buf: bytes, n: int, cid: int, dim: int) -> np.ndarray:
+    """
+    n bản ghi cùng codec nối liền trong buf -> (n, Dim) float32 (view có stride, không lặp).
+    """
+    stride = _blob_size(cid, dim)
+    if cid == CODEC_F32:
+        return np.ndarray((n, dim), dtype="<f4", buffer=buf, offset=1, strides=(stride, 4))
+    if cid == CODEC_F16:
+        return np.ndarray((n, dim), dtype="<f2", buffer=buf, offset=1, strides=(stride, 2)).astype(np.float32)
+    scales = np.ndarray((n,), dtype="<f4", buffer=buf, offset=1, strides=(stride,))
+    q = np.ndarray((n, dim), dtype=np.int8, buffer=buf, offset=5, strides=(stride, 1))
+    return q.astype(np.float32) * scales[:, None]
+
+
+def decode_vectors(blobs: Sequence[bytes], dim: int) -> np.ndarray:
+    """
+    Decode hàng loạt -> ma trận (N, Dim) float32, vector hóa theo nhóm codec
+    (join 1 lần rồi đọc bằng view có stride, không lặp Python theo phần tử).
+    """
+    out = np.empty((len(blobs), dim), dtype=np.float32)
+    groups: dict = {}
+    for i, b in enumerate(blobs):
+        groups.setdefault(blob_codec(b, dim), []).append(i)
+
+    for cid, idx in groups.items():
+        buf = b"".join(blobs[i] for i in idx)
+        n = len(idx)
+        if cid is None:
+            if len(buf) != n * 4 * dim:
+                # Dim không khớp độ dài BLOB cũ -> fallback từng dòng
+                for i in idx:
+                    v = decode_vector(blobs[i], dim)
+                    out[i, :v.size] = v
+                    out[i, v.size:] = 0.0
+                continue
+            out[idx] = np.frombuffer(buf, dtype="<f4").reshape(n, dim)
+            continue
+        out[idx] = _decode_records(buf, n, cid, dim)
+    return out
+
+
+def encode_matrix(mat: np.ndarray, codec: str | int | None = None) -> bytes:
+    """
+    Ma trận (N, Dim) -> N bản ghi codec nối liền (cùng codec).
+    """
+    cid = _codec_id(codec)
+    return b"".join(encode_vector(row, cid) for row in np.asarray(mat, dtype=np.float32).reshape(len(mat), -1))
+
+
+def decode_matrix(blob: bytes, dim: int) -> np.ndarray:
+    """
+    Ngược lại encode_matrix -> (N, Dim) float32.
+    """
+    if not blob:
+        return np.empty((0, dim), dtype=np.float32)
+    cid = blob[0]
+    size = _blob_size(cid, dim)
+    if len(blob) % size:
+        raise ValueError(f"BadEmbeddingMatrix:{len(blob)}")
+    return _decode_records(blob, len(blob) // size, cid, dim)
+
+
+# ---------- CACHE INVALIDATION (services/auth_cache) ----------
+# Mỗi lần ghi Users/embedding/template -> 1 dòng CacheInvalidations trong cùng transaction.
+# Seq tăng dần là "version counter": worker khác đọc các dòng Seq > seq đã thấy để evict.
+
+_INVALIDATION_HOOKS: List = []
+_INVALIDATION_KEEP = 100_000   # số dòng giữ lại; worker tụt quá xa thì flush toàn bộ cache
+
+
+def on_invalidate(fn) -> None:
+    """
+    Đăng ký callback fn(user_ids, emails, everything) để evict cache trong process ngay sau commit.
+    """
+    _INVALIDATION_HOOKS.append(fn)
+
+
+def _log_invalidation(c, user_ids: Iterable[int] = (), emails: Iterable[str] = (), everything: bool = False):
+    now = int(time.time())
+    if everything:
+        rows = [(None, None, now)]
+    else:
+        rows = [(int(u), None, now) for u in user_ids] + [(None, e, now) for e in emails if e]
+    if not rows:
+        return
+    c.executemany("INSERT INTO CacheInvalidations(UserId, Email, At) VALUES (?, ?, ?)", rows)
+    c.execute(
+        "DELETE FROM CacheInvalidations WHERE Seq <= (SELECT MAX(Seq) FROM CacheInvalidations) - ?",
+        (_INVALIDATION_KEEP,),
+    )
+
+
+def _notify(user_ids: Iterable[int] = (), emails: Iterable[str] = (), everything: bool = False):
+    for fn in _INVALIDATION_HOOKS:
+        fn(list(user_ids), list(emails), everything)
+
+
+def get_invalidations(after_seq: int, limit: int):
+    """
+    Các dòng CacheInvalidations có Seq > after_seq (tăng dần).
+    """
+    with get_read_conn() as c:
+        return c.execute(
+            "SELECT Seq, UserId, Email FROM CacheInvalidations WHERE Seq > ? ORDER BY Seq LIMIT ?",
+            (after_seq, limit),
+        ).fetchall()
+
+
+def last_invalidation_seq() -> int:
+    with get_read_conn() as c:
+        row = c.execute("SELECT MAX(Seq) AS s FROM CacheInvalidations").fetchone()
+        return int(row["s"] or 0)
+
+
+# ---------- CHALLENGE NONCES (services/nonce_ledger) ----------
+
+def consume_nonce(nonce: str, expires_at: int) -> bool:
+    """
+    Đánh dấu nonce đã dùng. True nếu đây là lần đầu (atomic giữa các worker).
+    """
+    with get_audit_conn() as c:
+        cur = c.execute(
+            "INSERT OR IGNORE INTO ConsumedNonces(Nonce, ExpiresAt) VALUES (?, ?)",
+            (nonce, int(expires_at)),
+        )
+        return cur.rowcount == 1
+
+
+def nonce_consumed(nonce: str) -> bool:
+    with get_audit_conn() as c:
+        return c.execute("SELECT 1 FROM ConsumedNonces WHERE Nonce=?", (nonce,)).fetchone() is not None
+
+
+def prune_nonces(now: int) -> int:
+    with get_audit_conn() as c:
+        return c.execute("DELETE FROM ConsumedNonces WHERE ExpiresAt < ?", (int(now),)).rowcount
+
+
+# ---------- RATE LIMIT (services/rate_limit) ----------
+
+def take_rate_tokens(rules, now: float):
+    """
+    rules: [(key, capacity, rate/s)]. Trừ 1 token ở mọi bucket trong 1 transaction, hoặc không
+    trừ gì nếu có bucket rỗng. Trả None nếu cho qua, ngược lại (key, số giây chờ).
+    """
+    with get_audit_conn() as c:
+        c.execute("BEGIN IMMEDIATE")
+        updates = []
+        for key, capacity, rate in rules:
+            row = c.execute("SELECT Tokens, UpdatedAt FROM RateBuckets WHERE Key=?", (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row["Tokens"] + (now - row["UpdatedAt"]) * rate)
+            if tokens < 1.0:
+                c.rollback()
+                return key, (1.0 - tokens) / rate
+            tokens -= 1.0
+            updates.append((key, tokens, now, now + (capacity - tokens) / rate))
+        c.executemany(
+            """
+            INSERT INTO RateBuckets(Key, Tokens, UpdatedAt, FullAt) VALUES (?, ?, ?, ?)
+            ON CONFLICT(Key) DO UPDATE SET
+              Tokens=excluded.Tokens, UpdatedAt=excluded.UpdatedAt, FullAt=excluded.FullAt
+            """,
+            updates,
+        )
+        return None
+
+
+def prune_rate_buckets(now: float) -> int:
+    with get_audit_conn() as c:
+        return c.execute("DELETE FROM RateBuckets WHERE FullAt <= ?", (now,)).rowcount
+
+
+# ---------- REVOKED TOKENS (services/revocation) ----------
+
+def revoke_token(jti: str, expires_at: int, reason: str | None = None) -> bool:
+    """
+    Thu hồi token theo jti. False nếu đã thu hồi trước đó.
+    """
+    with get_conn() as c:
+        cur = c.execute(
+            "INSERT OR IGNORE INTO RevokedTokens(Jti, ExpiresAt, RevokedAt, Reason) VALUES (?, ?, ?, ?)",
+            (jti, int(expires_at), int(time.time()), reason),
+        )
+        return cur.rowcount == 1
+
+
+def get_revocations(after_seq: int, now: int, limit: int):
+    """
+    Các token thu hồi còn hạn có Seq > after_seq (tăng dần).
+    """
+    with get_read_conn() as c:
+        return c.execute(
+            "SELECT Seq, Jti, ExpiresAt FROM RevokedTokens WHERE Seq > ? AND ExpiresAt >= ? ORDER BY Seq LIMIT ?",
+            (after_seq, int(now), limit),
+        ).fetchall()
+
+
+def prune_revocations(now: int) -> int:
+    with get_conn() as c:
+        return c.execute("DELETE FROM RevokedTokens WHERE ExpiresAt < ?", (int(now),)).rowcount
+
 
 # ---------- USERS / EMBEDDINGS ----------
 
@@ -63,11 +354,13 @@ def create_user(phone=None, email=None, password: str | None = None) -> int:
             """,
             (phone, email, now, now, pw_hash, pw_salt),
         )
-        return cur.lastrowid
+        _log_invalidation(c, emails=[email])
+    _notify(emails=[email])
+    return cur.lastrowid
 
 
 def get_user_by_email(email: str):
-    with get_conn() as c:
+    with get_read_conn() as c:
         return c.execute("SELECT * FROM Users WHERE Email=?", (email,)).fetchone()
 
 
@@ -87,11 +380,20 @@ def authenticate_user(email: str, password: str):
     return None
 
 
+def _unit(vec) -> Tuple[np.ndarray, float]:
+    """
+    Vector lưu DB luôn unit-norm (services/scoring chấm điểm bằng tích vô hướng).
+    Trả về (vector đã chuẩn hóa, norm gốc) - L2Norm giữ norm trước chuẩn hóa.
+    """
+    v = np.asarray(vec, dtype=np.float32).reshape(-1)
+    l2 = float(np.linalg.norm(v) + 1e-9)
+    return v / l2, l2
+
+
 def save_embedding(user_id: int, vec: np.ndarray, model_version="sface-128"):
     now = int(time.time())
-    v = np.asarray(vec, dtype=np.float32).reshape(-1)
+    v, l2 = _unit(vec)
     dim = int(v.size)
-    l2 = float(np.linalg.norm(v) + 1e-9)
     with get_conn() as c:
         c.execute(
             """
@@ -102,15 +404,16 @@ def save_embedding(user_id: int, vec: np.ndarray, model_version="sface-128"):
           ModelVersion=excluded.ModelVersion, L2Norm=excluded.L2Norm,
           CreatedAt=excluded.CreatedAt;
         """,
-            (user_id, v.tobytes(), dim, model_version, l2, now),
+            (user_id, encode_vector(v), dim, model_version, l2, now),
         )
+        _log_invalidation(c, user_ids=[user_id])
+    _notify(user_ids=[user_id])
 
 
 def save_pose_embedding(user_id: int, pose: str, vec: np.ndarray, model_version="sface-128"):
     now = int(time.time())
-    v = np.asarray(vec, dtype=np.float32).reshape(-1)
+    v, l2 = _unit(vec)
     dim = int(v.size)
-    l2 = float(np.linalg.norm(v) + 1e-9)
     with get_conn() as c:
         c.execute(
             """
@@ -121,41 +424,384 @@ def save_pose_embedding(user_id: int, pose: str, vec: np.ndarray, model_version=
           ModelVersion=excluded.ModelVersion, L2Norm=excluded.L2Norm,
           CreatedAt=excluded.CreatedAt;
         """,
-            (user_id, pose, v.tobytes(), dim, model_version, l2, now),
+            (user_id, pose, encode_vector(v), dim, model_version, l2, now),
         )
+        _log_invalidation(c, user_ids=[user_id])
+    _notify(user_ids=[user_id])
 
 
 def get_embedding(user_id: int):
-    with get_conn() as c:
+    with get_read_conn() as c:
         row = c.execute("SELECT Vector, Dim FROM UserEmbeddings WHERE UserId=?", (user_id,)).fetchone()
         if not row:
             return None
-        buf = row["Vector"]
-        dim = int(row["Dim"] or 0)
-        arr = np.frombuffer(buf, dtype=np.float32)
-        if dim <= 0 or dim > arr.size:
-            dim = arr.size
-        return arr[:dim].astype(np.float32, copy=False).reshape(-1)
+        return decode_vector(row["Vector"], int(row["Dim"] or 0))
 
 
 def get_pose_embeddings(user_id: int):
-    with get_conn() as c:
+    with get_read_conn() as c:
         rows = c.execute("SELECT Pose, Vector, Dim FROM PoseEmbeddings WHERE UserId=?", (user_id,)).fetchall()
         out = {}
         for r in rows:
-            buf = r["Vector"]
-            dim = int(r["Dim"] or 0)
-            arr = np.frombuffer(buf, dtype=np.float32)
-            if dim <= 0 or dim > arr.size:
-                dim = arr.size
-            out[r["Pose"]] = arr[:dim].astype(np.float32, copy=False).reshape(-1)
+            out[r["Pose"]] = decode_vector(r["Vector"], int(r["Dim"] or 0))
         return out
 
 
+# ---------- META ----------
+
+def get_meta(key: str, default: str | None = None) -> str | None:
+    with get_read_conn() as c:
+        row = c.execute("SELECT Value FROM Meta WHERE Key=?", (key,)).fetchone()
+        return row["Value"] if row and row["Value"] is not None else default
+
+
+def set_meta(key: str, value: str | None, conn=None):
+    """
+    Ghi Meta; truyền conn để ghi chung transaction với thao tác khác.
+    """
+    sql = "INSERT INTO Meta(Key, Value) VALUES (?, ?) ON CONFLICT(Key) DO UPDATE SET Value=excluded.Value"
+    if conn is not None:
+        conn.execute(sql, (key, value))
+        return
+    with get_conn() as c:
+        c.execute(sql, (key, value))
+
+
+# ---------- MODEL VERSION / RE-EMBEDDING ----------
+
+def get_active_model_version(default: str) -> str:
+    return get_meta("ActiveModelVersion", default)
+
+
+def get_migrating_model_version() -> str | None:
+    return get_meta("MigratingModelVersion")
+
+
+_STAGED_UPSERT = """
+    INSERT INTO EmbeddingsStaging(UserId, Pose, ModelVersion, Vector, Dim, L2Norm, CreatedAt)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(ModelVersion, UserId, Pose) DO UPDATE SET
+      Vector=excluded.Vector, Dim=excluded.Dim,
+      L2Norm=excluded.L2Norm, CreatedAt=excluded.CreatedAt;
+"""
+
+
+def save_staged_embeddings(rows: Iterable[Tuple[int, str, str, np.ndarray]]):
+    """
+    Ghi nhiều embedding (user_id, pose, model_version, vec) vào EmbeddingsStaging
+    trong 1 transaction. pose='mean' cho vector tổng hợp.
+    """
+    now = int(time.time())
+    params = []
+    for user_id, pose, version, vec in rows:
+        v, l2 = _unit(vec)
+        params.append((user_id, pose, version, encode_vector(v), int(v.size), l2, now))
+    if not params:
+        return
+    with get_conn() as c:
+        c.executemany(_STAGED_UPSERT, params)
+        user_ids = sorted({p[0] for p in params})
+        _log_invalidation(c, user_ids=user_ids)
+    _notify(user_ids=user_ids)
+
+
+def get_pose_embedding_sets(user_id: int) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    {model_version: {pose: vec}}: bản đang dùng (PoseEmbeddings) đứng trước,
+    sau đó là các version đang staging (đang migrate).
+    """
+    out: Dict[str, Dict[str, np.ndarray]] = {}
+    with get_read_conn() as c:
+        rows = c.execute(
+            "SELECT Pose, Vector, Dim, ModelVersion FROM PoseEmbeddings WHERE UserId=?", (user_id,)
+        ).fetchall()
+        staged = c.execute(
+            "SELECT Pose, Vector, Dim, ModelVersion FROM EmbeddingsStaging WHERE UserId=? AND Pose!='mean'",
+            (user_id,),
+        ).fetchall()
+    for r in list(rows) + list(staged):
+        out.setdefault(r["ModelVersion"], {}).setdefault(r["Pose"], decode_vector(r["Vector"], int(r["Dim"] or 0)))
+    return out
+
+
+def list_reembed_candidates(model_version: str, after_user_id: int, limit: int) -> List[int]:
+    """
+    UserId (tăng dần, > after_user_id) có đủ 3 crop nhưng chưa có đủ embedding staging
+    cho model_version. Dùng để job re-embed chạy tiếp được sau khi dừng.
+    """
+    with get_conn() as c:
+        rows = c.execute(
+            """
+            SELECT ec.UserId AS UserId
+            FROM EnrollmentCrops ec
+            WHERE ec.UserId > ?
+            GROUP BY ec.UserId
+            HAVING COUNT(*) = 3
+               AND (SELECT COUNT(*) FROM EmbeddingsStaging s
+                    WHERE s.ModelVersion = ? AND s.UserId = ec.UserId) < 4
+            ORDER BY ec.UserId
+            LIMIT ?
+            """,
+            (after_user_id, model_version, limit),
+        ).fetchall()
+        return [int(r["UserId"]) for r in rows]
+
+
+def count_users_without_crops() -> int:
+    with get_conn() as c:
+        row = c.execute(
+            """
+            SELECT COUNT(*) AS n FROM UserEmbeddings ue
+            WHERE (SELECT COUNT(*) FROM EnrollmentCrops ec WHERE ec.UserId = ue.UserId) < 3
+            """
+        ).fetchone()
+        return int(row["n"])
+
+
+def switch_model_version(model_version: str) -> Dict[str, int]:
+    """
+    Chuyển toàn bộ embedding staging của model_version sang PoseEmbeddings/UserEmbeddings
+    và đặt ActiveModelVersion trong CÙNG 1 transaction (atomic với mọi worker).
+    """
+    with get_conn() as c:
+        c.execute("BEGIN IMMEDIATE")
+        pose = c.execute(
+            """
+            INSERT INTO PoseEmbeddings(UserId, Pose, Vector, Dim, ModelVersion, L2Norm, CreatedAt)
+            SELECT UserId, Pose, Vector, Dim, ModelVersion, L2Norm, CreatedAt
+            FROM EmbeddingsStaging WHERE ModelVersion = ? AND Pose != 'mean'
+            ON CONFLICT(UserId, Pose) DO UPDATE SET
+              Vector=excluded.Vector, Dim=excluded.Dim,
+              ModelVersion=excluded.ModelVersion, L2Norm=excluded.L2Norm,
+              CreatedAt=excluded.CreatedAt;
+            """,
+            (model_version,),
+        ).rowcount
+        mean = c.execute(
+            """
+            INSERT INTO UserEmbeddings(UserId, Vector, Dim, ModelVersion, L2Norm, CreatedAt)
+            SELECT UserId, Vector, Dim, ModelVersion, L2Norm, CreatedAt
+            FROM EmbeddingsStaging WHERE ModelVersion = ? AND Pose = 'mean'
+            ON CONFLICT(UserId) DO UPDATE SET
+              Vector=excluded.Vector, Dim=excluded.Dim,
+              ModelVersion=excluded.ModelVersion, L2Norm=excluded.L2Norm,
+              CreatedAt=excluded.CreatedAt;
+            """,
+            (model_version,),
+        ).rowcount
+        c.execute("DELETE FROM EmbeddingsStaging WHERE ModelVersion = ?", (model_version,))
+        set_meta("ActiveModelVersion", model_version, conn=c)
+        set_meta("MigratingModelVersion", None, conn=c)
+        _log_invalidation(c, everything=True)
+    _notify(everything=True)
+    return {"pose_rows": pose, "user_rows": mean}
+
+
+# ---------- MULTI-TEMPLATE GALLERY ----------
+
+def get_pose_templates(user_id: int, model_version: str) -> Tuple[np.ndarray, List[str]] | None:
+    """
+    Template bổ sung (ngoài template enroll trong PoseEmbeddings): (ma trận (N, Dim), pose từng dòng).
+    """
+    with get_read_conn() as c:
+        row = c.execute(
+            "SELECT Dim, Poses, Matrix FROM PoseTemplates WHERE UserId=? AND ModelVersion=?",
+            (user_id, model_version),
+        ).fetchone()
+    if not row or not row["Poses"]:
+        return None
+    return decode_matrix(row["Matrix"], int(row["Dim"])), row["Poses"].split(",")
+
+
+def save_pose_templates(user_id: int, model_version: str, mat: np.ndarray, poses: List[str]):
+    now = int(time.time())
+    mat = np.asarray(mat, dtype=np.float32)
+    mat = mat / (np.linalg.norm(mat, axis=1, keepdims=True) + 1e-9)
+    with get_conn() as c:
+        c.execute(
+            """
+        INSERT INTO PoseTemplates(UserId, ModelVersion, Dim, Poses, Matrix, UpdatedAt)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(UserId, ModelVersion) DO UPDATE SET
+          Dim=excluded.Dim, Poses=excluded.Poses,
+          Matrix=excluded.Matrix, UpdatedAt=excluded.UpdatedAt;
+        """,
+            (user_id, model_version, int(mat.shape[1]), ",".join(poses), encode_matrix(mat), now),
+        )
+        _log_invalidation(c, user_ids=[user_id])
+    _notify(user_ids=[user_id])
+
+
+# ---------- FACE DEDUP (services/dedup, tools/dedup_faces) ----------
+
+def count_user_embeddings(model_version: str) -> int:
+    with get_read_conn() as c:
+        row = c.execute("SELECT COUNT(*) AS n FROM UserEmbeddings WHERE ModelVersion=?", (model_version,)).fetchone()
+        return int(row["n"])
+
+
+def get_user_embeddings_page(model_version: str, after_user_id: int, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vector tổng hợp (UserEmbeddings) của model_version có UserId > after_user_id, tăng dần theo UserId
+    -> (ids (n,) int64, ma trận (n, Dim) float32 unit-norm). Duyệt theo PK, đọc từng trang được.
+    """
+    with get_read_conn() as c:
+        rows = c.execute(
+            "SELECT UserId, Vector, Dim FROM UserEmbeddings WHERE UserId > ? AND ModelVersion = ? ORDER BY UserId LIMIT ?",
+            (after_user_id, model_version, limit),
+        ).fetchall()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+    ids = np.fromiter((r["UserId"] for r in rows), dtype=np.int64, count=len(rows))
+    return ids, decode_vectors([r["Vector"] for r in rows], int(rows[0]["Dim"] or 0))
+
+
+_FACE_DUP_UPSERT = """
+    INSERT INTO FaceDuplicates(UserId, MatchUserId, Similarity, Source, CreatedAt)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(UserId, MatchUserId) DO UPDATE SET Similarity=excluded.Similarity
+"""
+
+
+def _face_dup_rows(pairs: Iterable[Tuple[int, int, float]], source: str, now: int) -> list:
+    return [(max(int(a), int(b)), min(int(a), int(b)), float(s), source, now) for a, b, s in pairs]
+
+
+def save_face_duplicates(pairs: Iterable[Tuple[int, int, float]], source: str) -> int:
+    """
+    Ghi các cặp (user mới hơn, user trùng mặt, similarity); cặp đã có thì cập nhật similarity.
+    """
+    rows = _face_dup_rows(pairs, source, int(time.time()))
+    with get_conn() as c:
+        c.executemany(_FACE_DUP_UPSERT, rows)
+    return len(rows)
+
+
+def get_user_emails(user_ids: Sequence[int]) -> Dict[int, str]:
+    out: Dict[int, str] = {}
+    ids = [int(u) for u in user_ids]
+    with get_read_conn() as c:
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            rows = c.execute(
+                f"SELECT UserId, Email FROM Users WHERE UserId IN ({','.join('?' * len(part))})", part
+            ).fetchall()
+            out.update((int(r["UserId"]), r["Email"]) for r in rows)
+    return out
+
+
+# ---------- ENROLLMENT CROPS (đã mã hóa, xem services/crop_store) ----------
+
+def save_crop_blob(user_id: int, pose: str, blob: bytes):
+    now = int(time.time())
+    with get_conn() as c:
+        c.execute(
+            """
+        INSERT INTO EnrollmentCrops(UserId, Pose, Blob, CreatedAt) VALUES (?, ?, ?, ?)
+        ON CONFLICT(UserId, Pose) DO UPDATE SET Blob=excluded.Blob, CreatedAt=excluded.CreatedAt;
+        """,
+            (user_id, pose, blob, now),
+        )
+
+
+def get_crop_blobs(user_ids: Sequence[int]) -> Dict[int, Dict[str, bytes]]:
+    out: Dict[int, Dict[str, bytes]] = {}
+    if not user_ids:
+        return out
+    marks = ",".join("?" * len(user_ids))
+    with get_read_conn() as c:
+        rows = c.execute(
+            f"SELECT UserId, Pose, Blob FROM EnrollmentCrops WHERE UserId IN ({marks})", tuple(user_ids)
+        ).fetchall()
+    for r in rows:
+        out.setdefault(int(r["UserId"]), {})[r["Pose"]] = bytes(r["Blob"])
+    return out
+
+
+# ---------- BULK ENROLL (tools/bulk_enroll) ----------
+
+def bulk_enroll_users(
+    records: Sequence[dict],
+    model_version: str,
+    checkpoint: Tuple[str, str] | None = None,
+    encrypt_crop=None,
+) -> List[int]:
+    """
+    Ghi nhiều user đã xử lý sẵn trong 1 transaction: Users + PoseEmbeddings + UserEmbeddings
+    (+ EmbeddingsStaging của model đang migrate, + EnrollmentCrops nếu có encrypt_crop,
+    + FaceDuplicates Source='bulk') + log ENROLL + checkpoint (Meta) cùng commit.
+
+    record: {phone, email, pw_salt, pw_hash, vecs: {pose: vec}, mean: vec, crops: {pose: png} | None,
+             staged: [(pose, model_version, vec)] | None,
+             dup_users: [(user_id, sim)] | None, dup_records: [(vị trí record trong records, sim)] | None}
+    encrypt_crop(user_id, pose, png) -> BLOB.
+    """
+    now = int(time.time())
+    user_ids: List[int] = []
+    poses, means, staged, crops, logs = [], [], [], [], []
+    with get_conn() as c:
+        for r in records:
+            cur = c.execute(
+                """
+                INSERT INTO Users(Phone,Email,Status,CreatedAt,UpdatedAt,PasswordHash,PasswordSalt)
+                VALUES (?,?, 'ACTIVE', ?, ?, ?, ?)
+                """,
+                (r.get("phone"), r.get("email"), now, now, r.get("pw_hash"), r.get("pw_salt")),
+            )
+            uid = cur.lastrowid
+            user_ids.append(uid)
+            for pose, vec in r["vecs"].items():
+                v, l2 = _unit(vec)
+                poses.append((uid, pose, encode_vector(v), int(v.size), model_version, l2, now))
+            m, l2 = _unit(r["mean"])
+            means.append((uid, encode_vector(m), int(m.size), model_version, l2, now))
+            for pose, version, vec in r.get("staged") or ():
+                v, l2 = _unit(vec)
+                staged.append((uid, pose, version, encode_vector(v), int(v.size), l2, now))
+            if encrypt_crop is not None and r.get("crops"):
+                for pose, png in r["crops"].items():
+                    crops.append((uid, pose, encrypt_crop(uid, pose, png), now))
+            logs.append((uid, "ENROLL", "PASS", "ENROLL", now))
+
+        c.executemany(
+            """
+            INSERT INTO PoseEmbeddings(UserId, Pose, Vector, Dim, ModelVersion, L2Norm, CreatedAt)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            poses,
+        )
+        c.executemany(
+            """
+            INSERT INTO UserEmbeddings(UserId, Vector, Dim, ModelVersion, L2Norm, CreatedAt)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            means,
+        )
+        if staged:
+            c.executemany(_STAGED_UPSERT, staged)
+        dups = [(uid, m, s) for uid, r in zip(user_ids, records) for m, s in r.get("dup_users") or ()]
+        dups += [(uid, user_ids[j], s) for uid, r in zip(user_ids, records) for j, s in r.get("dup_records") or ()]
+        if dups:
+            c.executemany(_FACE_DUP_UPSERT, _face_dup_rows(dups, "bulk", now))
+        if crops:
+            c.executemany("INSERT INTO EnrollmentCrops(UserId, Pose, Blob, CreatedAt) VALUES (?, ?, ?, ?)", crops)
+        if checkpoint is not None:
+            set_meta(checkpoint[0], checkpoint[1], conn=c)
+        _log_invalidation(c, emails=[r.get("email") for r in records])
+    _notify(emails=[r.get("email") for r in records])
+    # Log ENROLL ghi vào DB audit sau khi dữ liệu gallery đã commit
+    with get_audit_conn() as c:
+        c.executemany(
+            "INSERT INTO AuthLogs(UserId, Decision, PadResult, Purpose, At) VALUES (?, ?, ?, ?, ?)",
+            logs,
+        )
+    return user_ids
+
+
 # ---- Logging: chèn theo cột đang tồn tại để không bao giờ vỡ INSERT ----
 
 def _existing_authlog_columns():
-    with get_conn() as c:
+    with get_audit_conn() as c:
         return [r["name"] for r in c.execute("PRAGMA table_info(AuthLogs);")]
 
 
@@ -175,6 +821,7 @@ def add_log(
     is_bona=None,
     attack_type=None,
     duration_ms=None,
+    match_user_id=None,
 ):
     cols = _existing_authlog_columns()
     fields = ["UserId", "Similarity", "Decision", "PadResult", "Purpose", "Ip", "DeviceInfo", "Geo", "At"]
@@ -188,6 +835,7 @@ def add_log(
         "IsBonaFide": is_bona,
         "AttackType": attack_type,
         "DurationMs": duration_ms,
+        "MatchUserId": match_user_id,
     }
     for k, v in extra_map.items():
         if k in cols:
@@ -196,5 +844,5 @@ def add_log(
             values.insert(idx, v)
 
     sql = f"INSERT INTO AuthLogs ({', '.join(fields)}) VALUES ({', '.join(['?'] * len(fields))})"
-    with get_conn() as c:
+    with get_audit_conn() as c:
         c.execute(sql, tuple(values))
@@ -1,18 +1,39 @@
-from fastapi import FastAPI
+import math
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 
 from .database.db import init_db
 from .routes.enroll import router as enroll_router
 from .routes.verify import router as verify_router
 from .routes.metrics import router as metrics_router
+from .routes.tokens import router as tokens_router
+from .routes.profiles import router as profiles_router
+from .services import profiler
 from .services.pad_model import init_pad_model
 from .services.face_embedding import init_face_models
+from .services.rate_limit import RateLimited
 
 app = FastAPI(title="Biometric Auth AI")
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 app.include_router(enroll_router)
 app.include_router(verify_router)
 app.include_router(metrics_router)
+app.include_router(tokens_router)
+app.include_router(profiles_router)
+
+if profiler.ENABLED:
+    app.middleware("http")(profiler.middleware)
+
+
+@app.exception_handler(RateLimited)
+def _rate_limited(request: Request, exc: RateLimited):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(math.ceil(exc.rejection.retry_after))},
+    )
 
 
 @app.on_event("startup")
@@ -1,12 +1,23 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, File, Form, Request, UploadFile
 from pydantic import BaseModel, Field
-from typing import Dict
+from typing import Dict, Union
 import numpy as np
 import logging
 
+from ..services import crop_store, dedup, frame_quality, rate_limit
 from ..services.pad_model import predict_prob_live
-from ..services.face_embedding import extract
-from ..database.queries import create_user, save_embedding, save_pose_embedding, add_log
+from ..services.risk_engine import pose_thresholds
+from ..services.face_embedding import MODEL_VERSION, available_versions, extract_versions, locate
+from ..database.queries import (
+    create_user,
+    save_embedding,
+    save_pose_embedding,
+    save_staged_embeddings,
+    save_crop_blob,
+    get_active_model_version,
+    get_migrating_model_version,
+    add_log,
+)
 
 router = APIRouter()
 log = logging.getLogger("enroll")
@@ -19,35 +30,88 @@ class EnrollMultiReq(BaseModel):
     phone: str | None = None
 
 
-POSE_THRESHOLDS = {"front": 0.50, "left": 0.25, "right": 0.25}
+# Ảnh: chuỗi base64 (JSON API) hoặc bytes JPEG thô (multipart)
+Image = Union[str, bytes]
 
 
 @router.post("/auth/register")
-def register(req: EnrollMultiReq):
+def register(req: EnrollMultiReq, request: Request):
+    ip = request.client.host if request.client else None
+    rate_limit.enforce("ENROLL", ip=ip, email=req.email)
     required = {"front", "left", "right"}
     if not required.issubset(set(req.images.keys())):
         raise HTTPException(
             status_code=400,
             detail=f"ImagesMustContain:{sorted(required)}"
         )
+    return _register(req.images, req.email, req.password, req.phone, ip)
+
+
+@router.post("/auth/register/multipart")
+def register_multipart(
+    request: Request,
+    front: UploadFile = File(...),
+    left: UploadFile = File(...),
+    right: UploadFile = File(...),
+    email: str = Form(...),
+    password: str = Form(...),
+    phone: str | None = Form(None),
+):
+    """
+    Giống /auth/register nhưng nhận JPEG thô qua multipart/form-data
+    (không base64, không parse JSON lớn). Bytes được đưa thẳng vào cv2.imdecode.
+    """
+    ip = request.client.host if request.client else None
+    rate_limit.enforce("ENROLL", ip=ip, email=email)
+    images = {
+        "front": front.file.read(),
+        "left": left.file.read(),
+        "right": right.file.read(),
+    }
+    return _register(images, email, password, phone, ip)
+
+
+def liveness_decision(pad_scores: Dict[str, float]) -> tuple[Dict[str, bool], bool]:
+    """
+    Luật PAD lúc enroll: pass theo ngưỡng từng pose (risk_engine, nạp lại được),
+    cần front pass và >= 2 pose pass.
+    """
+    thresholds = pose_thresholds()
+    passes = {pose: bool(p >= thresholds[pose]) for pose, p in pad_scores.items()}
+    return passes, bool(sum(passes.values()) >= 2 and passes.get("front", False))
 
+
+def _register(images: Dict[str, Image], email: str, password: str, phone: str | None, ip: str | None = None):
     # Validation đơn giản phía backend (frontend đã check trước)
-    if not req.email or not req.password:
+    if not email or not password:
         raise HTTPException(status_code=400, detail="EmailAndPasswordRequired")
-    if len(req.password) < 6:
+    if len(password) < 6:
         # Đề phòng trường hợp frontend bị skip, đảm bảo không tạo account với pass quá ngắn
         raise HTTPException(status_code=400, detail="PasswordTooShort")
 
-    # ----- PAD theo từng pose: yêu cầu front pass và tổng >= 2 pose pass -----
-    pad_scores: Dict[str, float] = {}
-    pad_passes: Dict[str, bool] = {}
-
+    # ----- Decode/detect 1 lần / pose + gate chất lượng trước khi chạy model -----
+    frames = {}
     for pose in ("front", "left", "right"):
-        p = float(predict_prob_live(req.images[pose]))
-        pad_scores[pose] = p
-        pad_passes[pose] = bool(p >= POSE_THRESHOLDS[pose])
+        try:
+            frames[pose] = locate(images[pose])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"{str(e)}:{pose}")
+        q = frame_quality.assess(frames[pose], pose)
+        if q.reason == "NoFaceDetected":
+            raise HTTPException(status_code=400, detail=f"NoFaceDetected:{pose}")
+        if not q.ok:
+            raise HTTPException(
+                status_code=400,
+                detail={"error": "LowQualityFrame", "reason": q.reason, "pose": pose, "metrics": q.metrics},
+            )
 
-    if sum(pad_passes.values()) < 2 or not pad_passes["front"]:
+    # ----- PAD theo từng pose: yêu cầu front pass và tổng >= 2 pose pass -----
+    pad_scores: Dict[str, float] = {
+        pose: float(predict_prob_live(images[pose], frames[pose])) for pose in ("front", "left", "right")
+    }
+    pad_passes, live = liveness_decision(pad_scores)
+
+    if not live:
         # Thất bại liveness → trả thông tin chi tiết cho UI
         raise HTTPException(
             status_code=400,
@@ -59,44 +123,92 @@ def register(req: EnrollMultiReq):
             },
         )
 
+    # Model đang active + model đang migrate (nếu có) để user mới không bị job re-embed bỏ sót
+    version = get_active_model_version(MODEL_VERSION)
+    if version not in available_versions():
+        raise HTTPException(status_code=503, detail=f"ModelVersionUnavailable:{version}")
+    versions = [version]
+    migrating = get_migrating_model_version()
+    if migrating and migrating != version and migrating in available_versions():
+        versions.append(migrating)
+
+    # ----- Trích embedding cho từng pose (trước khi tạo user: lỗi/trùng mặt không để lại tài khoản rỗng) -----
+    vecs: Dict[str, Dict[str, np.ndarray]] = {v: {} for v in versions}
+    crops: Dict[str, np.ndarray] = {}
+    for pose in ("front", "left", "right"):
+        try:
+            feats, crops[pose] = extract_versions(images[pose], versions, frames[pose])
+        except ValueError as e:
+            # Nói rõ pose nào lỗi cho UI
+            raise HTTPException(
+                status_code=400,
+                detail=f"{str(e)}:{pose}",
+            )
+        for v, feat in feats.items():
+            vecs[v][pose] = np.asarray(feat, dtype=np.float32).reshape(-1)
+
+    # Vector “tổng hợp” 3 pose
+    means = {
+        v: np.mean(np.stack([p["front"], p["left"], p["right"]], axis=0), axis=0)
+        for v, p in vecs.items()
+    }
+
+    # ----- Khuôn mặt đã đăng ký dưới tài khoản khác (services/dedup) -----
+    duplicates = []
+    if dedup.enabled():
+        try:
+            duplicates = dedup.find(means[version], version)
+        except Exception as e:
+            log.warning(f"dedup check failed (non-blocking): {e}")
+    if duplicates and dedup.ACTION == "reject":
+        # Không có tài khoản mới để gắn log; không ghi dưới UserId của tài khoản bị trùng
+        try:
+            add_log(None, duplicates[0][1], "DENY", "PASS", purpose="ENROLL",
+                    ip=ip, attack_type="duplicate_face", match_user_id=duplicates[0][0])
+        except Exception as e:
+            log.warning(f"add_log failed (non-blocking): {e}")
+        raise HTTPException(status_code=409, detail="DuplicateFace")
+
     # ----- Tạo user & lưu embedding (có email + password) -----
     try:
         # create_user() phải nhận thêm password (đã hash bên trong)
         user_id = create_user(
-            phone=req.phone,
-            email=req.email,
-            password=req.password,
+            phone=phone,
+            email=email,
+            password=password,
         )
     except Exception as e:
         # Ví dụ sau này thêm UNIQUE(email) mà bị trùng, sẽ rơi vào đây
         log.error(f"CreateUserFailed: {e}")
         raise HTTPException(status_code=400, detail="CreateUserFailed")
 
-    # ----- Trích embedding cho từng pose -----
-    vecs: Dict[str, np.ndarray] = {}
     for pose in ("front", "left", "right"):
-        try:
-            vec = extract(req.images[pose])
-        except ValueError as e:
-            # Nói rõ pose nào lỗi cho UI
-            raise HTTPException(
-                status_code=400,
-                detail=f"{str(e)}:{pose}",
-            )
-        arr = np.asarray(vec, dtype=np.float32).reshape(-1)
-        vecs[pose] = arr
-        save_pose_embedding(user_id, pose, arr, "sface-128")
-
-    # Vector “tổng hợp” 3 pose
-    mean_vec = np.mean(
-        np.stack([vecs["front"], vecs["left"], vecs["right"]], axis=0),
-        axis=0,
-    )
-    save_embedding(user_id, mean_vec, "sface-128")
+        save_pose_embedding(user_id, pose, vecs[version][pose], version)
+        if crop_store.enabled():
+            save_crop_blob(user_id, pose, crop_store.encrypt_crop(user_id, pose, crops[pose]))
+    save_embedding(user_id, means[version], version)
+
+    if len(versions) > 1:
+        save_staged_embeddings(
+            (user_id, pose, v, vec)
+            for v in versions[1:]
+            for pose, vec in list(vecs[v].items()) + [("mean", means[v])]
+        )
 
-    # Ghi log ENROLL (non-blocking)
+    # Ghi log ENROLL + cặp trùng mặt (non-blocking)
     try:
-        add_log(user_id, None, "ENROLL", "PASS", purpose="ENROLL")
+        if duplicates:
+            dedup.record(user_id, duplicates)
+        add_log(
+            user_id,
+            duplicates[0][1] if duplicates else None,
+            "ENROLL",
+            "PASS",
+            purpose="ENROLL",
+            ip=ip,
+            attack_type="duplicate_face" if duplicates else None,
+            match_user_id=duplicates[0][0] if duplicates else None,
+        )
     except Exception as e:
         log.warning(f"add_log failed (non-blocking): {e}")
 
@@ -1,6 +1,8 @@
 # app/routes/metrics.py
-from fastapi import APIRouter, Query
-from ..database.db import get_conn
+import os
+
+from fastapi import APIRouter, HTTPException, Query
+from ..services import auth_cache, log_archive, metrics_rollup, proc_stats, rate_limit
 
 router = APIRouter()
 
@@ -10,28 +12,45 @@ def export_metrics(t0: int | None = Query(None), t1: int | None = Query(None)):
     Trả về các bản ghi cần cho đánh giá:
     Similarity (sim_min), IsBonaFide, PadProbMin, PadPassed, Decision, Purpose, AttackType, DurationMs, At
     Có thể truyền t0,t1 (epoch seconds) để lọc theo thời gian.
+    Gồm cả log đã archive (services/log_archive) lẫn log còn trong AuthLogs.
+    """
+    out = log_archive.export_items(t0, t1)
+    return {"count": len(out), "items": out}
+
+
+@router.get("/metrics/rollup")
+def rollup_metrics(window: str = Query("1h"), purpose: str | None = Query(None)):
+    """
+    Metrics theo cửa sổ 1h / 24h / 7d từ bảng rollup (cập nhật tăng dần trước khi đọc):
+    tỉ lệ Decision, PAD pass, histogram similarity/duration, chuỗi theo bucket và bất thường.
+    """
+    if window not in metrics_rollup.WINDOWS:
+        raise HTTPException(status_code=400, detail=f"UnknownWindow:{window}")
+    # Tối đa 1 batch / request: phần tồn đọng (sau deploy, lâu không gọi) do tools/archive_logs
+    # đuổi kịp, không giữ write lock của DB audit lâu trong request
+    metrics_rollup.update(max_batches=1)
+    return metrics_rollup.window(window, purpose=purpose)
+
+
+@router.get("/metrics/cache")
+def cache_metrics():
+    """
+    Hit ratio của cache xác thực (services/auth_cache) trong worker trả lời request này.
+    """
+    return auth_cache.stats()
+
+
+@router.get("/metrics/ratelimit")
+def ratelimit_metrics():
+    """
+    Giới hạn đang áp dụng, số bucket và số request bị chặn (services/rate_limit) của worker này.
+    """
+    return rate_limit.stats()
+
+
+@router.get("/metrics/memory")
+def memory_metrics():
+    """
+    RSS/PSS/private (MB) và số thread suy luận của worker trả lời request này (xem tools/serve).
     """
-    sql = """
-    SELECT Similarity, IsBonaFide, PadProbMin, PadPassed, Decision, Purpose, AttackType, DurationMs, At
-    FROM AuthLogs
-    """
-    args=[]
-    if t0 is not None and t1 is not None:
-        sql += " WHERE At BETWEEN ? AND ?"
-        args=[t0, t1]
-    with get_conn() as c:
-        rows = c.execute(sql, args).fetchall()
-        out=[]
-        for r in rows:
-            out.append({
-                "sim": r["Similarity"],
-                "bona": r["IsBonaFide"],
-                "pad_prob": r["PadProbMin"],
-                "pad_ok": r["PadPassed"],
-                "decision": r["Decision"],
-                "purpose": r["Purpose"],
-                "atk": r["AttackType"],
-                "dur_ms": r["DurationMs"],
-                "at": r["At"],
-            })
-        return {"count": len(out), "items": out}
+    return {"pid": os.getpid(), **proc_stats.memory(), **proc_stats.threads()}
@@ -0,0 +1,43 @@
+# app/routes/profiles.py
+import hmac
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import FileResponse
+
+from ..services import profiler
+
+router = APIRouter()
+
+
+def _require_token(token: str | None) -> None:
+    # Không cấu hình PROFILE_TOKEN -> endpoint coi như không tồn tại
+    if not profiler.TOKEN:
+        raise HTTPException(status_code=404, detail="ProfilingDisabled")
+    if not token or not hmac.compare_digest(token, profiler.TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+@router.get("/admin/profiles")
+def list_profiles(
+    min_ms: float = Query(0.0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    x_profile_token: str | None = Header(None),
+):
+    """
+    Profile đã lưu, mới nhất trước (stage_totals, số sample, file ORT đi kèm).
+    """
+    _require_token(x_profile_token)
+    return {"dir": profiler.DIR, "profiles": profiler.list_profiles(min_ms, limit)}
+
+
+@router.get("/admin/profiles/{profile_id}/{kind}")
+def get_profile(profile_id: str, kind: str, x_profile_token: str | None = Header(None)):
+    """
+    kind: summary (JSON đủ stage) | folded (flamegraph.pl / speedscope) | ort_pad (chrome://tracing).
+    """
+    _require_token(x_profile_token)
+    path = profiler.profile_file(profile_id, kind)
+    if path is None:
+        raise HTTPException(status_code=404, detail="ProfileNotFound")
+    media = "text/plain" if kind == "folded" else "application/json"
+    return FileResponse(path, media_type=media, filename=path.rsplit("/", 1)[-1])
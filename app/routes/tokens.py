@@ -0,0 +1,41 @@
+# app/routes/tokens.py
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+
+from ..services import revocation
+from ..services.jwt_token import verify
+
+router = APIRouter()
+
+
+class TokenReq(BaseModel):
+    token: str
+    reason: str | None = None
+
+
+@router.post("/auth/token/verify")
+def token_verify(req: TokenReq):
+    """
+    Cho các service downstream: verify chữ ký/hạn/thu hồi, trả claims.
+    """
+    try:
+        claims = verify(req.token)
+    except ValueError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    return {"valid": True, "claims": claims}
+
+
+@router.post("/auth/token/revoke")
+def token_revoke(req: TokenReq):
+    """
+    Thu hồi token (logout / nghi lộ token). Token phải còn hợp lệ; thu hồi lại lần 2 vẫn trả 200.
+    """
+    try:
+        claims = verify(req.token, check_revoked=False)
+    except ValueError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    jti = claims.get("jti")
+    if not jti:
+        raise HTTPException(status_code=400, detail="TokenHasNoJti")
+    fresh = revocation.revoke(jti, int(claims["exp"]), req.reason)
+    return {"revoked": jti, "already": not fresh}
@@ -1,23 +1,31 @@
-from fastapi import APIRouter, HTTPException, Request, Query
+from fastapi import APIRouter, HTTPException, Request, Query, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Dict, Optional
-import numpy as np, random, time, uuid
+from typing import List, Dict, Optional, Tuple, Union
+import asyncio, os
+import numpy as np, random, struct, time, uuid
 
+from ..services import auth_cache, frame_quality, nonce_ledger, profiler, rate_limit, templates
+from ..services.face_detect import FaceFrame
 from ..services.liveness_pad import liveness_ok
-from ..services.face_embedding import extract
+from ..services.face_embedding import available_versions, extract_versions, locate
 from ..services.risk_engine import decide
-from ..services.jwt_token import issue
+from ..services.stream_liveness import BUFFER as STREAM_BUFFER, TIMEOUT_S as STREAM_TIMEOUT_S, PoseStream
+from ..services.jwt_token import decode_challenge, issue, issue_challenge
 from ..database.queries import (
-    get_pose_embeddings,
+    save_pose_templates,
     add_log,
-    authenticate_user,   # <-- dùng để login bằng email/password
 )
 
 router = APIRouter()
 
 
-def _pad_check(image_b64: str) -> tuple[bool, float]:
-    res = liveness_ok(image_b64)
+# Ảnh: chuỗi base64 (JSON API) hoặc bytes/memoryview JPEG thô (multipart/binary)
+Image = Union[str, bytes, memoryview]
+
+
+def _pad_check(image_b64: Image, frame: FaceFrame | None = None) -> tuple[bool, float]:
+    res = liveness_ok(image_b64, frame)
     if isinstance(res, tuple):
         ok, prob = bool(res[0]), float(res[1])
     else:
@@ -25,21 +33,21 @@ def _pad_check(image_b64: str) -> tuple[bool, float]:
     return ok, prob
 
 
-def _to_vec128(x) -> np.ndarray:
-    v = np.asarray(x, dtype=np.float32).reshape(-1)
-    if v.size == 512:
-        raise HTTPException(status_code=409, detail="DimMismatch:512_vs_128_ReEnrollRequired")
-    if v.size != 128:
-        raise HTTPException(status_code=500, detail=f"UnexpectedDim:{v.size}")
-    return v
-
-
-def cosine(a, b) -> float:
-    a = np.asarray(a, dtype=np.float32).reshape(-1)
-    b = np.asarray(b, dtype=np.float32).reshape(-1)
-    if a.size != b.size:
-        raise HTTPException(status_code=409, detail=f"DimMismatch:{a.size}_vs_{b.size}")
-    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-9))
+def _enrolled_sets(user_id: int) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    {model_version: {pose: vec}} đủ 3 pose và có recognizer đang nạp.
+    Version đầu (PoseEmbeddings) dùng để quyết định; version đang migrate
+    (EmbeddingsStaging) được chấm điểm kèm.
+    """
+    required = {"front", "left", "right"}
+    complete = {v: p for v, p in auth_cache.get_pose_embedding_sets(user_id).items() if set(p) == required}
+    if not complete:
+        raise HTTPException(status_code=404, detail="UserNotEnrolled")
+    loaded = set(available_versions())
+    usable = {v: p for v, p in complete.items() if v in loaded}
+    if not usable:
+        raise HTTPException(status_code=409, detail=f"ModelVersionUnavailable:{next(iter(complete))}_ReEnrollRequired")
+    return usable
 
 
 class VerifyStartReq(BaseModel):
@@ -64,16 +72,55 @@ class VerifySubmitReq(BaseModel):
     frames: List[Dict[str, str]]  # [{pose, imageBase64}]
 
 
+# memory: challenge nằm trong CHALLENGES của process (submit phải về đúng worker);
+# signed: challengeId là token ký có hạn (jwt_token), nonce chống replay qua nonce_ledger
+CHALLENGE_MODE = os.environ.get("CHALLENGE_MODE", "memory")
+
 CHALLENGES: Dict[str, Dict] = {}
 
 
+def _get_challenge(challenge_id: str) -> Dict | None:
+    if CHALLENGE_MODE != "signed":
+        return CHALLENGES.get(challenge_id)
+    try:
+        claims = decode_challenge(challenge_id)
+    except ValueError:
+        return None
+    if nonce_ledger.consumed(claims["jti"]):
+        return None
+    return {
+        "userId": int(claims["sub"]),
+        "sequence": list(claims["seq"]),
+        "purpose": claims["pur"],
+        "ts": claims["iat"],
+        "nonce": claims["jti"],
+        "exp": claims["exp"],
+    }
+
+
+def _consume_challenge(challenge_id: str, ch: Dict) -> bool:
+    """
+    Dùng challenge đúng 1 lần: False nếu request khác đã dùng trước (replay / submit song song).
+    """
+    if CHALLENGE_MODE != "signed":
+        return CHALLENGES.pop(challenge_id, None) is not None
+    return nonce_ledger.consume(ch["nonce"], ch["exp"])
+
+
 @router.post("/auth/verify/start", response_model=VerifyStartResp)
-def verify_start(req: VerifyStartReq):
+def verify_start(req: VerifyStartReq, request: Request):
     """
     Khởi tạo challenge:
     - Nếu có userId: dùng trực tiếp (ví dụ hệ thống core đã xác định user).
     - Nếu không có userId: dùng email + password để xác định userId.
     """
+    # Giới hạn tần suất trước PBKDF2
+    rate_limit.enforce(
+        req.purpose,
+        ip=request.client.host if request.client else None,
+        user_id=req.userId,
+        email=req.email if req.userId is None else None,
+    )
     # Resolve user_id
     if req.userId is not None:
         user_id = req.userId
@@ -81,20 +128,23 @@ def verify_start(req: VerifyStartReq):
         # Bắt buộc phải có email + password
         if not req.email or not req.password:
             raise HTTPException(status_code=400, detail="MissingCredentials")
-        user_id = authenticate_user(req.email, req.password)
+        user_id = auth_cache.authenticate_user(req.email, req.password)
         if not user_id:
             # Cho UI biết là sai tài khoản hoặc mật khẩu
             raise HTTPException(status_code=401, detail="InvalidCredentials")
 
     poses = ["front", "left", "right"]
     random.shuffle(poses)
-    cid = uuid.uuid4().hex
-    CHALLENGES[cid] = {
-        "userId": user_id,
-        "sequence": poses,
-        "purpose": req.purpose,
-        "ts": time.time(),
-    }
+    if CHALLENGE_MODE == "signed":
+        cid = issue_challenge(user_id, poses, req.purpose)
+    else:
+        cid = uuid.uuid4().hex
+        CHALLENGES[cid] = {
+            "userId": user_id,
+            "sequence": poses,
+            "purpose": req.purpose,
+            "ts": time.time(),
+        }
 
     # 👇 Trả luôn userId cho frontend
     return VerifyStartResp(
@@ -112,61 +162,221 @@ def verify_submit(
     gt: str | None = Query(None, description="lab only: 'bona' or 'spoof'"),
     atk: str | None = Query(None, description="lab only: 'print'|'replay'|'mask'|..."),
 ):
-    t0 = time.perf_counter()
+    frames = [(f.get("pose"), f.get("imageBase64", "")) for f in req.frames]
+    return _submit(req.challengeId, frames, request, gt, atk)
+
+
+@router.post("/auth/verify/submit/multipart")
+async def verify_submit_multipart(
+    request: Request,
+    gt: str | None = Query(None, description="lab only: 'bona' or 'spoof'"),
+    atk: str | None = Query(None, description="lab only: 'print'|'replay'|'mask'|..."),
+):
+    """
+    multipart/form-data: field 'challengeId' + mỗi frame là 1 file JPEG,
+    tên field = pose, gửi theo đúng thứ tự sequence.
+    """
+    form = await request.form()
+    challenge_id = form.get("challengeId")
+    if not isinstance(challenge_id, str):
+        raise HTTPException(status_code=400, detail="InvalidChallenge")
+    frames = []
+    for name, value in form.multi_items():
+        if isinstance(value, str):
+            continue
+        frames.append((name, await value.read()))
+    return await run_in_threadpool(_submit, challenge_id, frames, request, gt, atk)
+
 
-    ch = CHALLENGES.get(req.challengeId)
+@router.post("/auth/verify/submit/binary")
+async def verify_submit_binary(
+    request: Request,
+    challengeId: str = Query(...),
+    gt: str | None = Query(None, description="lab only: 'bona' or 'spoof'"),
+    atk: str | None = Query(None, description="lab only: 'print'|'replay'|'mask'|..."),
+):
+    """
+    application/octet-stream: các frame nối tiếp theo thứ tự sequence,
+    mỗi frame = [uint32 big-endian độ dài][JPEG bytes].
+    Frame được cắt bằng memoryview (zero-copy) rồi đưa thẳng vào cv2.imdecode.
+    Challenge + rate limit kiểm tra trước khi đọc body.
+    """
+    ch = await run_in_threadpool(_admit, challengeId, request)
+    body = await request.body()
+    images = _split_frames(body)
+    if len(images) != len(ch["sequence"]):
+        raise HTTPException(status_code=400, detail="FramesNotMatchSequence")
+    frames = list(zip(ch["sequence"], images))
+    return await run_in_threadpool(_submit, challengeId, frames, request, gt, atk, ch)
+
+
+def _split_frames(body: bytes) -> List[memoryview]:
+    """
+    Tách body length-prefixed thành list memoryview (không copy).
+    """
+    mv = memoryview(body)
+    out: List[memoryview] = []
+    i = 0
+    while i < len(mv):
+        if i + 4 > len(mv):
+            raise HTTPException(status_code=400, detail="BadBinaryBody")
+        (n,) = struct.unpack(">I", mv[i:i + 4])
+        i += 4
+        if n == 0 or i + n > len(mv):
+            raise HTTPException(status_code=400, detail="BadBinaryBody")
+        out.append(mv[i:i + n])
+        i += n
+    return out
+
+
+def _admit(challenge_id: str, request: Request) -> Dict:
+    """
+    Giải challenge + áp rate limit (1 lần / request). Không hợp lệ -> 400 InvalidChallenge.
+    """
+    ch = _get_challenge(challenge_id)
     if not ch:
         raise HTTPException(status_code=400, detail="InvalidChallenge")
+    rate_limit.enforce(ch["purpose"], ip=request.client.host if request.client else None, user_id=ch["userId"])
+    return ch
+
+
+def _submit(
+    challenge_id: str,
+    frames: List[Tuple[Optional[str], Image]],
+    request: Request,
+    gt: str | None,
+    atk: str | None,
+    ch: Dict | None = None,
+):
+    """
+    ch: challenge đã qua _admit (endpoint binary); None -> _admit tại đây.
+    """
+    t0 = time.perf_counter()
+
+    if ch is None:
+        ch = _admit(challenge_id, request)
     user_id = ch["userId"]
     seq = ch["sequence"]
     purpose = ch["purpose"]
 
-    enrolled_raw = get_pose_embeddings(user_id)
-    if set(enrolled_raw.keys()) != {"front", "left", "right"}:
-        raise HTTPException(status_code=404, detail="UserNotEnrolled")
-    enrolled = {k: _to_vec128(v) for k, v in enrolled_raw.items()}
+    with profiler.stage("gallery"):
+        enrolled = _enrolled_sets(user_id)
+    versions = list(enrolled)
+    model_version = versions[0]
 
-    if len(req.frames) != len(seq):
+    if len(frames) != len(seq):
         raise HTTPException(status_code=400, detail="FramesNotMatchSequence")
 
-    sims: List[float] = []
+    probes_by_version: Dict[str, List[np.ndarray]] = {v: [] for v in versions}
     pad_probs: List[float] = []
     pad_flags: List[bool] = []
 
-    for expected, frame in zip(seq, req.frames):
-        if frame.get("pose") != expected:
+    # 0) Decode/detect mỗi frame 1 lần + gate chất lượng: frame hỏng bị trả về trước khi
+    #    chạy PAD/SFace, challenge giữ nguyên để client chụp lại ngay
+    located: List[FaceFrame] = []
+    for expected, (pose, img) in zip(seq, frames):
+        if pose != expected:
             raise HTTPException(status_code=400, detail=f"WrongPoseOrder:{expected}")
+        try:
+            with profiler.stage("locate"):
+                frame = locate(img)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        with profiler.stage("quality"):
+            q = frame_quality.assess(frame, expected)
+        if not q.ok:
+            # Trả về 400 rõ ràng cho UI, đồng thời log forensics nhẹ
+            no_face = q.reason == "NoFaceDetected"
+            try:
+                add_log(
+                    user_id,
+                    None,
+                    "DENY",
+                    "FAIL",
+                    purpose,
+                    ip=(request.client.host if request.client else None),
+                    attack_type="no_face" if no_face else "low_quality",
+                    duration_ms=int((time.perf_counter() - t0) * 1000),
+                )
+            except Exception:
+                pass
+            if no_face:
+                raise HTTPException(status_code=400, detail="NoFaceDetected")
+            raise HTTPException(
+                status_code=400,
+                detail={"error": "LowQualityFrame", "reason": q.reason, "pose": expected, "metrics": q.metrics},
+            )
+        located.append(frame)
 
-        img = frame.get("imageBase64", "")
-
+    for (pose, img), frame in zip(frames, located):
         # 1) PAD
-        pad_ok, p_live = _pad_check(img)
+        with profiler.stage("pad"):
+            pad_ok, p_live = _pad_check(img, frame)
         pad_probs.append(float(p_live))
         pad_flags.append(bool(pad_ok))
 
         # 2) Embedding
         try:
-            probe = extract(img)
+            with profiler.stage("embed"):
+                probes, _ = extract_versions(img, versions, frame)
         except ValueError as e:
-            if "NoFaceDetected" in str(e):
-                # Trả về 400 rõ ràng cho UI, đồng thời log forensics nhẹ
-                try:
-                    add_log(
-                        user_id,
-                        None,
-                        "DENY",
-                        "FAIL",
-                        purpose,
-                        ip=(request.client.host if request.client else None),
-                        attack_type="no_face",
-                        duration_ms=int((time.perf_counter() - t0) * 1000),
-                    )
-                except Exception:
-                    pass
-                raise HTTPException(status_code=400, detail="NoFaceDetected")
             raise HTTPException(status_code=400, detail=str(e))
 
-        sims.append(cosine(probe, enrolled[expected]))
+        for v in versions:
+            probes_by_version[v].append(np.asarray(probes[v], dtype=np.float32).reshape(-1))
+
+    ip = request.client.host if request.client else None
+    return _finish(challenge_id, ch, enrolled, probes_by_version, pad_probs, pad_flags, ip, gt, atk, t0)
+
+
+def _finish(
+    challenge_id: str,
+    ch: Dict,
+    enrolled: Dict[str, Dict[str, np.ndarray]],
+    probes_by_version: Dict[str, List[np.ndarray]],
+    pad_probs: List[float],
+    pad_flags: List[bool],
+    ip: str | None,
+    gt: str | None,
+    atk: str | None,
+    t0: float,
+    fields: Dict | None = None,
+    groups: List[int] | None = None,
+):
+    """
+    Chấm điểm + quyết định + log + adaptation, dùng chung cho submit ảnh tĩnh và stream.
+    fields: thêm vào response (vd. thống kê stream).
+    groups: vị trí trong sequence của từng probe khi 1 pose có nhiều probe (stream);
+    điểm của pose = min các probe của nó. None = đúng 1 probe / pose theo thứ tự sequence.
+    """
+    user_id = ch["userId"]
+    seq = ch["sequence"]
+    purpose = ch["purpose"]
+    model_version = next(iter(enrolled))
+    fields = fields or {}
+    if groups is None:
+        groups = list(range(len(seq)))
+    probe_poses = [seq[g] for g in groups]
+
+    # Chiếm challenge trước khi quyết định: frame bị gate trả về trước đó vẫn chụp lại được
+    if not _consume_challenge(challenge_id, ch):
+        raise HTTPException(status_code=400, detail="InvalidChallenge")
+
+    # 3) Chấm điểm: mỗi version 1 phép nhân ma trận probes x templates (enroll + bổ sung)
+    with profiler.stage("score"):
+        extra = auth_cache.get_pose_templates(user_id, model_version)
+        sims_by_version: Dict[str, List[float]] = {}
+        for v in enrolled:
+            probe_mat = np.stack(probes_by_version[v], axis=0)
+            tmpl, tmpl_poses = templates.gallery_matrix(enrolled[v], extra if v == model_version else None)
+            if probe_mat.shape[1] != tmpl.shape[1]:
+                raise HTTPException(status_code=409, detail=f"DimMismatch:{probe_mat.shape[1]}_vs_{tmpl.shape[1]}")
+            raw = templates.score(probe_mat, probe_poses, tmpl, tmpl_poses)
+            sims_by_version[v] = [
+                float(min(s for s, g in zip(raw, groups) if g == i)) for i in range(len(seq))
+            ]
+
+    sims = sims_by_version[model_version]
 
     sim_min = float(min(sims))
     pad_min = float(min(pad_probs))
@@ -184,25 +394,43 @@ def verify_submit(
     is_bona = None if gt is None else (1 if gt.lower() == "bona" else 0)
 
     try:
-        add_log(
-            user_id,
-            sim_min,
-            dec,
-            "PASS" if pad_passed else "FAIL",
-            purpose,
-            ip=(request.client.host if request.client else None),
-            pad_prob_min=pad_min,
-            pad_prob_max=pad_max,
-            pad_prob_avg=pad_avg,
-            pad_passed=pad_passed,
-            is_bona=is_bona,
-            attack_type=atk,
-            duration_ms=duration_ms,
-        )
+        with profiler.stage("log"):
+            add_log(
+                user_id,
+                sim_min,
+                dec,
+                "PASS" if pad_passed else "FAIL",
+                purpose,
+                ip=ip,
+                pad_prob_min=pad_min,
+                pad_prob_max=pad_max,
+                pad_prob_avg=pad_avg,
+                pad_passed=pad_passed,
+                is_bona=is_bona,
+                attack_type=atk,
+                duration_ms=duration_ms,
+            )
     except Exception as e:
         print(f"add_log failed (non-blocking): {e}")
 
-    CHALLENGES.pop(req.challengeId, None)
+    # Adaptation: chỉ với ALLOW tin cậy cao, không áp dụng cho traffic lab (gt)
+    if (
+        dec == "ALLOW"
+        and gt is None
+        and templates.ADAPTATION_ENABLED
+        and sim_min >= templates.ADAPT_MIN_SIM
+        and pad_min >= templates.ADAPT_MIN_PAD
+    ):
+        try:
+            with profiler.stage("adapt"):
+                # Mỗi pose chỉ thêm probe đầu tiên (stream: frame nét nhất đã pass PAD)
+                first = [groups.index(i) for i in range(len(seq))]
+                probe_mat = np.stack(probes_by_version[model_version])[first]
+                upd = templates.adapt(enrolled[model_version], extra, probe_mat, seq)
+            if upd is not None:
+                save_pose_templates(user_id, model_version, upd[0], upd[1])
+        except Exception as e:
+            print(f"template adaptation failed (non-blocking): {e}")
 
     if dec == "ALLOW":
         return {
@@ -211,10 +439,13 @@ def verify_submit(
             "userId": user_id,  # 👈 thêm userId cho frontend
             "similarity_min": sim_min,
             "similarities": sims,
+            "model_version": model_version,
+            "similarities_by_version": sims_by_version,
             "pad_prob_min": pad_min,
             "pad_prob_max": pad_max,
             "pad_prob_avg": pad_avg,
             "pad_probs": pad_probs,
+            **fields,
         }
     if dec == "STEP_UP":
         return {
@@ -223,10 +454,13 @@ def verify_submit(
             "userId": user_id,  # 👈 nếu muốn có luôn ở case STEP_UP
             "similarity_min": sim_min,
             "similarities": sims,
+            "model_version": model_version,
+            "similarities_by_version": sims_by_version,
             "pad_prob_min": pad_min,
             "pad_prob_max": pad_max,
             "pad_prob_avg": pad_avg,
             "pad_probs": pad_probs,
+            **fields,
         }
 
     # DENY
@@ -236,9 +470,208 @@ def verify_submit(
             "error": "VerifyFailed",
             "similarity_min": sim_min,
             "similarities": sims,
+            "model_version": model_version,
+            "similarities_by_version": sims_by_version,
             "pad_prob_min": pad_min,
             "pad_prob_max": pad_max,
             "pad_prob_avg": pad_avg,
             "pad_probs": pad_probs,
+            **fields,
         },
     )
+
+
+# ---------- Stream liveness (burst / WebSocket) ----------
+
+def _stream_finish(
+    challenge_id: str,
+    streams: List[PoseStream],
+    ip: str | None,
+    gt: str | None,
+    atk: str | None,
+    t0: float,
+    dropped: int = 0,
+):
+    """
+    Chốt các pose, embed các frame nét nhất đã pass PAD của mỗi pose rồi quyết định như _submit
+    (similarity của pose = min các frame). PAD mỗi pose = trung bình theo thời gian,
+    pass = quyết định của PoseStream.
+    """
+    ch = _get_challenge(challenge_id)
+    if not ch:
+        raise HTTPException(status_code=400, detail="InvalidChallenge")
+    enrolled = _enrolled_sets(ch["userId"])
+    versions = list(enrolled)
+    probes_by_version: Dict[str, List[np.ndarray]] = {v: [] for v in versions}
+    groups: List[int] = []
+    for i, ps in enumerate(streams):
+        ps.finish()
+        frames = ps.probe_frames()
+        if not frames:
+            raise HTTPException(
+                status_code=400,
+                detail={"error": "LowQualityStream", "pose": ps.pose, "rejected": ps.rejected},
+            )
+        for frame in frames:
+            try:
+                probes, _ = extract_versions(None, versions, frame)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            for v in versions:
+                probes_by_version[v].append(np.asarray(probes[v], dtype=np.float32).reshape(-1))
+            groups.append(i)
+
+    return _finish(
+        challenge_id,
+        ch,
+        enrolled,
+        probes_by_version,
+        [ps.pad_prob for ps in streams],
+        [ps.decision == "live" for ps in streams],
+        ip,
+        gt,
+        atk,
+        t0,
+        {"stream": {"poses": [ps.stats() for ps in streams], "dropped": dropped}},
+        groups,
+    )
+
+
+def _burst(challenge_id: str, bursts: Dict[str, List[bytes]], ip: str | None, gt: str | None, atk: str | None):
+    t0 = time.perf_counter()
+    ch = _get_challenge(challenge_id)
+    if not ch:
+        raise HTTPException(status_code=400, detail="InvalidChallenge")
+    rate_limit.enforce(ch["purpose"], ip=ip, user_id=ch["userId"])
+    if set(bursts) != set(ch["sequence"]):
+        raise HTTPException(status_code=400, detail="FramesNotMatchSequence")
+    streams = []
+    for pose in ch["sequence"]:
+        ps = PoseStream(pose)
+        for img in bursts[pose]:
+            if ps.feed(img) is not None:
+                break   # đủ tin cậy -> bỏ các frame còn lại của pose
+        streams.append(ps)
+    return _stream_finish(challenge_id, streams, ip, gt, atk, t0)
+
+
+@router.post("/auth/verify/submit/burst")
+async def verify_submit_burst(
+    request: Request,
+    gt: str | None = Query(None, description="lab only: 'bona' or 'spoof'"),
+    atk: str | None = Query(None, description="lab only: 'print'|'replay'|'mask'|..."),
+):
+    """
+    multipart/form-data: field 'challengeId' + một chuỗi frame JPEG cho mỗi pose
+    (tên field = pose, lặp lại theo thứ tự thời gian).
+    """
+    form = await request.form()
+    challenge_id = form.get("challengeId")
+    if not isinstance(challenge_id, str):
+        raise HTTPException(status_code=400, detail="InvalidChallenge")
+    bursts: Dict[str, List[bytes]] = {}
+    for name, value in form.multi_items():
+        if isinstance(value, str):
+            continue
+        bursts.setdefault(name, []).append(await value.read())
+    ip = request.client.host if request.client else None
+    return await run_in_threadpool(_burst, challenge_id, bursts, ip, gt, atk)
+
+
+@router.websocket("/auth/verify/stream")
+async def verify_stream(
+    ws: WebSocket,
+    challengeId: str = Query(...),
+    gt: str | None = Query(None),
+    atk: str | None = Query(None),
+):
+    """
+    Mỗi message binary = [1 byte: vị trí pose trong sequence][JPEG]; message chỉ có 1 byte
+    = hết frame của pose đó. Sau mỗi pose server gửi {"pose", "decision", "pad_prob", "next"},
+    cuối cùng {"status": 200, "result": ...} hoặc {"status": <mã lỗi>, "detail": ...} rồi đóng.
+    Frame chờ xử lý nằm trong hàng đợi STREAM_BUFFER, xử lý không kịp thì bỏ frame cũ nhất.
+    """
+    await ws.accept()
+    ch = _get_challenge(challengeId)
+    if not ch:
+        await ws.send_json({"status": 400, "detail": "InvalidChallenge"})
+        await ws.close(code=1008)
+        return
+    try:
+        rate_limit.enforce(ch["purpose"], ip=ws.client.host if ws.client else None, user_id=ch["userId"])
+    except rate_limit.RateLimited as e:
+        await ws.send_json({"status": 429, "detail": e.detail})
+        await ws.close(code=1008)
+        return
+    t0 = time.perf_counter()
+    seq = ch["sequence"]
+    streams = [PoseStream(p) for p in seq]
+    queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_BUFFER)
+    dropped = 0
+
+    def _put(item) -> None:
+        nonlocal dropped
+        if queue.full():
+            queue.get_nowait()
+            dropped += 1
+        queue.put_nowait(item)
+
+    async def _receive() -> None:
+        try:
+            while True:
+                msg = await ws.receive()
+                if msg["type"] == "websocket.disconnect":
+                    break
+                data = msg.get("bytes")
+                if data:
+                    _put((data[0], memoryview(data)[1:] if len(data) > 1 else None))
+        finally:
+            _put(None)
+
+    async def _announce(i: int) -> None:
+        ps = streams[i]
+        await ws.send_json({
+            "pose": ps.pose,
+            "decision": ps.decision,
+            "pad_prob": ps.pad_prob,
+            "next": seq[i + 1] if i + 1 < len(seq) else None,
+        })
+
+    reader = asyncio.create_task(_receive())
+    try:
+        i = 0
+        while i < len(seq):
+            try:
+                item = await asyncio.wait_for(queue.get(), STREAM_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                await ws.send_json({"status": 408, "detail": "StreamTimeout"})
+                await ws.close()
+                return
+            if item is None:
+                return   # client ngắt kết nối, challenge vẫn còn để thử lại
+            idx, data = item
+            if idx < i:
+                continue   # frame / "end" trễ của pose đã chốt
+            # "end" của pose hiện tại hoặc client đã chuyển pose -> chốt (cả các pose bị bỏ qua)
+            upto = min(idx + 1 if data is None else idx, len(seq))
+            while i < upto:
+                streams[i].finish()
+                await _announce(i)
+                i += 1
+            if data is None or i >= len(seq):
+                continue
+            if await run_in_threadpool(streams[i].feed, data) is not None:
+                await _announce(i)
+                i += 1
+
+        ip = ws.client.host if ws.client else None
+        try:
+            res = await run_in_threadpool(_stream_finish, challengeId, streams, ip, gt, atk, t0, dropped)
+            await ws.send_json({"status": 200, "result": res})
+        except HTTPException as e:
+            await ws.send_json({"status": e.status_code, "detail": e.detail})
+        await ws.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        reader.cancel()
@@ -0,0 +1,235 @@
+# app/services/auth_cache.py
+"""
+Cache nóng cho đăng nhập lặp lại: user theo email + embedding pose/template theo UserId.
+
+- 2 LRU có giới hạn (AUTH_CACHE_USERS, AUTH_CACHE_GALLERIES), dùng chung cho các thread của worker.
+- Vector lưu sẵn dạng đã L2-normalize, read-only.
+- Invalidation:
+  * trong process: queries gọi hook ngay sau commit (on_invalidate);
+  * giữa các worker: bảng CacheInvalidations (Seq tăng dần), mỗi worker đọc các dòng mới
+    tối đa mỗi AUTH_CACHE_SYNC_S giây -> dữ liệu cũ tồn tại tối đa ~AUTH_CACHE_SYNC_S giây.
+- Không cache kết quả "không tìm thấy".
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from ..database import queries
+from . import scoring
+
+ENABLED = os.environ.get("AUTH_CACHE", "1") == "1"
+USERS_CAPACITY = int(os.environ.get("AUTH_CACHE_USERS", "20000"))
+GALLERIES_CAPACITY = int(os.environ.get("AUTH_CACHE_GALLERIES", "20000"))
+SYNC_INTERVAL_S = float(os.environ.get("AUTH_CACHE_SYNC_S", "1.0"))
+_SYNC_BATCH = 1000
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return _MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else None,
+            "evictions": self.evictions,
+        }
+
+
+USERS = LRUCache(USERS_CAPACITY)          # email -> user dict
+GALLERIES = LRUCache(GALLERIES_CAPACITY)  # user_id -> {"sets": ..., "templates": {version: ...}}
+
+_sync_lock = threading.Lock()
+_seq = None          # Seq CacheInvalidations đã xử lý (None = chưa sync lần nào)
+_synced_at = 0.0
+_flushes = 0
+# Tăng mỗi lần evict: lần đọc DB nào chồng lên 1 invalidation thì không được put vào cache
+_generation = 0
+
+
+def _evict(user_ids: List[int], emails: List[str], everything: bool) -> None:
+    global _flushes, _generation
+    _generation += 1
+    if everything:
+        USERS.clear()
+        GALLERIES.clear()
+        _flushes += 1
+        return
+    for uid in user_ids:
+        GALLERIES.pop(int(uid))
+    for email in emails:
+        USERS.pop(email)
+
+
+queries.on_invalidate(_evict)
+
+
+def _sync() -> None:
+    """
+    Đọc invalidation của các worker khác (giới hạn tần suất).
+    """
+    global _seq, _synced_at
+    now = time.monotonic()
+    if _seq is not None and now - _synced_at < SYNC_INTERVAL_S:
+        return
+    if not _sync_lock.acquire(blocking=False):
+        return   # thread khác đang sync
+    try:
+        _synced_at = now
+        if _seq is None:
+            # cache đang rỗng: chỉ cần mốc hiện tại
+            _seq = queries.last_invalidation_seq()
+            return
+        while True:
+            rows = queries.get_invalidations(_seq, _SYNC_BATCH)
+            if not rows:
+                return
+            if int(rows[0]["Seq"]) != _seq + 1 or len(rows) == _SYNC_BATCH:
+                # hụt dòng (đã bị prune) hoặc quá nhiều thay đổi -> flush cho chắc
+                _evict([], [], True)
+                _seq = queries.last_invalidation_seq()
+                return
+            user_ids = [int(r["UserId"]) for r in rows if r["UserId"] is not None]
+            emails = [r["Email"] for r in rows if r["Email"] is not None]
+            everything = any(r["UserId"] is None and r["Email"] is None for r in rows)
+            _evict(user_ids, emails, everything)
+            _seq = int(rows[-1]["Seq"])
+    finally:
+        _sync_lock.release()
+
+
+def _readonly_unit(vec) -> np.ndarray:
+    v = scoring.ensure_unit(np.asarray(vec, dtype=np.float32).reshape(-1)).copy()
+    v.setflags(write=False)
+    return v
+
+
+# ---------- Users ----------
+
+def get_user_by_email(email: str) -> dict | None:
+    if not ENABLED:
+        row = queries.get_user_by_email(email)
+        return dict(row) if row else None
+    _sync()
+    user = USERS.get(email)
+    if user is not _MISSING:
+        return user
+    gen = _generation
+    row = queries.get_user_by_email(email)
+    if not row:
+        return None
+    user = dict(row)
+    if gen == _generation:
+        USERS.put(email, user)
+    return user
+
+
+def authenticate_user(email: str, password: str):
+    """
+    Như queries.authenticate_user nhưng lấy record Users từ cache.
+    """
+    user = get_user_by_email(email)
+    if not user:
+        return None
+    salt, pw_hash = user.get("PasswordSalt"), user.get("PasswordHash")
+    if not salt or not pw_hash:
+        return None
+    if queries._verify_password(password, salt, pw_hash):
+        return user["UserId"]
+    return None
+
+
+# ---------- Gallery ----------
+
+def _gallery(user_id: int) -> dict:
+    entry = GALLERIES.get(user_id)
+    if entry is _MISSING:
+        gen = _generation
+        sets = queries.get_pose_embedding_sets(user_id)
+        entry = {
+            "sets": {v: {p: _readonly_unit(x) for p, x in poses.items()} for v, poses in sets.items()},
+            "templates": {},
+        }
+        if sets and gen == _generation:
+            GALLERIES.put(user_id, entry)
+    return entry
+
+
+def get_pose_embedding_sets(user_id: int) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    {model_version: {pose: vec đã normalize}} (xem queries.get_pose_embedding_sets).
+    """
+    if not ENABLED:
+        return queries.get_pose_embedding_sets(user_id)
+    _sync()
+    return _gallery(int(user_id))["sets"]
+
+
+def get_pose_templates(user_id: int, model_version: str) -> Tuple[np.ndarray, List[str]] | None:
+    if not ENABLED:
+        return queries.get_pose_templates(user_id, model_version)
+    _sync()
+    entry = _gallery(int(user_id))
+    tmpl = entry["templates"].get(model_version, _MISSING)
+    if tmpl is _MISSING:
+        tmpl = queries.get_pose_templates(user_id, model_version)
+        if tmpl is not None:
+            mat = scoring.ensure_unit(tmpl[0]).copy()
+            mat.setflags(write=False)
+            tmpl = (mat, list(tmpl[1]))
+        entry["templates"][model_version] = tmpl
+    return tmpl
+
+
+def stats() -> dict:
+    return {
+        "enabled": ENABLED,
+        "pid": os.getpid(),
+        "users": USERS.stats(),
+        "galleries": GALLERIES.stats(),
+        "invalidation_seq": _seq,
+        "full_flushes": _flushes,
+    }
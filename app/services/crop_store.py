@@ -0,0 +1,70 @@
+# app/services/crop_store.py
+"""
+Lưu ảnh mặt đã align 112x112 lúc enroll (opt-in) để re-embed khi đổi model
+mà không bắt user enroll lại.
+
+- Bật khi có CROP_STORE_KEY (base64 của key AES 16/24/32 bytes).
+- Mỗi crop: PNG (lossless) -> AES-GCM, AAD = "userId:pose" để không tráo được giữa các dòng.
+- BLOB = nonce(12) + ciphertext|tag.
+"""
+from __future__ import annotations
+
+import base64
+import os
+
+import numpy as np
+import cv2
+
+_KEY_B64 = os.environ.get("CROP_STORE_KEY", "")
+_AEAD = None
+
+
+def enabled() -> bool:
+    return bool(_KEY_B64)
+
+
+def _aead():
+    """
+    Khởi tạo AESGCM 1 lần. Cần package 'cryptography' khi bật crop store.
+    """
+    global _AEAD
+    if _AEAD is None:
+        if not enabled():
+            raise RuntimeError("CropStoreDisabled")
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        _AEAD = AESGCM(base64.b64decode(_KEY_B64))
+    return _AEAD
+
+
+def _aad(user_id: int, pose: str) -> bytes:
+    return f"{int(user_id)}:{pose}".encode("utf-8")
+
+
+def encode_crop(aligned_bgr: np.ndarray) -> bytes:
+    """
+    Crop -> PNG bytes (phần tốn CPU, có thể làm trước khi biết userId).
+    """
+    ok, png = cv2.imencode(".png", aligned_bgr)
+    if not ok:
+        raise ValueError("CropEncodeFailed")
+    return png.tobytes()
+
+
+def encrypt_png(user_id: int, pose: str, png: bytes) -> bytes:
+    nonce = os.urandom(12)
+    return nonce + _aead().encrypt(nonce, png, _aad(user_id, pose))
+
+
+def encrypt_crop(user_id: int, pose: str, aligned_bgr: np.ndarray) -> bytes:
+    return encrypt_png(user_id, pose, encode_crop(aligned_bgr))
+
+
+def decrypt_crop(user_id: int, pose: str, blob: bytes) -> np.ndarray:
+    """
+    Raise cryptography InvalidTag nếu sai key hoặc BLOB bị sửa/tráo.
+    """
+    png = _aead().decrypt(blob[:12], blob[12:], _aad(user_id, pose))
+    img = cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("CropDecodeFailed")
+    return img
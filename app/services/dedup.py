@@ -0,0 +1,66 @@
+# app/services/dedup.py
+"""
+Kiểm tra trùng khuôn mặt lúc đăng ký (1 khuôn mặt, nhiều tài khoản -> dấu hiệu gian lận).
+
+- Vector tổng hợp của user mới được search 1:N (scoring.top_k) trên UserEmbeddings của model
+  đang active; tài khoản có cosine >= DEDUP_THRESHOLD là trùng.
+- DEDUP_ACTION: off (mặc định) | flag (vẫn tạo tài khoản, ghi FaceDuplicates + AuthLogs AttackType
+  'duplicate_face') | reject (409 DuplicateFace, không tạo tài khoản).
+- Gallery đọc từ DB theo trang DEDUP_PAGE dòng (UserEmbeddings duyệt theo PK) cho mỗi lần kiểm
+  tra: bộ nhớ giới hạn ở DEDUP_PAGE x Dim, không giữ gallery trong worker nên luôn thấy user
+  bị xóa / re-embed. Chi phí mỗi lần đăng ký tăng theo N; quét toàn bộ theo lô + gom cụm:
+  tools/dedup_faces.
+"""
+from __future__ import annotations
+
+import os
+from typing import List, Tuple
+
+import numpy as np
+
+from ..database import queries
+from . import scoring
+
+ACTION = os.environ.get("DEDUP_ACTION", "off").lower()
+THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.80"))
+TOP_K = int(os.environ.get("DEDUP_TOP_K", "5"))
+PAGE = int(os.environ.get("DEDUP_PAGE", "20000"))
+_SCORE_CELLS = 4_000_000   # probe x cột gallery mỗi phép nhân (~16 MB float32)
+
+
+def enabled() -> bool:
+    return ACTION in ("flag", "reject")
+
+
+def find_many(vecs, version: str) -> List[List[Tuple[int, float]]]:
+    """
+    Search 1:N cho M vector trong 1 lượt đọc gallery. Mỗi vector: [(user_id, similarity)]
+    giảm dần, tối đa DEDUP_TOP_K.
+    """
+    probes = scoring.l2_normalize(np.asarray(vecs, dtype=np.float32).reshape(len(vecs), -1))
+    found: List[List[Tuple[int, float]]] = [[] for _ in range(len(probes))]
+    if not len(probes):
+        return found
+    last = 0
+    while True:
+        ids, mat = queries.get_user_embeddings_page(version, last, PAGE)
+        if len(ids) and mat.shape[1] == probes.shape[1]:
+            chunk = max(256, _SCORE_CELLS // len(probes))
+            idx, sims = scoring.top_k(probes, scoring.ensure_unit(mat), TOP_K, chunk=chunk)
+            for m, (row_i, row_s) in enumerate(zip(idx, sims)):
+                found[m].extend((int(ids[i]), float(s)) for i, s in zip(row_i, row_s) if s >= THRESHOLD)
+        if len(ids) < PAGE:
+            break
+        last = int(ids[-1])
+    return [sorted(f, key=lambda x: -x[1])[:TOP_K] for f in found]
+
+
+def find(vec, version: str) -> List[Tuple[int, float]]:
+    """
+    Tài khoản đã có cùng khuôn mặt với vec: [(user_id, similarity)] giảm dần, tối đa DEDUP_TOP_K.
+    """
+    return find_many([vec], version)[0]
+
+
+def record(user_id: int, matches: List[Tuple[int, float]], source: str = "register") -> None:
+    queries.save_face_duplicates(((user_id, m, s) for m, s in matches), source)
@@ -0,0 +1,224 @@
+# app/services/face_detect.py
+"""
+Pipeline detect "downscale-first" dùng chung cho face_embedding và pad_model.
+
+- Ảnh JPEG lớn được decode ở độ phân giải giảm (cv2.IMREAD_REDUCED_*), không
+  decode full chỉ để tìm mặt.
+- YuNet chạy trên ảnh làm việc có cạnh dài <= DETECT_MAX_SIDE, bbox/landmark
+  được map ngược về hệ tọa độ ảnh dùng để crop.
+- Chỉ upscale x2 khi bản thân khung hình nhỏ (mặt thực sự nhỏ).
+- Stream: track_face() chỉ detect trong ROI quanh bbox của frame trước.
+"""
+from __future__ import annotations
+
+import base64
+import os
+import struct
+from typing import NamedTuple, Tuple
+
+import numpy as np
+import cv2
+
+# Cạnh dài tối đa của ảnh đưa vào YuNet
+DETECT_MAX_SIDE = int(os.environ.get("FACE_DETECT_MAX_SIDE", "640"))
+# Cạnh mặt tối thiểu (px) trên ảnh dùng để crop; nhỏ hơn thì decode lại full-res
+CROP_MIN_FACE = int(os.environ.get("FACE_CROP_MIN_FACE", "112"))
+# Lề ROI khi tracking, tính theo cạnh lớn của bbox frame trước
+TRACK_MARGIN = float(os.environ.get("FACE_TRACK_MARGIN", "0.5"))
+
+_REDUCED_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class FaceFrame(NamedTuple):
+    """
+    Ảnh BGR dùng cho crop/align + bbox (x, y, w, h) và 5 landmark trong hệ tọa độ của ảnh đó.
+    bbox/landmarks = None nếu không thấy mặt.
+    """
+    bgr: np.ndarray
+    bbox: np.ndarray | None
+    landmarks: np.ndarray | None
+    score: float
+
+
+def to_bytes(image) -> bytes | memoryview:
+    """
+    Chuẩn hóa input ảnh về bytes:
+    - str: base64 (raw hoặc 'data:image/jpeg;base64,...')
+    - bytes/bytearray/memoryview: trả nguyên, không copy.
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return image
+    try:
+        payload = image.split(",")[-1].strip()
+        return base64.b64decode(payload, validate=False)
+    except Exception as e:
+        raise ValueError(f"BadImageDecode:{e}") from e
+
+
+def jpeg_size(data) -> Tuple[int, int] | None:
+    """
+    Đọc (w, h) từ header SOF của JPEG mà không decode ảnh. None nếu không phải JPEG.
+    """
+    mv = memoryview(data)
+    n = len(mv)
+    if n < 4 or mv[0] != 0xFF or mv[1] != 0xD8:
+        return None
+    i = 2
+    while i + 4 <= n:
+        if mv[i] != 0xFF:
+            return None
+        marker = mv[i + 1]
+        if marker == 0xFF:          # byte đệm
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        (seg_len,) = struct.unpack(">H", mv[i + 2:i + 4])
+        # SOF0..SOF15, trừ DHT(C4), JPG(C8), DAC(CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if i + 9 > n:
+                return None
+            h, w = struct.unpack(">HH", mv[i + 5:i + 9])
+            return int(w), int(h)
+        i += 2 + seg_len
+    return None
+
+
+def _pick_reduction(data, max_side: int) -> int:
+    """
+    Hệ số giảm lớn nhất (1/2/4/8) mà cạnh dài sau khi giảm vẫn >= max_side.
+    """
+    size = jpeg_size(data)
+    if size is None:
+        return 1
+    longest = max(size)
+    for r in (8, 4, 2):
+        if longest // r >= max_side:
+            return r
+    return 1
+
+
+def decode_bgr(data, reduction: int = 1) -> np.ndarray:
+    """
+    Decode bytes -> BGR, có thể giảm độ phân giải ngay lúc decode (JPEG DCT scaling).
+    Raise ValueError('BadImageDecode') nếu lỗi.
+    """
+    flag = _REDUCED_FLAGS.get(reduction, cv2.IMREAD_COLOR)
+    try:
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    except Exception as e:
+        raise ValueError(f"BadImageDecode:{e}") from e
+    if img is None:
+        raise ValueError("BadImageDecode")
+    return img
+
+
+def _largest(faces: np.ndarray | None) -> np.ndarray | None:
+    if faces is None or len(faces) == 0:
+        return None
+    areas = faces[:, 2] * faces[:, 3]
+    return faces[int(np.argmax(areas))]
+
+
+def _detect_at(detector, bgr: np.ndarray, scale: float) -> np.ndarray | None:
+    """
+    Chạy detector trên ảnh resize theo scale, trả face lớn nhất (tọa độ ảnh gốc).
+    """
+    h, w = bgr.shape[:2]
+    if scale == 1.0:
+        work = bgr
+    else:
+        ww, hh = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+        interp = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+        work = cv2.resize(bgr, (ww, hh), interpolation=interp)
+    detector.setInputSize((work.shape[1], work.shape[0]))
+    out = detector.detect(work)
+    faces = out[1] if (out is not None and len(out) >= 2) else None
+    f = _largest(faces)
+    if f is None:
+        return None
+    f = f.astype(np.float32).copy()
+    f[:14] /= scale
+    return f
+
+
+def detect_largest_face(detector, bgr: np.ndarray, max_side: int = DETECT_MAX_SIDE) -> np.ndarray | None:
+    """
+    Detect mặt lớn nhất trên ảnh làm việc (cạnh dài <= max_side).
+    Trả về hàng YuNet (15 giá trị) trong hệ tọa độ của bgr, hoặc None.
+    """
+    h, w = bgr.shape[:2]
+    longest = max(h, w)
+    s = min(1.0, max_side / float(longest))
+
+    f = _detect_at(detector, bgr, s)
+    if f is None and s < 1.0:
+        # Mặt nhỏ trên khung hình lớn: thử lại với độ phân giải gấp đôi (không vượt native)
+        f = _detect_at(detector, bgr, min(1.0, s * 2.0))
+    if f is None and s == 1.0:
+        # Khung hình nhỏ hơn working size -> mặt thực sự nhỏ -> upscale x2
+        f = _detect_at(detector, bgr, 2.0)
+    return f
+
+
+def locate_face(detector, image, max_side: int = DETECT_MAX_SIDE) -> FaceFrame:
+    """
+    Decode (reduced nếu được) + detect. Chỉ decode full-res khi mặt trên ảnh reduced
+    nhỏ hơn CROP_MIN_FACE (align/crop cần đủ điểm ảnh).
+    """
+    data = to_bytes(image)
+    r = _pick_reduction(data, max_side)
+    bgr = decode_bgr(data, r)
+    f = detect_largest_face(detector, bgr, max_side)
+
+    if f is not None and r > 1 and min(f[2], f[3]) < CROP_MIN_FACE:
+        # Mặt quá nhỏ để crop từ ảnh reduced -> decode full-res và map bbox/landmark
+        full = decode_bgr(data, 1)
+        sx = full.shape[1] / float(bgr.shape[1])
+        sy = full.shape[0] / float(bgr.shape[0])
+        f[0:14:2] *= sx
+        f[1:14:2] *= sy
+        bgr = full
+
+    if f is None:
+        return FaceFrame(bgr, None, None, 0.0)
+    return FaceFrame(bgr, f[0:4].copy(), f[4:14].reshape(5, 2).copy(), float(f[14]))
+
+
+def normalized_box(frame: FaceFrame) -> np.ndarray | None:
+    """
+    bbox chia theo kích thước ảnh -> dùng được giữa các frame decode ở độ phân giải khác nhau.
+    """
+    if frame.bbox is None:
+        return None
+    h, w = frame.bgr.shape[:2]
+    return np.asarray(frame.bbox, dtype=np.float32) / np.array([w, h, w, h], dtype=np.float32)
+
+
+def track_face(detector, image, prev_box: np.ndarray, margin: float = TRACK_MARGIN,
+               max_side: int = DETECT_MAX_SIDE) -> FaceFrame:
+    """
+    Decode + detect trong ROI quanh prev_box (normalized_box của frame trước).
+    bbox = None nếu mất dấu hoặc mặt quá nhỏ trên ảnh reduced -> caller gọi locate_face.
+    """
+    data = to_bytes(image)
+    r = _pick_reduction(data, max_side)
+    bgr = decode_bgr(data, r)
+    h, w = bgr.shape[:2]
+    x, y, bw, bh = np.asarray(prev_box, dtype=np.float32) * np.array([w, h, w, h], dtype=np.float32)
+    m = margin * max(bw, bh)
+    x0, y0 = int(max(0, x - m)), int(max(0, y - m))
+    x1, y1 = int(min(w, x + bw + m)), int(min(h, y + bh + m))
+    if x1 - x0 < 16 or y1 - y0 < 16:
+        return FaceFrame(bgr, None, None, 0.0)
+    f = detect_largest_face(detector, bgr[y0:y1, x0:x1], max_side)
+    if f is None or (r > 1 and min(f[2], f[3]) < CROP_MIN_FACE):
+        return FaceFrame(bgr, None, None, 0.0)
+    f[0:14:2] += x0
+    f[1:14:2] += y0
+    return FaceFrame(bgr, f[0:4].copy(), f[4:14].reshape(5, 2).copy(), float(f[14]))
@@ -1,29 +1,51 @@
 # app/services/face_embedding.py
 from __future__ import annotations
 
-import base64
-import io
 import os
-from typing import Tuple
+from typing import Dict, Iterable, List, Tuple
 
 import numpy as np
-from PIL import Image
 import cv2
 
+from .face_detect import FaceFrame, locate_face, track_face
+
 MODEL_DIR = os.environ.get("OPENCV_MODEL_DIR", "models")
 DETECTOR_WEIGHTS = os.path.join(MODEL_DIR, "face_detection_yunet_2023mar.onnx")
 RECOG_WEIGHTS    = os.path.join(MODEL_DIR, "face_recognition_sface_2021dec.onnx")
 
+# ModelVersion ghi kèm embedding của RECOG_WEIGHTS
+MODEL_VERSION = "sface-128"
+
+
+def _parse_models(spec: str) -> Dict[str, str]:
+    """
+    "sface-128=models/a.onnx,arcface-512=models/b.onnx" -> {version: weights}.
+    Rỗng -> chỉ SFace mặc định. Version đầu tiên là model chính (dùng cho alignCrop).
+    """
+    models: Dict[str, str] = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        version, path = item.split("=", 1)
+        models[version.strip()] = path.strip()
+    return models or {MODEL_VERSION: RECOG_WEIGHTS}
+
+
+# Các recognizer được nạp cùng lúc (vd. model cũ + model mới trong thời gian migrate)
+FACE_MODELS = _parse_models(os.environ.get("FACE_MODELS", ""))
+
 _detector = None
 _recognizer = None
+_recognizers: Dict[str, object] = {}
 
 
 def _ensure_models_exist():
     missing = []
     if not os.path.isfile(DETECTOR_WEIGHTS):
         missing.append(DETECTOR_WEIGHTS)
-    if not os.path.isfile(RECOG_WEIGHTS):
-        missing.append(RECOG_WEIGHTS)
+    for path in FACE_MODELS.values():
+        if not os.path.isfile(path):
+            missing.append(path)
     if missing:
         raise FileNotFoundError(
             "Missing model files:\n" + "\n".join(missing) +
@@ -31,9 +53,16 @@ def _ensure_models_exist():
         )
 
 
+def load_recognizer(weights: str):
+    """
+    Nạp 1 recognizer (interface FaceRecognizerSF: input 112x112 BGR đã align).
+    """
+    return cv2.FaceRecognizerSF.create(weights, "")
+
+
 def _init_models():
     """
-    Khởi tạo YuNet + SFace, chỉ làm 1 lần.
+    Khởi tạo YuNet + các recognizer trong FACE_MODELS, chỉ làm 1 lần.
     """
     global _detector, _recognizer
     if _detector is not None and _recognizer is not None:
@@ -50,9 +79,11 @@ def _init_models():
         nms_threshold=0.3,
         top_k=5000,
     )
-    # SFace recognizer
-    _recognizer = cv2.FaceRecognizerSF.create(RECOG_WEIGHTS, "")
-    print("[FACE] YuNet + SFace loaded.")
+    # Recognizers (SFace mặc định)
+    for version, path in FACE_MODELS.items():
+        _recognizers[version] = load_recognizer(path)
+    _recognizer = _recognizers[next(iter(FACE_MODELS))]
+    print(f"[FACE] YuNet + recognizers loaded: {list(FACE_MODELS)}")
 
 
 def init_face_models() -> None:
@@ -62,72 +93,71 @@ def init_face_models() -> None:
     _init_models()
 
 
-def _b64_to_bgr(image_b64: str) -> np.ndarray:
+def available_versions() -> List[str]:
     """
-    Decode base64 (hỗ trợ cả raw 'AAA...' và 'data:image/jpeg;base64,...') -> BGR.
-    Raise ValueError nếu decode lỗi.
+    Các ModelVersion có recognizer được cấu hình (model chính đứng đầu).
     """
-    try:
-        payload = image_b64.split(",")[-1].strip()
-        raw = base64.b64decode(payload, validate=False)
-        img = Image.open(io.BytesIO(raw)).convert("RGB")
-        arr = np.array(img)  # RGB
-        return cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
-    except Exception as e:
-        raise ValueError(f"BadImageDecode:{e}") from e
+    return list(FACE_MODELS)
 
 
-def _detect_largest_face(bgr: np.ndarray) -> Tuple[np.ndarray, np.ndarray] | None:
+def locate(image_b64: str | bytes) -> FaceFrame:
     """
-    Detect khuôn mặt lớn nhất.
-    Trả về (bbox, landmarks) hoặc None nếu không thấy.
+    Decode + detect 1 lần; FaceFrame dùng lại cho gate chất lượng, PAD và align.
     """
-    h, w = bgr.shape[:2]
-    _detector.setInputSize((w, h))
-    out = _detector.detect(bgr)
-    faces = out[1] if (out is not None and len(out) >= 2) else None
-
-    if faces is None or len(faces) == 0:
-        # Thử upscale x2 nếu mặt quá nhỏ
-        up = cv2.resize(bgr, (w * 2, h * 2), interpolation=cv2.INTER_LINEAR)
-        _detector.setInputSize((w * 2, h * 2))
-        out2 = _detector.detect(up)
-        faces2 = out2[1] if (out2 is not None and len(out2) >= 2) else None
-        if faces2 is None or len(faces2) == 0:
-            return None
+    _init_models()
+    return locate_face(_detector, image_b64)
 
-        # Lấy face lớn nhất trên ảnh upscale
-        areas = faces2[:, 2] * faces2[:, 3]
-        idx = int(np.argmax(areas))
-        f = faces2[idx]
-        bbox = (f[0] / 2, f[1] / 2, f[2] / 2, f[3] / 2)
-        lmk = (f[4:14].reshape(5, 2) / 2.0)
-        return np.array(bbox, dtype=np.float32), lmk.astype(np.float32)
 
-    # Lấy face lớn nhất trên ảnh gốc
-    areas = faces[:, 2] * faces[:, 3]
-    idx = int(np.argmax(areas))
-    f = faces[idx]
-    bbox = f[0:4]
-    lmk = f[4:14].reshape(5, 2)
-    return bbox.astype(np.float32), lmk.astype(np.float32)
+def track(image_b64: str | bytes, prev_box: np.ndarray) -> FaceFrame:
+    """
+    Như locate() nhưng chỉ detect quanh bbox frame trước (xem face_detect.track_face).
+    """
+    _init_models()
+    return track_face(_detector, image_b64, prev_box)
 
 
-def extract(image_b64: str) -> np.ndarray:
+def align(image_b64: str | bytes, frame: FaceFrame | None = None) -> np.ndarray:
     """
-    Trả về embedding L2-normalized (float32), Dim=128 (SFace).
+    Decode + detect + alignCrop -> ảnh mặt 112x112 BGR (bỏ qua decode/detect nếu có frame).
     Raise ValueError("NoFaceDetected") nếu không thấy khuôn mặt.
-    Raise ValueError("BadImageDecode:...") nếu ảnh lỗi.
     """
     _init_models()
-    bgr = _b64_to_bgr(image_b64)
-
-    det = _detect_largest_face(bgr)
-    if det is None:
+    if frame is None:
+        frame = locate_face(_detector, image_b64)
+    if frame.landmarks is None:
         raise ValueError("NoFaceDetected")
-    _, kps = det
+    return _recognizer.alignCrop(frame.bgr, frame.landmarks)   # 112x112 BGR
+
 
-    aligned = _recognizer.alignCrop(bgr, kps)   # 112x112 BGR
-    feat = _recognizer.feature(aligned)
+def embed_aligned(aligned: np.ndarray, model_version: str | None = None, recognizer=None) -> np.ndarray:
+    """
+    Embedding L2-normalized (float32) từ ảnh đã align.
+    """
+    if recognizer is None:
+        _init_models()
+        recognizer = _recognizers[model_version] if model_version else _recognizer
+    feat = recognizer.feature(aligned)
     feat = feat / (np.linalg.norm(feat) + 1e-9)
     return feat.astype(np.float32)
+
+
+def extract(image_b64: str | bytes) -> np.ndarray:
+    """
+    image_b64: chuỗi base64 hoặc bytes JPEG/PNG.
+    Trả về embedding L2-normalized (float32) của model chính, Dim=128 (SFace).
+    Raise ValueError("NoFaceDetected") nếu không thấy khuôn mặt.
+    Raise ValueError("BadImageDecode:...") nếu ảnh lỗi.
+    """
+    return embed_aligned(align(image_b64))
+
+
+def extract_versions(
+    image_b64: str | bytes, versions: Iterable[str], frame: FaceFrame | None = None
+) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """
+    Decode/detect/align 1 lần (hoặc dùng frame đã locate), embed bằng nhiều model.
+    Trả về ({version: embedding}, ảnh 112x112 đã align).
+    """
+    aligned = align(image_b64, frame)
+    feats = {v: embed_aligned(aligned, v) for v in versions}
+    return feats, aligned
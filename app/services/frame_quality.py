@@ -0,0 +1,94 @@
+# app/services/frame_quality.py
+"""
+Gate chất lượng frame, chạy trên kết quả detect sẵn có (FaceFrame) TRƯỚC PAD/SFace.
+
+- Đo: cạnh mặt (px), điểm YuNet, độ nét (variance Laplacian), độ sáng, yaw từ 5 landmark.
+- Frame không đạt -> trả reason code cụ thể để client chụp lại ngay, không tốn ONNX.
+- Ngưỡng theo pose nằm trong policy của risk_engine (mục "quality"), nạp lại được.
+- Yaw chỉ so độ lớn: chiều trái/phải phụ thuộc client có lật ảnh (mirror) hay không.
+"""
+from __future__ import annotations
+
+import os
+from typing import Dict, NamedTuple
+
+import numpy as np
+import cv2
+
+from .face_detect import FaceFrame
+from .risk_engine import quality_thresholds
+
+ENABLED = os.environ.get("FRAME_QUALITY_GATE", "1") == "1"
+
+# Kích thước chuẩn khi đo độ nét: variance Laplacian không phụ thuộc cỡ mặt
+_BLUR_SIDE = 112
+
+
+class QualityReport(NamedTuple):
+    ok: bool
+    reason: str | None          # None nếu đạt
+    metrics: Dict[str, float]
+
+
+def _face_gray(frame: FaceFrame) -> np.ndarray:
+    h, w = frame.bgr.shape[:2]
+    x, y, bw, bh = np.asarray(frame.bbox).astype(int)
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(w, x + bw), min(h, y + bh)
+    face = frame.bgr[y0:y1, x0:x1]
+    if face.size == 0:
+        return np.zeros((_BLUR_SIDE, _BLUR_SIDE), dtype=np.uint8)
+    face = cv2.resize(face, (_BLUR_SIDE, _BLUR_SIDE), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+
+
+def yaw_ratio(landmarks: np.ndarray) -> float:
+    """
+    (mũi.x - giữa 2 mắt.x) / khoảng cách 2 mắt. ~0 khi nhìn thẳng, |.| tăng khi quay đầu.
+    Thứ tự landmark YuNet: mắt phải, mắt trái, mũi, mép phải, mép trái.
+    """
+    lm = np.asarray(landmarks, dtype=np.float32).reshape(5, 2)
+    eye_mid = (lm[0] + lm[1]) / 2.0
+    eye_dist = float(np.linalg.norm(lm[1] - lm[0])) + 1e-6
+    return float((lm[2, 0] - eye_mid[0]) / eye_dist)
+
+
+def measure(frame: FaceFrame) -> Dict[str, float]:
+    gray = _face_gray(frame)
+    return {
+        "face_px": float(min(frame.bbox[2], frame.bbox[3])),
+        "score": float(frame.score),
+        "blur": float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        "brightness": float(gray.mean()),
+        "yaw": yaw_ratio(frame.landmarks),
+    }
+
+
+def assess(frame: FaceFrame, pose: str) -> QualityReport:
+    """
+    Kiểm tra 1 frame cho pose yêu cầu. Reason code theo thứ tự kiểm tra:
+    NoFaceDetected, FaceTooSmall, LowDetectionScore, TooDark, TooBright, TooBlurry, PoseMismatch.
+    """
+    if frame.bbox is None or frame.landmarks is None:
+        return QualityReport(False, "NoFaceDetected", {})
+    m = measure(frame)
+    if not ENABLED:
+        return QualityReport(True, None, m)
+    th = quality_thresholds(pose)
+    lo_b, hi_b = th["brightness"]
+    lo_y, hi_y = th["yaw"]
+    if m["face_px"] < th["min_face"]:
+        reason = "FaceTooSmall"
+    elif m["score"] < th["min_score"]:
+        reason = "LowDetectionScore"
+    elif m["brightness"] < lo_b:
+        reason = "TooDark"
+    elif m["brightness"] > hi_b:
+        reason = "TooBright"
+    elif m["blur"] < th["min_blur"]:
+        reason = "TooBlurry"
+    elif not lo_y <= abs(m["yaw"]) <= hi_y:
+        reason = "PoseMismatch"
+    else:
+        reason = None
+    return QualityReport(reason is None, reason, m)
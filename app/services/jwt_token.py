@@ -1,8 +1,128 @@
-import os, time, jwt
+import base64, hashlib, hmac, json, os, secrets, time, jwt
+from . import revocation
 SECRET = os.environ.get("JWT_SECRET", "dev-secret-change-me-32bytes")
 ISS = "bank.example"; AUD = "bank.web"; EXP = 30*60
+# Key ring: JWT_KEYS="kid1:secret1,kid2:secret2" (key đầu tiên / JWT_ACTIVE_KID dùng để ký,
+# các key còn lại chỉ để verify token cũ khi xoay key). Không đặt -> {"default": JWT_SECRET}.
+KEYS_SPEC = os.environ.get("JWT_KEYS", "")
+ACTIVE_KID = os.environ.get("JWT_ACTIVE_KID", "")
+LEEWAY = int(os.environ.get("JWT_LEEWAY_S", "0"))
+
+_ring = None          # (active kid, {kid: key bytes})
+_headers = {}         # header base64 đã verify -> (kid, key), header của 1 kid luôn giống nhau
+_HEADERS_MAX = 64
+
+def _parse_keys(spec: str) -> dict:
+    keys = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        kid, sep, secret = part.partition(":")
+        if not sep or not kid or not secret:
+            raise ValueError(f"BadJwtKeySpec:{kid}")
+        keys[kid] = secret.encode()
+    return keys
+
+def load_keys(spec: str | None = None, active: str | None = None):
+    """
+    Nạp (lại) key ring. Gọi lại khi xoay key; cache header được xóa theo.
+    """
+    global _ring
+    spec = KEYS_SPEC if spec is None else spec
+    keys = _parse_keys(spec) or {"default": SECRET.encode()}
+    kid = (ACTIVE_KID if active is None else active) or next(iter(keys))
+    if kid not in keys:
+        raise ValueError(f"UnknownActiveKid:{kid}")
+    _ring = (kid, keys)
+    _headers.clear()
+    return _ring
+
+def _keyring():
+    return _ring or load_keys()
+
+def _sign(payload: dict) -> str:
+    kid, keys = _keyring()
+    return jwt.encode(payload, keys[kid], algorithm="HS256", headers={"kid": kid})
 
 def issue(user_id: str) -> str:
     now = int(time.time())
-    payload = {"sub": user_id, "iss": ISS, "aud": AUD, "iat": now, "exp": now+EXP}
-    return jwt.encode(payload, SECRET, algorithm="HS256")
+    payload = {"sub": user_id, "iss": ISS, "aud": AUD, "iat": now, "exp": now+EXP, "jti": secrets.token_urlsafe(12)}
+    return _sign(payload)
+
+def _b64d(seg: str) -> bytes:
+    return base64.urlsafe_b64decode(seg + "=" * (-len(seg) % 4))
+
+def _header_key(seg: str):
+    try:
+        header = json.loads(_b64d(seg))
+    except Exception:
+        raise ValueError("MalformedToken")
+    if not isinstance(header, dict) or header.get("alg") != "HS256":
+        raise ValueError("UnsupportedAlg")
+    kid = header.get("kid", "default")
+    if not isinstance(kid, str):
+        raise ValueError("MalformedToken")
+    key = _keyring()[1].get(kid)
+    if key is None:
+        raise ValueError(f"UnknownKid:{kid}")
+    return kid, key
+
+def verify(token: str, audience: str = AUD, check_revoked: bool = True) -> dict:
+    """
+    Verify HS256 theo kid: chữ ký + exp/nbf + iss/aud + index thu hồi (bộ nhớ, không round-trip DB).
+    Trả claims; raise ValueError (MalformedToken, UnknownKid, BadSignature, TokenExpired,
+    BadIssuer, BadAudience, TokenRevoked...) nếu không hợp lệ.
+    """
+    parts = token.split(".") if isinstance(token, str) else ()
+    if len(parts) != 3:
+        raise ValueError("MalformedToken")
+    h, p, s = parts
+    cached = _headers.get(h)
+    kid, key = cached or _header_key(h)
+    try:
+        sig = _b64d(s)
+    except Exception:
+        raise ValueError("MalformedToken")
+    if not hmac.compare_digest(hmac.new(key, f"{h}.{p}".encode(), hashlib.sha256).digest(), sig):
+        raise ValueError("BadSignature")
+    if cached is None and len(_headers) < _HEADERS_MAX:
+        _headers[h] = (kid, key)   # chỉ cache header đã qua chữ ký -> không bị spam header lạ
+    try:
+        claims = json.loads(_b64d(p))
+    except Exception:
+        raise ValueError("MalformedToken")
+    if not isinstance(claims, dict) or not isinstance(claims.get("jti", ""), str):
+        raise ValueError("MalformedToken")
+    now = time.time()
+    exp = claims.get("exp")
+    if not isinstance(exp, (int, float)) or now >= exp + LEEWAY:
+        raise ValueError("TokenExpired")
+    nbf = claims.get("nbf")
+    if isinstance(nbf, (int, float)) and now < nbf - LEEWAY:
+        raise ValueError("TokenNotYetValid")
+    if claims.get("iss") != ISS:
+        raise ValueError("BadIssuer")
+    aud = claims.get("aud")
+    if aud != audience and not (isinstance(aud, list) and audience in aud):
+        raise ValueError("BadAudience")
+    if check_revoked and revocation.is_revoked(claims.get("jti")):
+        raise ValueError("TokenRevoked")
+    return claims
+
+
+# Challenge verify ký HMAC (CHALLENGE_MODE=signed): không cần lưu state phía server
+CHALLENGE_AUD = AUD + "/challenge"
+CHALLENGE_TTL = int(os.environ.get("CHALLENGE_TTL_S", "120"))
+
+def issue_challenge(user_id: int, sequence: list, purpose: str) -> str:
+    now = int(time.time())
+    payload = {"sub": str(user_id), "seq": list(sequence), "pur": purpose, "jti": secrets.token_urlsafe(12),
+               "iss": ISS, "aud": CHALLENGE_AUD, "iat": now, "exp": now+CHALLENGE_TTL}
+    return _sign(payload)
+
+def decode_challenge(token: str) -> dict:
+    """
+    Kiểm tra chữ ký + hạn + audience (replay do nonce_ledger lo). Raise ValueError nếu không hợp lệ.
+    """
+    claims = verify(token, audience=CHALLENGE_AUD, check_revoked=False)
+    if not claims.get("jti") or not claims.get("sub"):
+        raise ValueError("MissingClaim")
+    return claims
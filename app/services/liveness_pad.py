@@ -1,7 +1,8 @@
 # app/services/liveness_pad.py
 from __future__ import annotations
+from .face_detect import FaceFrame
 from .pad_model import is_live
 
-def liveness_ok(image_b64: str) -> tuple[bool, float]:
-    ok, prob = is_live(image_b64)
+def liveness_ok(image_b64: str | bytes, frame: FaceFrame | None = None) -> tuple[bool, float]:
+    ok, prob = is_live(image_b64, frame=frame)
     return ok, prob
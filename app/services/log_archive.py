@@ -0,0 +1,200 @@
+# app/services/log_archive.py
+"""
+Archive AuthLogs cũ ra file cột nén (.npz) theo ngày, đọc chung với log nóng trong SQLite.
+
+- Layout: AUTHLOG_ARCHIVE_DIR/YYYY-MM-DD/part-<LogId đầu>.npz (ngày theo UTC của At).
+- Mỗi part: 1 mảng / cột AuthLogs. Cột số: float64 (NULL = NaN), LogId/At: int64,
+  cột text: unicode ("" = NULL).
+- Ghi part (fsync + os.replace) TRƯỚC khi xóa dòng trong SQLite; chạy lại sau khi dừng giữa
+  chừng chỉ ghi đè cùng part, lúc đọc loại trùng theo LogId.
+"""
+from __future__ import annotations
+
+import glob
+import os
+import time
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from ..database.db import get_audit_conn
+
+ARCHIVE_DIR = os.environ.get("AUTHLOG_ARCHIVE_DIR", "archive/authlogs")
+
+_INT_COLS = {"LogId", "At"}
+_TEXT_COLS = {"Decision", "PadResult", "Purpose", "Ip", "DeviceInfo", "Geo", "AttackType"}
+
+
+def _day(at: int) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(int(at)))
+
+
+def to_columns(rows, cols: List[str]) -> Dict[str, np.ndarray]:
+    out = {}
+    for col in cols:
+        vals = [r[col] for r in rows]
+        if col in _INT_COLS:
+            out[col] = np.array(vals, dtype=np.int64)
+        elif col in _TEXT_COLS:
+            out[col] = np.array(["" if v is None else str(v) for v in vals], dtype=str)
+        else:
+            out[col] = np.array([np.nan if v is None else v for v in vals], dtype=np.float64)
+    return out
+
+
+def write_parts(rows, cols: List[str], archive_dir: str | None = None) -> List[str]:
+    """
+    Ghi các dòng (đã sort theo LogId) thành 1 part / ngày. Trả về danh sách file.
+    """
+    archive_dir = archive_dir or ARCHIVE_DIR
+    by_day: Dict[str, list] = {}
+    for r in rows:
+        by_day.setdefault(_day(r["At"]), []).append(r)
+    paths = []
+    for day, day_rows in sorted(by_day.items()):
+        d = os.path.join(archive_dir, day)
+        os.makedirs(d, exist_ok=True)
+        path = os.path.join(d, f"part-{int(day_rows[0]['LogId']):012d}.npz")
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **to_columns(day_rows, cols))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        paths.append(path)
+    return paths
+
+
+def read_archive(
+    t0: int | None = None, t1: int | None = None, archive_dir: str | None = None
+) -> Dict[str, np.ndarray]:
+    """
+    Đọc + ghép các part có ngày giao [t0, t1] -> {cột: mảng}, loại trùng LogId, lọc theo At.
+    Chỉ mở file của những ngày liên quan (tên thư mục = ngày).
+    """
+    archive_dir = archive_dir or ARCHIVE_DIR
+    lo = _day(t0) if t0 is not None else None
+    hi = _day(t1) if t1 is not None else None
+    parts: List[Dict[str, np.ndarray]] = []
+    for d in sorted(glob.glob(os.path.join(archive_dir, "????-??-??"))):
+        day = os.path.basename(d)
+        if (lo and day < lo) or (hi and day > hi):
+            continue
+        for path in sorted(glob.glob(os.path.join(d, "part-*.npz"))):
+            with np.load(path, allow_pickle=False) as z:
+                parts.append({k: z[k] for k in z.files})
+    if not parts:
+        return {}
+
+    cols = sorted(set().union(*parts))
+    merged = {}
+    for col in cols:
+        arrs = []
+        for p in parts:
+            if col in p:
+                arrs.append(p[col])
+            else:   # part cũ thiếu cột (schema AuthLogs mở rộng sau)
+                n = len(p["LogId"])
+                arrs.append(np.full(n, "", dtype=str) if col in _TEXT_COLS else np.full(n, np.nan))
+        merged[col] = np.concatenate(arrs)
+    _, keep = np.unique(merged["LogId"], return_index=True)
+    mask = np.ones(keep.size, dtype=bool)
+    if t0 is not None:
+        mask &= merged["At"][keep] >= t0
+    if t1 is not None:
+        mask &= merged["At"][keep] <= t1
+    keep = keep[mask]
+    return {k: v[keep] for k, v in merged.items()}
+
+
+# Cột AuthLogs -> key của /metrics/export
+ITEM_COLS = {
+    "sim": "Similarity",
+    "bona": "IsBonaFide",
+    "pad_prob": "PadProbMin",
+    "pad_ok": "PadPassed",
+    "decision": "Decision",
+    "purpose": "Purpose",
+    "atk": "AttackType",
+    "dur_ms": "DurationMs",
+    "at": "At",
+}
+_INT_LIKE = {"IsBonaFide", "PadPassed", "DurationMs"}
+
+
+def _py(v, col):
+    v = v.item()
+    if col in _TEXT_COLS:
+        return v or None
+    if isinstance(v, float):
+        if np.isnan(v):
+            return None
+        if col in _INT_LIKE:
+            return int(v)
+    return v
+
+
+def export_items(t0: int | None = None, t1: int | None = None, archive_dir: str | None = None) -> List[dict]:
+    """
+    Bản ghi đánh giá (định dạng /metrics/export) từ archive + AuthLogs nóng.
+    """
+    if t0 is None or t1 is None:
+        t0 = t1 = None   # như /metrics/export cũ: chỉ lọc khi có đủ t0, t1
+    arch = read_archive(t0, t1, archive_dir)
+    arrays = {key: arch.get(col) for key, col in ITEM_COLS.items()}
+    items: List[dict] = []
+    for i in range(len(arch.get("LogId", ()))):
+        items.append({
+            key: (None if arr is None else _py(arr[i], ITEM_COLS[key])) for key, arr in arrays.items()
+        })
+    # dòng đã ghi archive nhưng chưa kịp xóa (dừng giữa chừng) không được đếm 2 lần
+    archived = set(arch["LogId"].tolist()) if arch else set()
+
+    sql = f"SELECT LogId, {', '.join(ITEM_COLS.values())} FROM AuthLogs"
+    args: list = []
+    if t0 is not None:
+        sql += " WHERE At BETWEEN ? AND ?"
+        args = [t0, t1]
+    with get_audit_conn() as c:
+        for r in c.execute(sql, args):
+            if r["LogId"] not in archived:
+                items.append({key: r[col] for key, col in ITEM_COLS.items()})
+    return items
+
+
+def authlog_columns() -> List[str]:
+    with get_audit_conn() as c:
+        return [row[1] for row in c.execute("PRAGMA table_info(AuthLogs)")]
+
+
+def archive_before(
+    cutoff: int, max_log_id: int, batch: int = 5000, archive_dir: str | None = None
+) -> Iterable[dict]:
+    """
+    Chuyển AuthLogs có At < cutoff và LogId <= max_log_id ra archive, xóa theo batch giới hạn
+    (mỗi batch 1 transaction ngắn để không chặn writer lâu). Sinh thống kê từng batch.
+    """
+    cols = authlog_columns()
+    after = 0
+    while True:
+        with get_audit_conn() as c:
+            rows = c.execute(
+                f"""
+                SELECT {', '.join(cols)} FROM AuthLogs
+                WHERE LogId > ? AND LogId <= ? AND At < ?
+                ORDER BY LogId LIMIT ?
+                """,
+                (after, max_log_id, cutoff, batch),
+            ).fetchall()
+        if not rows:
+            return
+        first, last = int(rows[0]["LogId"]), int(rows[-1]["LogId"])
+        paths = write_parts(rows, cols, archive_dir)
+        with get_audit_conn() as c:
+            # cùng điều kiện với SELECT -> xóa đúng các dòng vừa ghi
+            deleted = c.execute(
+                "DELETE FROM AuthLogs WHERE LogId BETWEEN ? AND ? AND At < ?",
+                (first, last, cutoff),
+            ).rowcount
+        after = last
+        yield {"rows": len(rows), "deleted": deleted, "first": first, "last": last, "files": paths}
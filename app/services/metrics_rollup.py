@@ -0,0 +1,249 @@
+# app/services/metrics_rollup.py
+"""
+Rollup metrics tăng dần từ AuthLogs (thay vì export + tính lại toàn bảng).
+
+- Bảng MetricsRollup: 1 dòng / (Grain, BucketStart, Purpose), Grain = 60 (phút) hoặc 3600 (giờ).
+  Mỗi dòng: số lượng theo Decision, PAD pass, tổng similarity, histogram similarity + duration.
+- update(): đọc AuthLogs có LogId > high-water mark (Meta 'RollupHighWater'), cộng dồn vào
+  bucket, ghi bucket + high-water mark trong CÙNG 1 transaction -> không đếm trùng/thiếu.
+- window(): đọc <= 168 bucket cho 1h/24h/7d, chi phí O(bucket) thay vì O(dòng log).
+"""
+from __future__ import annotations
+
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from ..database.db import get_audit_conn
+
+HIGH_WATER_KEY = "RollupHighWater"
+GRAINS = (60, 3600)
+BATCH = int(os.environ.get("ROLLUP_BATCH", "50000"))
+MINUTE_RETENTION_S = int(os.environ.get("ROLLUP_MINUTE_RETENTION_H", "48")) * 3600
+ANOMALY_Z = float(os.environ.get("ROLLUP_ANOMALY_Z", "3"))
+
+# Histogram: similarity 50 bin đều trên [0, 1] (ngoài khoảng dồn về bin đầu/cuối),
+# duration theo mốc ms (bin cuối = >= 5000ms)
+SIM_BINS = 50
+DUR_EDGES = np.array([25, 50, 75, 100, 150, 200, 300, 400, 500, 750, 1000, 1500, 2000, 3000, 5000], dtype=np.float64)
+DUR_BINS = len(DUR_EDGES) + 1
+
+DECISIONS = {"ALLOW": "Allow", "STEP_UP": "StepUp", "DENY": "Deny", "ENROLL": "Enroll"}
+WINDOWS = {"1h": (3600, 60), "24h": (86400, 3600), "7d": (7 * 86400, 3600)}
+
+_COUNT_COLS = ["Total", "Allow", "StepUp", "Deny", "Enroll", "PadPassed", "PadTotal", "SimCount"]
+
+
+def _hist_blob(h: np.ndarray) -> bytes:
+    return h.astype("<i8").tobytes()
+
+
+def _hist(blob: bytes | None, n: int) -> np.ndarray:
+    if not blob:
+        return np.zeros(n, dtype=np.int64)
+    return np.frombuffer(blob, dtype="<i8").astype(np.int64)
+
+
+def _new_bucket() -> dict:
+    b = {k: 0 for k in _COUNT_COLS}
+    b["SimSum"] = 0.0
+    b["SimHist"] = np.zeros(SIM_BINS, dtype=np.int64)
+    b["DurHist"] = np.zeros(DUR_BINS, dtype=np.int64)
+    return b
+
+
+def _aggregate(rows) -> Dict[tuple, dict]:
+    """
+    rows AuthLogs -> {(grain, bucket_start, purpose): bucket}
+    """
+    at = np.array([r["At"] for r in rows], dtype=np.int64)
+    sim = np.array([np.nan if r["Similarity"] is None else r["Similarity"] for r in rows], dtype=np.float64)
+    dur = np.array([np.nan if r["DurationMs"] is None else r["DurationMs"] for r in rows], dtype=np.float64)
+    sim_bin = np.clip(np.nan_to_num(sim, nan=0.0) * SIM_BINS, 0, SIM_BINS - 1).astype(np.int64)
+    dur_bin = np.searchsorted(DUR_EDGES, np.nan_to_num(dur, nan=0.0), side="right")
+
+    out: Dict[tuple, dict] = {}
+    for i, r in enumerate(rows):
+        purpose = r["Purpose"] or "-"
+        col = DECISIONS.get(r["Decision"])
+        for grain in GRAINS:
+            key = (grain, int(at[i] - at[i] % grain), purpose)
+            b = out.get(key)
+            if b is None:
+                b = out[key] = _new_bucket()
+            b["Total"] += 1
+            if col:
+                b[col] += 1
+            if r["PadPassed"] is not None:
+                b["PadTotal"] += 1
+                b["PadPassed"] += int(bool(r["PadPassed"]))
+            if not np.isnan(sim[i]):
+                b["SimCount"] += 1
+                b["SimSum"] += float(sim[i])
+                b["SimHist"][sim_bin[i]] += 1
+            if not np.isnan(dur[i]):
+                b["DurHist"][dur_bin[i]] += 1
+    return out
+
+
+def _merge(conn, buckets: Dict[tuple, dict]) -> None:
+    for (grain, start, purpose), b in buckets.items():
+        row = conn.execute(
+            "SELECT * FROM MetricsRollup WHERE Grain=? AND BucketStart=? AND Purpose=?",
+            (grain, start, purpose),
+        ).fetchone()
+        if row is not None:
+            for k in _COUNT_COLS:
+                b[k] += row[k]
+            b["SimSum"] += row["SimSum"]
+            b["SimHist"] += _hist(row["SimHist"], SIM_BINS)
+            b["DurHist"] += _hist(row["DurHist"], DUR_BINS)
+        conn.execute(
+            f"""
+            INSERT OR REPLACE INTO MetricsRollup(Grain, BucketStart, Purpose, {', '.join(_COUNT_COLS)}, SimSum, SimHist, DurHist)
+            VALUES ({', '.join(['?'] * (len(_COUNT_COLS) + 6))})
+            """,
+            (grain, start, purpose, *[b[k] for k in _COUNT_COLS], b["SimSum"],
+             _hist_blob(b["SimHist"]), _hist_blob(b["DurHist"])),
+        )
+
+
+def update(max_batches: int | None = None) -> dict:
+    """
+    Cộng dồn log mới vào rollup. Mỗi batch 1 transaction (BEGIN IMMEDIATE: nhiều worker
+    gọi cùng lúc cũng không đếm trùng). Trả về {'rows': số log đã xử lý, 'high_water': LogId}.
+    """
+    done = 0
+    hw = 0
+    n = 0
+    while max_batches is None or n < max_batches:
+        n += 1
+        with get_audit_conn() as c:
+            c.execute("BEGIN IMMEDIATE")
+            row = c.execute("SELECT Value FROM Meta WHERE Key=?", (HIGH_WATER_KEY,)).fetchone()
+            hw = int(row["Value"]) if row and row["Value"] is not None else 0
+            rows = c.execute(
+                """
+                SELECT LogId, At, Purpose, Decision, PadPassed, Similarity, DurationMs
+                FROM AuthLogs WHERE LogId > ? ORDER BY LogId LIMIT ?
+                """,
+                (hw, BATCH),
+            ).fetchall()
+            if not rows:
+                break
+            _merge(c, _aggregate(rows))
+            hw = int(rows[-1]["LogId"])
+            c.execute(
+                "INSERT INTO Meta(Key, Value) VALUES (?, ?) ON CONFLICT(Key) DO UPDATE SET Value=excluded.Value",
+                (HIGH_WATER_KEY, str(hw)),
+            )
+            # bucket phút chỉ phục vụ cửa sổ 1h
+            c.execute(
+                "DELETE FROM MetricsRollup WHERE Grain=60 AND BucketStart < ?",
+                (int(time.time()) - MINUTE_RETENTION_S,),
+            )
+        done += len(rows)
+        if len(rows) < BATCH:
+            break
+    return {"rows": done, "high_water": hw}
+
+
+def high_water() -> int:
+    with get_audit_conn() as c:
+        row = c.execute("SELECT Value FROM Meta WHERE Key=?", (HIGH_WATER_KEY,)).fetchone()
+    return int(row["Value"]) if row and row["Value"] is not None else 0
+
+
+def _hist_quantiles(hist: np.ndarray, upper_edges: np.ndarray, qs=(0.5, 0.9, 0.99)) -> List[float | None]:
+    """
+    Phân vị xấp xỉ = cận trên của bin chứa phân vị (bin cuối trả về mốc cuối, nghĩa là >=).
+    """
+    total = int(hist.sum())
+    if total == 0:
+        return [None for _ in qs]
+    cum = np.cumsum(hist)
+    return [float(upper_edges[int(np.searchsorted(cum, q * total, side="left"))]) for q in qs]
+
+
+def _rates(b: dict) -> dict:
+    total = b["Total"]
+    return {
+        "total": total,
+        "allow_rate": b["Allow"] / total if total else None,
+        "step_up_rate": b["StepUp"] / total if total else None,
+        "deny_rate": b["Deny"] / total if total else None,
+        "pad_pass_rate": b["PadPassed"] / b["PadTotal"] if b["PadTotal"] else None,
+        "sim_mean": b["SimSum"] / b["SimCount"] if b["SimCount"] else None,
+    }
+
+
+def _anomalies(series: List[dict], total: dict) -> List[dict]:
+    """
+    So tỉ lệ từng Decision của bucket mới nhất với phần còn lại của cửa sổ (z-score nhị thức).
+    """
+    if len(series) < 2:
+        return []
+    last = series[-1]
+    out = []
+    for col in ("Allow", "StepUp", "Deny"):
+        n_rest = total["Total"] - last["Total"]
+        if last["Total"] == 0 or n_rest <= 0:
+            continue
+        p0 = (total[col] - last[col]) / n_rest
+        p = last[col] / last["Total"]
+        se = np.sqrt(max(p0 * (1 - p0), 1e-6) / last["Total"])
+        z = (p - p0) / se
+        if abs(z) >= ANOMALY_Z:
+            out.append({"decision": col, "bucket": last["BucketStart"], "rate": p, "baseline": p0, "z": float(z)})
+    return out
+
+
+def window(name: str, purpose: str | None = None, now: int | None = None) -> dict:
+    """
+    Tổng hợp cửa sổ 1h (bucket phút) / 24h, 7d (bucket giờ).
+    """
+    if name not in WINDOWS:
+        raise ValueError(f"UnknownWindow:{name}")
+    span, grain = WINDOWS[name]
+    now = int(time.time()) if now is None else int(now)
+    start = now - now % grain - span + grain
+    sql = "SELECT * FROM MetricsRollup WHERE Grain=? AND BucketStart >= ?"
+    args: list = [grain, start]
+    if purpose:
+        sql += " AND Purpose=?"
+        args.append(purpose)
+    sql += " ORDER BY BucketStart"
+    with get_audit_conn() as c:
+        rows = c.execute(sql, args).fetchall()
+
+    total = _new_bucket()
+    by_start: Dict[int, dict] = {}
+    for r in rows:
+        b = by_start.setdefault(r["BucketStart"], {**_new_bucket(), "BucketStart": r["BucketStart"]})
+        for k in _COUNT_COLS:
+            b[k] += r[k]
+            total[k] += r[k]
+        b["SimSum"] += r["SimSum"]
+        total["SimSum"] += r["SimSum"]
+        total["SimHist"] += _hist(r["SimHist"], SIM_BINS)
+        total["DurHist"] += _hist(r["DurHist"], DUR_BINS)
+    series = [by_start[k] for k in sorted(by_start)]
+
+    dur_upper = np.append(DUR_EDGES, DUR_EDGES[-1])
+    p50, p90, p99 = _hist_quantiles(total["DurHist"], dur_upper)
+    return {
+        "window": name,
+        "grain_s": grain,
+        "from": start,
+        "to": now,
+        "purpose": purpose,
+        **_rates(total),
+        "decisions": {d: total[col] for d, col in DECISIONS.items()},
+        "duration_ms": {"p50": p50, "p90": p90, "p99": p99, "edges": DUR_EDGES.tolist(),
+                        "hist": total["DurHist"].tolist()},
+        "similarity_hist": {"bins": SIM_BINS, "range": [0.0, 1.0], "hist": total["SimHist"].tolist()},
+        "series": [{"at": b["BucketStart"], **_rates(b)} for b in series],
+        "anomalies": _anomalies(series, total),
+    }
@@ -0,0 +1,62 @@
+# app/services/nonce_ledger.py
+"""
+Chống replay cho challenge ký (jwt_token.issue_challenge): mỗi nonce (jti) chỉ dùng được 1 lần.
+
+- NONCE_LEDGER=sqlite (mặc định): bảng ConsumedNonces trong audit DB, INSERT OR IGNORE là
+  atomic giữa mọi worker -> start/submit chạy trên worker nào cũng được.
+- NONCE_LEDGER=memory: chỉ đúng khi chạy 1 process; set theo bucket thời gian hết hạn.
+- Nonce chỉ cần giữ tới khi token hết hạn (token hết hạn tự bị từ chối) -> bộ nhớ / số dòng
+  tỉ lệ với số challenge trong CHALLENGE_TTL_S, không tăng theo thời gian.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Dict, Set
+
+from ..database import queries
+
+BACKEND = os.environ.get("NONCE_LEDGER", "sqlite")   # sqlite | memory
+BUCKET_S = int(os.environ.get("NONCE_BUCKET_S", "30"))
+PRUNE_INTERVAL_S = float(os.environ.get("NONCE_PRUNE_S", "60"))
+
+_lock = threading.Lock()
+_buckets: Dict[int, Set[str]] = {}   # cận trên thời gian hết hạn của bucket -> nonces
+_pruned_at = 0.0
+
+
+def _prune(now: float) -> None:
+    global _pruned_at
+    if BACKEND == "memory":
+        for end in [e for e in _buckets if e < now]:
+            del _buckets[end]
+        return
+    if now - _pruned_at >= PRUNE_INTERVAL_S:
+        _pruned_at = now
+        queries.prune_nonces(int(now))
+
+
+def consume(nonce: str, expires_at: int) -> bool:
+    """
+    True nếu nonce chưa dùng (và đánh dấu đã dùng), False nếu là replay.
+    """
+    now = time.time()
+    if BACKEND != "memory":
+        _prune(now)
+        return queries.consume_nonce(nonce, expires_at)
+    with _lock:
+        _prune(now)
+        if any(nonce in s for s in _buckets.values()):
+            return False
+        end = -(-int(expires_at) // BUCKET_S) * BUCKET_S
+        _buckets.setdefault(end, set()).add(nonce)
+        return True
+
+
+def consumed(nonce: str) -> bool:
+    if BACKEND != "memory":
+        return queries.nonce_consumed(nonce)
+    with _lock:
+        return any(nonce in s for s in _buckets.values())
+
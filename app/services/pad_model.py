@@ -1,10 +1,12 @@
 # app/services/pad_model.py
 import os
-import base64
 import onnxruntime as ort
 import numpy as np
 import cv2
 
+from . import profiler
+from .face_detect import FaceFrame, decode_bgr, locate_face, to_bytes
+
 # ---- Config ----
 _MODEL_PATH = "models/face_antispoof.onnx"                # model PAD
 _YUNET_PATH = "models/face_detection_yunet_2023mar.onnx"  # YuNet
@@ -18,6 +20,28 @@ _EXPECT_SHAPE = None  # (N, C, H, W) hoặc dynamic
 _DET = None           # YuNet detector nếu có
 
 
+def _new_session(profile_prefix: str | None = None):
+    """
+    InferenceSession PAD; profile_prefix -> bật ORT profiling (services/profiler).
+    """
+    opts = ort.SessionOptions()
+    # Số thread intra-op cho mỗi process (0 = mặc định ORT = số core)
+    threads = int(os.environ.get("ORT_INTRA_OP_THREADS", "0"))
+    if threads > 0:
+        opts.intra_op_num_threads = threads
+    if profile_prefix:
+        opts.enable_profiling = True
+        opts.profile_file_prefix = profile_prefix
+    return ort.InferenceSession(
+        _MODEL_PATH,
+        sess_options=opts,
+        providers=["CPUExecutionProvider"],
+    )
+
+
+profiler.register_ort("pad", _new_session)
+
+
 def _ensure_session():
     """
     Khởi tạo session ONNX (PAD) + YuNet, chỉ làm 1 lần.
@@ -31,10 +55,7 @@ def _ensure_session():
                 f"[PAD] Model not found at '{_MODEL_PATH}'. "
                 "Hãy kiểm tra lại đường dẫn hoặc đặt file vào thư mục models/"
             )
-        _SESSION = ort.InferenceSession(
-            _MODEL_PATH,
-            providers=["CPUExecutionProvider"],
-        )
+        _SESSION = _new_session()
         _INPUT_NAME = _SESSION.get_inputs()[0].name
         _OUTPUT_NAME = _SESSION.get_outputs()[0].name
         _EXPECT_SHAPE = _SESSION.get_inputs()[0].shape  # [1, 3, H, W] hoặc dynamic
@@ -67,40 +88,12 @@ def init_pad_model() -> None:
     _ensure_session()
 
 
-def _decode_base64_to_bgr(image_b64: str) -> np.ndarray:
+def _crop_box(img_bgr: np.ndarray, bbox: np.ndarray) -> np.ndarray:
     """
-    Decode base64 (có thể là raw hoặc 'data:image/jpeg;base64,...') -> BGR.
-    Raise ValueError('BadImageDecode') nếu lỗi.
+    Crop bbox (x, y, w, h) kèm margin 35%.
     """
-    try:
-        # Hỗ trợ cả dataURL lẫn raw base64
-        payload = image_b64.split(",")[-1].strip()
-        data = base64.b64decode(payload, validate=False)
-        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
-        if img is None:
-            raise ValueError("BadImageDecode")
-        return img
-    except Exception as e:
-        raise ValueError(f"BadImageDecode:{e}") from e
-
-
-def _crop_face(img_bgr: np.ndarray) -> np.ndarray | None:
-    """
-    Crop khuôn mặt lớn nhất bằng YuNet (nếu có).
-    Trả None nếu không phát hiện.
-    """
-    if _DET is None:
-        return None
     h, w = img_bgr.shape[:2]
-    _DET.setInputSize((w, h))
-    ret, faces = _DET.detect(img_bgr)
-    if faces is None or len(faces) == 0:
-        return None
-
-    # Lấy face lớn nhất
-    areas = faces[:, 2] * faces[:, 3]
-    i = int(np.argmax(areas))
-    x, y, ww, hh = faces[i][:4].astype(int)
+    x, y, ww, hh = np.asarray(bbox).astype(int)
 
     # Margin khi crop
     m = int(0.35 * max(ww, hh))
@@ -111,6 +104,16 @@ def _crop_face(img_bgr: np.ndarray) -> np.ndarray | None:
     return img_bgr[y0:y1, x0:x1].copy()
 
 
+def _locate(image_b64) -> FaceFrame:
+    """
+    Decode (reduced nếu ảnh lớn) + detect 1 lần, dùng chung cho nhánh crop và no-crop.
+    """
+    if _DET is None:
+        data = to_bytes(image_b64)
+        return FaceFrame(decode_bgr(data), None, None, 0.0)
+    return locate_face(_DET, image_b64)
+
+
 def _infer_target_size() -> int:
     """
     Đoán H=W mong đợi từ shape input model. Mặc định 112 nếu không rõ.
@@ -126,25 +129,31 @@ def _infer_target_size() -> int:
     return 112  # fallback an toàn cho nhiều model anti-spoof
 
 
-def _preprocess(image_b64: str) -> np.ndarray:
+def _to_nchw(img_bgr: np.ndarray, size: int, interpolation=cv2.INTER_AREA) -> np.ndarray:
+    """
+    Resize về size x size, BGR->RGB, chuẩn hóa -> NCHW float32 [0..1].
+    """
+    img = cv2.cvtColor(cv2.resize(img_bgr, (size, size), interpolation=interpolation), cv2.COLOR_BGR2RGB)
+    x = img.astype(np.float32) / 255.0   # (H, W, 3)
+    x = np.transpose(x, (2, 0, 1))       # (3, H, W)
+    return np.expand_dims(x, axis=0)     # (1, 3, H, W)
+
+
+def _preprocess(image_b64, frame: FaceFrame | None = None) -> np.ndarray:
     """
     Decode, crop (nếu có), resize theo size model yêu cầu, chuẩn hóa -> NCHW float32 [0..1].
     """
-    img = _decode_base64_to_bgr(image_b64)
+    if frame is None:
+        frame = _locate(image_b64)
 
-    face = _crop_face(img)
-    if face is None:
+    if frame.bbox is not None:
+        face = _crop_box(frame.bgr, frame.bbox)
+    else:
         # Fallback: dùng ảnh gốc (demo). Production nên raise "NoFace" để UI báo rõ.
-        face = img
+        face = frame.bgr
 
     size = _infer_target_size()  # 112 hoặc 224
-    face = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
-    face = cv2.resize(face, (size, size), interpolation=cv2.INTER_AREA)
-
-    x = face.astype(np.float32) / 255.0  # (H, W, 3)
-    x = np.transpose(x, (2, 0, 1))       # (3, H, W)
-    x = np.expand_dims(x, axis=0)        # (1, 3, H, W)
-    return x
+    return _to_nchw(face, size)
 
 
 def _to_prob_live(out: np.ndarray) -> float:
@@ -169,36 +178,34 @@ def _to_prob_live(out: np.ndarray) -> float:
     return max(0.0, min(1.0, p_live))
 
 
-def predict_prob_live(image_b64: str) -> float:
+def predict_prob_live(image_b64: str | bytes, frame: FaceFrame | None = None) -> float:
     """
     Trả về xác suất live (0..1), lấy max giữa:
     - A) crop khuôn mặt (YuNet)
     - B) full-frame (no-crop)
+    frame: kết quả decode/detect có sẵn (face_embedding.locate) -> không detect lại.
     """
     _ensure_session()
+    session = profiler.ort_session("pad", _SESSION)
+    if frame is None:
+        frame = _locate(image_b64)
 
     # A) với crop
-    x1 = _preprocess(image_b64)
-    out1 = _SESSION.run([_OUTPUT_NAME], {_INPUT_NAME: x1})[0]
+    x1 = _preprocess(image_b64, frame)
+    out1 = session.run([_OUTPUT_NAME], {_INPUT_NAME: x1})[0]
     p1 = _to_prob_live(out1)
 
-    # B) no-crop: resize trực tiếp toàn ảnh
-    img = _decode_base64_to_bgr(image_b64)
-    size = _infer_target_size()
-    frame = cv2.cvtColor(cv2.resize(img, (size, size)), cv2.COLOR_BGR2RGB)
-    x2 = np.expand_dims(
-        np.transpose(frame.astype(np.float32) / 255.0, (2, 0, 1)),
-        0,
-    )
-    out2 = _SESSION.run([_OUTPUT_NAME], {_INPUT_NAME: x2})[0]
+    # B) no-crop: resize trực tiếp toàn ảnh (ảnh đã decode ở bước A)
+    x2 = _to_nchw(frame.bgr, _infer_target_size(), interpolation=cv2.INTER_LINEAR)
+    out2 = session.run([_OUTPUT_NAME], {_INPUT_NAME: x2})[0]
     p2 = _to_prob_live(out2)
 
     return max(p1, p2)
 
 
-def is_live(image_b64: str, threshold: float = 0.5) -> tuple[bool, float]:
+def is_live(image_b64: str | bytes, threshold: float = 0.5, frame: FaceFrame | None = None) -> tuple[bool, float]:
     """
     Trả về (ok, prob_live) với ngưỡng threshold.
     """
-    p = predict_prob_live(image_b64)
+    p = predict_prob_live(image_b64, frame)
     return p >= threshold, p
@@ -0,0 +1,59 @@
+# app/services/proc_stats.py
+"""
+Bộ nhớ của process (tools/serve, /metrics/memory).
+
+RSS đếm cả trang dùng chung với process khác (model nạp trước fork) -> cộng RSS các worker
+bị đếm trùng. PSS chia đều trang dùng chung cho các process dùng nó -> tổng PSS ~ RAM thật;
+private = trang chỉ process này dùng (cái mất đi khi worker chết).
+"""
+from __future__ import annotations
+
+import os
+
+_FIELDS = {
+    "Rss": "rss_mb",
+    "Pss": "pss_mb",
+    "Shared_Clean": "shared_clean_mb",
+    "Shared_Dirty": "shared_dirty_mb",
+    "Private_Clean": "private_clean_mb",
+    "Private_Dirty": "private_dirty_mb",
+    "Swap": "swap_mb",
+}
+
+
+def memory(pid: int | str = "self") -> dict:
+    """
+    {rss_mb, pss_mb, private_mb, ...} từ /proc/<pid>/smaps_rollup (Linux >= 4.14).
+    Không có smaps_rollup -> chỉ rss_mb (VmRSS); không phải Linux -> {}.
+    """
+    out: dict = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in _FIELDS:
+                    out[_FIELDS[key]] = round(int(rest.split()[0]) / 1024.0, 1)
+        out["private_mb"] = round(out.get("private_clean_mb", 0.0) + out.get("private_dirty_mb", 0.0), 1)
+        return out
+    except OSError:
+        pass
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    out["rss_mb"] = round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    return out
+
+
+def threads() -> dict:
+    """
+    Số thread suy luận cấu hình cho process này.
+    """
+    import cv2
+    return {
+        "ort_intra_op_threads": int(os.environ.get("ORT_INTRA_OP_THREADS", "0")),
+        "cv2_threads": cv2.getNumThreads(),
+        "affinity": sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None,
+    }
@@ -0,0 +1,294 @@
+# app/services/profiler.py
+"""
+Profile theo request, bật theo yêu cầu (opt-in).
+
+- Kích hoạt: header "X-Profile: <PROFILE_TOKEN>" hoặc lấy mẫu ngẫu nhiên PROFILE_SAMPLE_RATE,
+  chỉ với path bắt đầu bằng PROFILE_PATHS. Tắt cả hai (mặc định) -> main.py không cài middleware;
+  stage()/ort_session() chỉ còn 1 lần đọc ContextVar.
+- Mỗi request được profile có:
+  * stack sampler: thread lấy sys._current_frames() của các thread đang xử lý request mỗi
+    PROFILE_INTERVAL_MS ms -> stack dạng folded (flamegraph.pl / speedscope);
+  * timer theo stage (with stage("pad"): ...) ghi trong contextvar, đi theo request vào threadpool;
+  * ORT profiling của session PAD: dùng 1 session bật enable_profiling đã nạp sẵn (ORT không bật/tắt
+    profiling theo lần run được), xong request thì end_profiling() và nạp session mới ở nền.
+- Kết quả: PROFILE_DIR/<id>.json (+ .folded, .ort_<tên>.json), giữ PROFILE_KEEP profile mới nhất.
+  Request lấy mẫu chỉ được giữ khi chậm hơn PROFILE_SLOW_MS; request bật bằng header luôn được giữ.
+"""
+from __future__ import annotations
+
+import contextvars
+import hmac
+import json
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Dict, List
+
+SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PATHS = tuple(p for p in os.environ.get("PROFILE_PATHS", "/auth/").split(",") if p)
+DIR = os.environ.get("PROFILE_DIR", "profiles")
+KEEP = int(os.environ.get("PROFILE_KEEP", "200"))
+SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "500"))
+INTERVAL_S = float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000.0
+ORT_PROFILING = os.environ.get("PROFILE_ORT", "1") == "1"
+
+ENABLED = SAMPLE_RATE > 0 or bool(TOKEN)
+HEADER = "x-profile"
+
+_current: contextvars.ContextVar = contextvars.ContextVar("profile", default=None)
+_lock = threading.Lock()
+_ort_factories: Dict[str, Callable[[str], object]] = {}
+_armed: Dict[str, object] = {}
+_arming: set = set()
+
+
+class _Noop:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _Noop()
+
+
+class Profile:
+    def __init__(self, method: str, path: str, trigger: str):
+        self.id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.t0 = time.perf_counter()
+        self.stages: List[tuple] = []        # (tên, bắt đầu ms, thời lượng ms)
+        self.threads: set = set()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.ort: Dict[str, object] = {}
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name=f"profile-{self.id}", daemon=True)
+
+    def _sample(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(INTERVAL_S):
+            frames = sys._current_frames()
+            for tid in list(self.threads):
+                f = frames.get(tid) if tid != me else None
+                stack = []
+                while f is not None:
+                    code = f.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    f = f.f_back
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+                    self.samples += 1
+
+    def summary(self, status: int, duration_ms: float) -> dict:
+        totals: Dict[str, dict] = {}
+        for name, _, ms in self.stages:
+            t = totals.setdefault(name, {"ms": 0.0, "count": 0})
+            t["ms"] = round(t["ms"] + ms, 3)
+            t["count"] += 1
+        return {
+            "id": self.id,
+            "at": int(time.time()),
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "trigger": self.trigger,
+            "duration_ms": round(duration_ms, 3),
+            "stage_totals": totals,
+            "stages": [{"name": n, "start_ms": round(s, 3), "ms": round(d, 3)} for n, s, d in self.stages],
+            "samples": self.samples,
+            "interval_ms": INTERVAL_S * 1000.0,
+            "ort": sorted(self.ort),
+        }
+
+
+class _Stage:
+    __slots__ = ("p", "name", "t0")
+
+    def __init__(self, p: Profile, name: str):
+        self.p = p
+        self.name = name
+
+    def __enter__(self):
+        self.p.threads.add(threading.get_ident())
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        t1 = time.perf_counter()
+        self.p.stages.append((self.name, (self.t0 - self.p.t0) * 1000.0, (t1 - self.t0) * 1000.0))
+        return False
+
+
+def stage(name: str):
+    """
+    Timer cho 1 stage của request đang được profile; không profile -> no-op dùng chung.
+    """
+    p = _current.get()
+    return _NOOP if p is None else _Stage(p, name)
+
+
+# ---------- ONNX Runtime ----------
+
+def register_ort(name: str, factory: Callable[[str], object]) -> None:
+    """
+    factory(prefix) -> InferenceSession bật enable_profiling, file profile bắt đầu bằng prefix.
+    """
+    _ort_factories[name] = factory
+
+
+def _arm(name: str) -> None:
+    try:
+        os.makedirs(DIR, exist_ok=True)
+        sess = _ort_factories[name](os.path.join(DIR, f".ort_{name}"))
+        with _lock:
+            _armed[name] = sess
+    except Exception as e:
+        print(f"[PROFILE] ORT session '{name}' unavailable: {e}")
+    finally:
+        with _lock:
+            _arming.discard(name)
+
+
+def _arm_async(name: str) -> None:
+    with _lock:
+        if name in _armed or name in _arming or name not in _ort_factories:
+            return
+        _arming.add(name)
+    threading.Thread(target=_arm, args=(name,), daemon=True).start()
+
+
+def ort_session(name: str, default):
+    """
+    Session ORT cho request hiện tại: bản bật profiling nếu request đang được profile
+    (và có sẵn), ngược lại default.
+    """
+    p = _current.get()
+    if p is None or not ORT_PROFILING:
+        return default
+    sess = p.ort.get(name)
+    if sess is None:
+        with _lock:
+            sess = _armed.pop(name, None)
+        if sess is None:
+            _arm_async(name)   # chưa nạp / request khác đang dùng
+            return default
+        p.ort[name] = sess
+    return sess
+
+
+# ---------- middleware ----------
+
+def _trigger(request) -> str | None:
+    if not request.url.path.startswith(PATHS):
+        return None
+    token = request.headers.get(HEADER)
+    if TOKEN and token and hmac.compare_digest(token.encode(), TOKEN.encode()):
+        return "header"
+    if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+def _rotate() -> None:
+    names = os.listdir(DIR)
+    ids = sorted(f[:-5] for f in names if f.endswith(".json") and ".ort_" not in f and not f.startswith("."))
+    old = set(ids[:-KEEP]) if KEEP > 0 else set()
+    now = time.time()
+    for f in names:
+        path = os.path.join(DIR, f)
+        # .ort_*: session đã nạp sẵn nhưng bị hủy không qua end_profiling (worker thoát)
+        if f.split(".", 1)[0] in old or (f.startswith(".ort_") and now - os.path.getmtime(path) > 60):
+            os.remove(path)
+
+
+def _write(p: Profile, status: int, duration_ms: float) -> None:
+    p._sampler.join(timeout=1.0)
+    keep = p.trigger == "header" or duration_ms >= SLOW_MS
+    os.makedirs(DIR, exist_ok=True)
+    for name, sess in p.ort.items():
+        try:
+            src = sess.end_profiling()
+            if keep:
+                shutil.move(src, os.path.join(DIR, f"{p.id}.ort_{name}.json"))
+            else:
+                os.remove(src)
+        except Exception as e:
+            print(f"[PROFILE] ORT profile '{name}' failed: {e}")
+        _arm_async(name)
+    if not keep:
+        return
+    with open(os.path.join(DIR, f"{p.id}.folded"), "w", encoding="utf-8") as f:
+        for stack, n in p.stacks.most_common():
+            f.write(f"{stack} {n}\n")
+    tmp = os.path.join(DIR, f".{p.id}.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(p.summary(status, duration_ms), f, indent=2)
+    os.replace(tmp, os.path.join(DIR, f"{p.id}.json"))
+    _rotate()
+
+
+async def middleware(request, call_next):
+    trigger = _trigger(request)
+    if trigger is None:
+        return await call_next(request)
+    from starlette.concurrency import run_in_threadpool
+
+    p = Profile(request.method, request.url.path, trigger)
+    token = _current.set(p)
+    p._sampler.start()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Profile-Id"] = p.id
+        return response
+    finally:
+        duration_ms = (time.perf_counter() - p.t0) * 1000.0
+        p._stop.set()
+        _current.reset(token)
+        await run_in_threadpool(_write, p, status, duration_ms)
+
+
+# ---------- đọc (admin) ----------
+
+def list_profiles(min_ms: float = 0.0, limit: int = 50) -> List[dict]:
+    """
+    Profile mới nhất trước, chỉ những request >= min_ms.
+    """
+    if not os.path.isdir(DIR):
+        return []
+    out = []
+    for f in sorted((f for f in os.listdir(DIR) if f.endswith(".json") and ".ort_" not in f
+                     and not f.startswith(".")), reverse=True):
+        try:
+            with open(os.path.join(DIR, f), encoding="utf-8") as fh:
+                s = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        if s.get("duration_ms", 0.0) >= min_ms:
+            s.pop("stages", None)
+            out.append(s)
+            if len(out) >= limit:
+                break
+    return out
+
+
+def profile_file(profile_id: str, kind: str) -> str | None:
+    """
+    kind: summary | folded | ort_<tên>. None nếu không có / id không hợp lệ.
+    """
+    if not profile_id.replace("-", "").isalnum() or not kind.replace("_", "").isalnum():
+        return None
+    name = {"summary": f"{profile_id}.json", "folded": f"{profile_id}.folded"}.get(kind, f"{profile_id}.{kind}.json")
+    path = os.path.join(DIR, name)
+    return path if os.path.isfile(path) else None
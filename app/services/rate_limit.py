@@ -0,0 +1,157 @@
+# app/services/rate_limit.py
+"""
+Giới hạn tần suất (token bucket) trước khi chạy PAD/SFace/PBKDF2.
+
+- Bucket theo IP, user id và email; mỗi request trừ 1 token ở mọi bucket liên quan
+  (tất cả hoặc không: request bị chặn không làm cạn bucket khác).
+- Giới hạn dạng "N/S": tối đa N request dồn dập, hồi N token mỗi S giây.
+- RATE_LIMIT_BACKEND=memory (mặc định): dict trong process, O(1) / lần kiểm tra; bucket đã đầy lại
+  được dọn mỗi RATE_LIMIT_SWEEP_S giây. Nhiều worker -> mỗi worker giới hạn riêng.
+  RATE_LIMIT_BACKEND=sqlite: bảng RateBuckets trong audit DB, dùng chung mọi worker.
+- Request bị chặn ghi AuthLogs (attack_type "rate_limited"), tối đa 1 dòng / key / RATE_LIMIT_LOG_S giây
+  để đợt credential stuffing không biến thành đợt ghi log.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Tuple
+
+from ..database import queries
+
+ENABLED = os.environ.get("RATE_LIMIT", "1") == "1"
+BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")   # memory | sqlite
+SWEEP_S = float(os.environ.get("RATE_LIMIT_SWEEP_S", "60"))
+LOG_INTERVAL_S = float(os.environ.get("RATE_LIMIT_LOG_S", "10"))
+
+
+def _parse(spec: str) -> Tuple[float, float]:
+    """
+    "N/S" -> (capacity, token/giây).
+    """
+    n, _, s = spec.partition("/")
+    capacity, period = float(n), float(s or 1)
+    if capacity < 1 or period <= 0:
+        raise ValueError(f"BadRateLimit:{spec}")
+    return capacity, capacity / period
+
+
+LIMITS: Dict[str, Tuple[float, float]] = {
+    "ip": _parse(os.environ.get("RATE_LIMIT_IP", "60/60")),
+    "user": _parse(os.environ.get("RATE_LIMIT_USER", "20/60")),
+    "email": _parse(os.environ.get("RATE_LIMIT_EMAIL", "10/60")),
+}
+
+
+class Rejection(NamedTuple):
+    scope: str          # ip | user | email
+    key: str            # "<scope>:<giá trị>"
+    retry_after: float  # giây
+
+
+class RateLimited(Exception):
+    """
+    Raise bởi enforce(); main.py đổi thành 429 + Retry-After.
+    """
+    def __init__(self, rejection: Rejection):
+        super().__init__(f"RateLimited:{rejection.scope}")
+        self.rejection = rejection
+
+    @property
+    def detail(self) -> dict:
+        return {"error": "RateLimited", "scope": self.rejection.scope,
+                "retry_after": round(self.rejection.retry_after, 1)}
+
+
+_lock = threading.Lock()
+_buckets: Dict[str, List[float]] = {}     # key -> [tokens, updated_at]
+_logged: Dict[str, float] = {}            # key -> lần ghi AuthLogs gần nhất
+_swept_at = 0.0
+rejected = 0
+
+
+def _sweep(now: float) -> None:
+    global _swept_at
+    if now - _swept_at < SWEEP_S:
+        return
+    _swept_at = now
+    if BACKEND == "sqlite":
+        queries.prune_rate_buckets(now)
+    for key, (tokens, at) in list(_buckets.items()):
+        capacity, rate = LIMITS[key.split(":", 1)[0]]
+        if tokens + (now - at) * rate >= capacity:
+            del _buckets[key]
+    for key in [k for k, at in _logged.items() if now - at >= LOG_INTERVAL_S]:
+        del _logged[key]
+
+
+def _take_memory(rules, now: float):
+    buckets = []
+    for key, capacity, rate in rules:
+        b = _buckets.get(key)
+        tokens = capacity if b is None else min(capacity, b[0] + (now - b[1]) * rate)
+        if tokens < 1.0:
+            return key, (1.0 - tokens) / rate
+        buckets.append((key, tokens - 1.0))
+    for key, tokens in buckets:
+        _buckets[key] = [tokens, now]
+    return None
+
+
+def check(ip: str | None = None, user_id: int | None = None, email: str | None = None) -> Rejection | None:
+    """
+    Trừ 1 token cho mỗi khóa có mặt. None = cho qua.
+    """
+    if not ENABLED:
+        return None
+    keys = [("ip", ip), ("user", user_id), ("email", email.strip().lower() if email else None)]
+    rules = [(f"{scope}:{value}",) + LIMITS[scope] for scope, value in keys if value is not None]
+    if not rules:
+        return None
+    now = time.time()
+    with _lock:
+        _sweep(now)
+        hit = _take_memory(rules, now) if BACKEND != "sqlite" else None
+    if BACKEND == "sqlite":
+        hit = queries.take_rate_tokens(rules, now)
+    if hit is None:
+        return None
+    return Rejection(hit[0].split(":", 1)[0], hit[0], hit[1])
+
+
+def record(rej: Rejection, purpose: str, ip: str | None = None, user_id: int | None = None) -> None:
+    """
+    Ghi AuthLogs cho request bị chặn (lấy mẫu theo bucket đã cạn).
+    """
+    global rejected
+    now = time.time()
+    with _lock:
+        rejected += 1
+        if now - _logged.get(rej.key, 0.0) < LOG_INTERVAL_S:
+            return
+        _logged[rej.key] = now
+    try:
+        queries.add_log(user_id, None, "DENY", None, purpose, ip=ip, attack_type="rate_limited")
+    except Exception as e:
+        print(f"[RATE] add_log failed: {e}")
+
+
+def enforce(purpose: str, ip: str | None = None, user_id: int | None = None, email: str | None = None) -> None:
+    """
+    check() + ghi log; raise RateLimited nếu bị chặn. Gọi trước mọi bước decode ảnh / hash mật khẩu.
+    """
+    rej = check(ip, user_id, email)
+    if rej is not None:
+        record(rej, purpose, ip, user_id)
+        raise RateLimited(rej)
+
+
+def stats() -> dict:
+    return {
+        "enabled": ENABLED,
+        "backend": BACKEND,
+        "buckets": len(_buckets),
+        "rejected": rejected,
+        "limits": {k: {"capacity": c, "per_s": r} for k, (c, r) in LIMITS.items()},
+    }
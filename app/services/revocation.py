@@ -0,0 +1,96 @@
+# app/services/revocation.py
+"""
+Index thu hồi token (jti) trong bộ nhớ cho jwt_token.verify.
+
+- is_revoked(): tra dict O(1), không chạm DB trên đường nóng.
+- Giữa các worker: bảng RevokedTokens (Seq tăng dần), mỗi worker đọc các dòng mới
+  tối đa mỗi REVOCATION_SYNC_S giây -> thu hồi có hiệu lực ở worker khác sau ~REVOCATION_SYNC_S giây,
+  ở worker gọi revoke() thì ngay lập tức.
+- Chỉ giữ jti chưa hết hạn: bộ nhớ tỉ lệ với số token thu hồi trong JWT EXP, không tăng theo thời gian.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Dict
+
+from ..database import queries
+
+SYNC_INTERVAL_S = float(os.environ.get("REVOCATION_SYNC_S", "1.0"))
+PRUNE_INTERVAL_S = float(os.environ.get("REVOCATION_PRUNE_S", "60"))
+_SYNC_BATCH = 5000
+
+_revoked: Dict[str, int] = {}   # jti -> exp
+_sync_lock = threading.Lock()
+_seq = 0
+_synced_at = None
+_pruned_at = 0.0
+
+
+def _prune(now: float) -> None:
+    global _pruned_at
+    if now - _pruned_at < PRUNE_INTERVAL_S:
+        return
+    _pruned_at = now
+    # Snapshot: add_local() ghi vào dict từ thread khác, không dùng chung lock
+    for jti in [j for j, exp in list(_revoked.items()) if exp < now]:
+        _revoked.pop(jti, None)
+    queries.prune_revocations(int(now))
+
+
+def _sync() -> None:
+    """
+    Nạp các dòng RevokedTokens mới (giới hạn tần suất, không chặn thread khác).
+    """
+    global _seq, _synced_at
+    mono = time.monotonic()
+    if _synced_at is not None and mono - _synced_at < SYNC_INTERVAL_S:
+        return
+    if not _sync_lock.acquire(blocking=False):
+        return   # thread khác đang sync
+    try:
+        _synced_at = mono
+        now = time.time()
+        while True:
+            rows = queries.get_revocations(_seq, int(now), _SYNC_BATCH)
+            for r in rows:
+                _revoked[r["Jti"]] = int(r["ExpiresAt"])
+            if rows:
+                _seq = int(rows[-1]["Seq"])
+            if len(rows) < _SYNC_BATCH:
+                break
+        _prune(now)
+    finally:
+        _sync_lock.release()
+
+
+def is_revoked(jti: str | None) -> bool:
+    if not jti:
+        return False
+    _sync()
+    return jti in _revoked
+
+
+def add_local(jti: str, expires_at: int) -> None:
+    """
+    Đánh dấu thu hồi trong process (không ghi DB).
+    """
+    _revoked[jti] = int(expires_at)
+
+
+def revoke(jti: str, expires_at: int, reason: str | None = None) -> bool:
+    """
+    Ghi RevokedTokens + cập nhật index local. False nếu jti đã bị thu hồi.
+    """
+    fresh = queries.revoke_token(jti, expires_at, reason)
+    add_local(jti, expires_at)
+    return fresh
+
+
+def stats() -> dict:
+    return {
+        "revoked": len(_revoked),
+        "seq": _seq,
+        "sync_interval_s": SYNC_INTERVAL_S,
+    }
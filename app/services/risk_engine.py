@@ -1,15 +1,143 @@
+# app/services/risk_engine.py
+"""
+Ngưỡng quyết định ALLOW / STEP_UP / DENY theo purpose + ngưỡng PAD theo pose lúc enroll
++ ngưỡng chất lượng frame theo pose (services/frame_quality).
+
+- Giá trị mặc định bên dưới; nếu có file ngưỡng (RISK_THRESHOLDS_FILE, sinh bởi
+  tools/calibrate_thresholds) thì dùng file, tự nạp lại khi file đổi (kiểm tra mtime
+  tối đa mỗi RISK_THRESHOLDS_RELOAD_S giây) -> đổi policy không cần restart worker.
+- Policy là 1 dict không sửa sau khi tạo; nạp lại = thay tham chiếu _POLICY (atomic),
+  request đang chạy vẫn thấy trọn 1 policy cũ hoặc mới.
+- File lỗi / không hợp lệ: giữ policy đang dùng.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+
 PASS_LOGIN      = 0.80
 STEPUP_LOGIN    = 0.70
 
 PASS_PAYMENT    = 0.83   # chặt hơn cho giao dịch
 STEPUP_PAYMENT  = 0.78
 
+# Ngưỡng PAD theo pose lúc enroll (front bắt buộc pass)
+POSE_THRESHOLDS = {"front": 0.50, "left": 0.25, "right": 0.25}
+
+# Ngưỡng chất lượng frame theo pose (frame_quality), chạy trước PAD/SFace:
+# min_face: cạnh bbox nhỏ nhất (px), min_score: điểm YuNet, min_blur: variance Laplacian
+# trên mặt resize 112x112, brightness: độ sáng trung bình mặt [min, max] (0..255),
+# yaw: |độ lệch mũi so với giữa 2 mắt| / khoảng cách 2 mắt, trong [min, max]
+QUALITY_THRESHOLDS = {
+    "front": {"min_face": 64, "min_score": 0.70, "min_blur": 20.0, "brightness": [40, 220], "yaw": [0.0, 0.25]},
+    "left":  {"min_face": 64, "min_score": 0.65, "min_blur": 20.0, "brightness": [40, 220], "yaw": [0.12, 1.5]},
+    "right": {"min_face": 64, "min_score": 0.65, "min_blur": 20.0, "brightness": [40, 220], "yaw": [0.12, 1.5]},
+}
+
+THRESHOLDS_FILE = os.environ.get("RISK_THRESHOLDS_FILE", "thresholds.json")
+RELOAD_INTERVAL_S = float(os.environ.get("RISK_THRESHOLDS_RELOAD_S", "2"))
+
+PURPOSES = ("LOGIN", "PAYMENT")
+
+DEFAULT_POLICY = {
+    "version": 0,
+    "purposes": {
+        "LOGIN": {"pass": PASS_LOGIN, "stepup": STEPUP_LOGIN},
+        "PAYMENT": {"pass": PASS_PAYMENT, "stepup": STEPUP_PAYMENT},
+    },
+    "pose_pad": dict(POSE_THRESHOLDS),
+    "quality": QUALITY_THRESHOLDS,
+}
+
+_POLICY = DEFAULT_POLICY
+_MTIME = None        # mtime_ns của file đã nạp (None = đang dùng mặc định)
+_CHECKED_AT = 0.0
+
+
+def validate_policy(policy: dict) -> dict:
+    """
+    Kiểm tra + chuẩn hóa policy đọc từ file. Raise ValueError nếu không hợp lệ.
+    Thiếu mục nào thì lấy từ DEFAULT_POLICY.
+    """
+    purposes = {}
+    for purpose in PURPOSES:
+        p = dict(DEFAULT_POLICY["purposes"][purpose])
+        p.update((policy.get("purposes") or {}).get(purpose) or {})
+        t_pass, t_step = float(p["pass"]), float(p["stepup"])
+        if not (-1.0 <= t_step <= t_pass <= 1.0):
+            raise ValueError(f"BadThresholds:{purpose}")
+        purposes[purpose] = {"pass": t_pass, "stepup": t_step}
+    pose_pad = dict(DEFAULT_POLICY["pose_pad"])
+    pose_pad.update(policy.get("pose_pad") or {})
+    for pose, t in pose_pad.items():
+        if not 0.0 <= float(t) <= 1.0:
+            raise ValueError(f"BadPadThreshold:{pose}")
+    quality = {}
+    for pose, defaults in DEFAULT_POLICY["quality"].items():
+        q = dict(defaults)
+        q.update((policy.get("quality") or {}).get(pose) or {})
+        lo_b, hi_b = (float(x) for x in q["brightness"])
+        lo_y, hi_y = (float(x) for x in q["yaw"])
+        if not (0.0 <= lo_b <= hi_b <= 255.0 and 0.0 <= lo_y <= hi_y):
+            raise ValueError(f"BadQualityThreshold:{pose}")
+        quality[pose] = {
+            "min_face": float(q["min_face"]),
+            "min_score": float(q["min_score"]),
+            "min_blur": float(q["min_blur"]),
+            "brightness": [lo_b, hi_b],
+            "yaw": [lo_y, hi_y],
+        }
+    return {
+        "version": int(policy.get("version", 0)),
+        "purposes": purposes,
+        "pose_pad": {k: float(v) for k, v in pose_pad.items()},
+        "quality": quality,
+    }
+
+
+def _maybe_reload() -> None:
+    global _POLICY, _MTIME, _CHECKED_AT
+    now = time.monotonic()
+    if now - _CHECKED_AT < RELOAD_INTERVAL_S:
+        return
+    _CHECKED_AT = now
+    try:
+        mtime = os.stat(THRESHOLDS_FILE).st_mtime_ns
+    except OSError:
+        if _MTIME is not None:
+            print(f"[RISK] {THRESHOLDS_FILE} removed, back to defaults")
+            _POLICY, _MTIME = DEFAULT_POLICY, None
+        return
+    if mtime == _MTIME:
+        return
+    try:
+        with open(THRESHOLDS_FILE, "r", encoding="utf-8") as f:
+            policy = validate_policy(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"[RISK] ignoring {THRESHOLDS_FILE}: {e}")
+        _MTIME = mtime   # không đọc lại file lỗi cho tới khi nó đổi
+        return
+    _POLICY, _MTIME = policy, mtime
+    print(f"[RISK] thresholds v{policy['version']} loaded: {policy['purposes']}")
+
+
+def current_policy() -> dict:
+    _maybe_reload()
+    return _POLICY
+
+
+def pose_thresholds() -> dict:
+    return current_policy()["pose_pad"]
+
+
+def quality_thresholds(pose: str) -> dict:
+    q = current_policy()["quality"]
+    return q.get(pose) or q["front"]
+
+
 def decide(sim: float, purpose: str = "LOGIN"):
-    if purpose == "PAYMENT":
-        if sim >= PASS_PAYMENT: return "ALLOW"
-        if sim >= STEPUP_PAYMENT: return "STEP_UP"
-        return "DENY"
-    else:
-        if sim >= PASS_LOGIN: return "ALLOW"
-        if sim >= STEPUP_LOGIN: return "STEP_UP"
-        return "DENY"
+    th = current_policy()["purposes"]["PAYMENT" if purpose == "PAYMENT" else "LOGIN"]
+    if sim >= th["pass"]: return "ALLOW"
+    if sim >= th["stepup"]: return "STEP_UP"
+    return "DENY"
@@ -0,0 +1,109 @@
+# app/services/scoring.py
+"""
+Kernel chấm điểm dùng chung cho verify 1:1 và search 1:N.
+
+- Vector lưu trong DB đã là unit-norm (queries chuẩn hóa lúc ghi), probe từ
+  face_embedding cũng vậy -> cosine = tích vô hướng, M probes x N templates = 1 phép matmul.
+- ensure_unit() chỉ chuẩn hóa lại khi có dòng lệch khỏi norm 1 (dữ liệu cũ chưa migrate).
+"""
+from __future__ import annotations
+
+import os
+from typing import Sequence, Tuple
+
+import numpy as np
+
+UNIT_TOL = 1e-2   # i8 lượng tử hóa lệch norm ~1e-3, vector chưa chuẩn hóa lệch xa hơn nhiều
+SEARCH_CHUNK = int(os.environ.get("SEARCH_CHUNK_ROWS", "65536"))
+
+
+def l2_normalize(x) -> np.ndarray:
+    """
+    Chuẩn hóa L2 theo dòng (1-D: cả vector), trả về float32.
+    """
+    x = np.asarray(x, dtype=np.float32)
+    if x.ndim == 1:
+        return x / (np.linalg.norm(x) + 1e-9)
+    return x / (np.linalg.norm(x, axis=1, keepdims=True) + 1e-9)
+
+
+def ensure_unit(x) -> np.ndarray:
+    """
+    Trả lại chính mảng nếu mọi dòng đã unit-norm (sai số UNIT_TOL), ngược lại bản đã chuẩn hóa.
+    """
+    x = np.asarray(x, dtype=np.float32)
+    sq = np.einsum("...d,...d->...", x, x)
+    if np.all(np.abs(sq - 1.0) <= 2 * UNIT_TOL):
+        return x
+    return l2_normalize(x)
+
+
+def score_matrix(probes, templates) -> np.ndarray:
+    """
+    (M, D) x (N, D) -> (M, N) cosine. Đầu vào phải unit-norm.
+    """
+    p = np.asarray(probes, dtype=np.float32)
+    t = np.asarray(templates, dtype=np.float32)
+    if p.ndim == 1:
+        p = p[None, :]
+    if t.ndim == 1:
+        t = t[None, :]
+    if p.shape[1] != t.shape[1]:
+        raise ValueError(f"DimMismatch:{p.shape[1]}_vs_{t.shape[1]}")
+    return p @ t.T
+
+
+def pose_scores(
+    probes,
+    probe_poses: Sequence[str],
+    templates,
+    template_poses: Sequence[str],
+    mode: str = "max",
+    k: int = 2,
+) -> np.ndarray:
+    """
+    Điểm của mỗi probe với các template cùng pose -> (M,).
+    mode='max': max; mode='topk': trung bình k điểm cao nhất.
+    """
+    s = score_matrix(ensure_unit(probes), ensure_unit(templates))   # 1 phép nhân cho mọi pose
+    mask = np.asarray(probe_poses)[:, None] == np.asarray(template_poses)[None, :]
+    s = np.where(mask, s, -np.inf)
+    if mode == "topk":
+        kk = max(1, min(k, s.shape[1]))
+        top = -np.partition(-s, kk - 1, axis=1)[:, :kk]
+        cnt = np.sum(np.isfinite(top), axis=1)
+        top = np.where(np.isfinite(top), top, 0.0)
+        return np.sum(top, axis=1) / np.maximum(cnt, 1)
+    return np.max(s, axis=1)
+
+
+def top_k(probes, gallery, k: int = 10, chunk: int | None = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Search 1:N: (M, D) probes trên gallery (N, D) unit-norm -> (chỉ số (M, k), điểm (M, k)),
+    giảm dần. Gallery lớn được nhân theo chunk để giới hạn bộ nhớ (M x chunk).
+    """
+    p = np.asarray(probes, dtype=np.float32)
+    if p.ndim == 1:
+        p = p[None, :]
+    g = np.asarray(gallery, dtype=np.float32)
+    n = g.shape[0]
+    k = max(0, min(k, n))
+    chunk = chunk or SEARCH_CHUNK
+    best_s = np.full((p.shape[0], 0), -np.inf, dtype=np.float32)
+    best_i = np.zeros((p.shape[0], 0), dtype=np.int64)
+    for start in range(0, n, chunk):
+        s = score_matrix(p, g[start:start + chunk])
+        if s.shape[1] > k:
+            part = np.argpartition(-s, k - 1, axis=1)[:, :k]
+            s = np.take_along_axis(s, part, axis=1)
+            idx = part + start
+        else:
+            idx = np.broadcast_to(np.arange(start, start + s.shape[1]), s.shape)
+        best_s = np.concatenate([best_s, s], axis=1)
+        best_i = np.concatenate([best_i, idx], axis=1)
+        if best_s.shape[1] > k:
+            part = np.argpartition(-best_s, k - 1, axis=1)[:, :k]
+            best_s = np.take_along_axis(best_s, part, axis=1)
+            best_i = np.take_along_axis(best_i, part, axis=1)
+    order = np.argsort(-best_s, axis=1)
+    return np.take_along_axis(best_i, order, axis=1), np.take_along_axis(best_s, order, axis=1)
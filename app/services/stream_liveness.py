@@ -0,0 +1,157 @@
+# app/services/stream_liveness.py
+"""
+Liveness theo luồng frame (burst / WebSocket), mỗi pose 1 PoseStream.
+
+- Hàng đợi frame có giới hạn (STREAM_BUFFER, phía route WebSocket); lấy mẫu: chỉ xử lý
+  1 / STREAM_SAMPLE_EVERY frame nhận được; tối đa STREAM_MAX_FRAMES frame / pose.
+- Tracking: detect trong ROI quanh bbox frame trước (face_detect.track_face), mất dấu mới detect full.
+- Frame không đạt frame_quality bị bỏ qua (đếm theo reason), không làm hỏng cả luồng.
+- PAD theo thời gian: trung bình p_live của STREAM_WINDOW frame gần nhất + khoảng tin cậy
+  mean ± z·se. Quyết định sớm: cận dưới >= ngưỡng -> live, cận trên < ngưỡng -> spoof.
+  Hết frame mà chưa chắc chắn -> so trung bình với ngưỡng.
+- Embedding chỉ chạy trên tối đa STREAM_EMBED_FRAMES frame nét nhất mà TỰ pass PAD (p_live >= ngưỡng);
+  verify lấy similarity nhỏ nhất giữa các frame đó. PAD trung bình cao không đủ để 1 frame
+  spoof nét (ảnh in của nạn nhân chen vào luồng mặt thật) được dùng làm probe.
+"""
+from __future__ import annotations
+
+import math
+import os
+from collections import deque
+from typing import Dict, List, Tuple
+
+from . import face_embedding, frame_quality
+from .face_detect import FaceFrame, normalized_box
+from .pad_model import predict_prob_live
+
+SAMPLE_EVERY = int(os.environ.get("STREAM_SAMPLE_EVERY", "2"))
+MAX_FRAMES = int(os.environ.get("STREAM_MAX_FRAMES", "30"))
+MIN_FRAMES = int(os.environ.get("STREAM_MIN_FRAMES", "3"))
+WINDOW = int(os.environ.get("STREAM_WINDOW", "10"))
+PAD_THRESHOLD = float(os.environ.get("STREAM_PAD_THRESHOLD", "0.5"))
+CONFIDENCE_Z = float(os.environ.get("STREAM_CONFIDENCE_Z", "1.64"))
+EMBED_FRAMES = max(1, int(os.environ.get("STREAM_EMBED_FRAMES", "2")))
+# WebSocket: hàng đợi frame chờ xử lý (đầy -> bỏ frame cũ nhất), thời gian chờ frame tối đa
+BUFFER = int(os.environ.get("STREAM_BUFFER", "8"))
+TIMEOUT_S = float(os.environ.get("STREAM_TIMEOUT_S", "30"))
+# Sàn cho độ lệch chuẩn: vài frame giống hệt nhau không được coi là chắc chắn tuyệt đối
+_MIN_STD = 0.05
+
+
+class PoseStream:
+    def __init__(self, pose: str):
+        self.pose = pose
+        self.received = 0
+        self.detections = 0
+        self.tracked = 0
+        self.rejected: Dict[str, int] = {}
+        self.probs: deque = deque(maxlen=WINDOW)
+        self.scored = 0
+        self.accepted: List[Tuple[float, FaceFrame]] = []   # (blur, frame) pass PAD, nét nhất trước
+        self._fallback: Tuple[float, FaceFrame] | None = None  # nét nhất bất kể PAD (pose spoof)
+        self._box = None
+        self.decision: str | None = None   # "live" | "spoof" | None (đang thu)
+        self.early = False
+
+    def _locate(self, image) -> FaceFrame:
+        if self._box is not None:
+            frame = face_embedding.track(image, self._box)
+            if frame.bbox is not None:
+                self.tracked += 1
+                return frame
+        self.detections += 1
+        return face_embedding.locate(image)
+
+    def feed(self, image) -> str | None:
+        """
+        Nhận 1 frame. Trả về quyết định của pose (None = cần thêm frame).
+        """
+        if self.decision is not None:
+            return self.decision
+        self.received += 1
+        if (self.received - 1) % SAMPLE_EVERY == 0:
+            self._process(image)
+        if self.decision is None and self.received >= MAX_FRAMES:
+            self.finish()
+        return self.decision
+
+    def _process(self, image) -> None:
+        try:
+            frame = self._locate(image)
+        except ValueError:
+            self.rejected["BadImageDecode"] = self.rejected.get("BadImageDecode", 0) + 1
+            return
+        self._box = normalized_box(frame)
+        q = frame_quality.assess(frame, self.pose)
+        if not q.ok:
+            self.rejected[q.reason] = self.rejected.get(q.reason, 0) + 1
+            return
+        p_live = float(predict_prob_live(image, frame))
+        self.probs.append(p_live)
+        self.scored += 1
+        blur = float(q.metrics["blur"])
+        if self._fallback is None or blur > self._fallback[0]:
+            self._fallback = (blur, frame)
+        if p_live >= PAD_THRESHOLD:
+            self.accepted.append((blur, frame))
+            self.accepted.sort(key=lambda t: -t[0])
+            del self.accepted[EMBED_FRAMES:]
+        self.decision = self._decide()
+        self.early = self.decision is not None
+
+    def _bounds(self):
+        n = len(self.probs)
+        mean = sum(self.probs) / n
+        var = sum((p - mean) ** 2 for p in self.probs) / max(n - 1, 1)
+        se = max(math.sqrt(var), _MIN_STD) / math.sqrt(n)
+        return mean, mean - CONFIDENCE_Z * se, mean + CONFIDENCE_Z * se
+
+    def _decide(self) -> str | None:
+        if len(self.probs) < MIN_FRAMES:
+            return None
+        _, lo, hi = self._bounds()
+        if lo >= PAD_THRESHOLD:
+            return "live"
+        if hi < PAD_THRESHOLD:
+            return "spoof"
+        return None
+
+    def finish(self) -> str:
+        """
+        Kết thúc pose (hết frame / client chuyển pose): quyết định theo trung bình.
+        """
+        if self.decision is None:
+            if not self.probs:
+                self.decision = "spoof"
+            else:
+                self.decision = "live" if self._bounds()[0] >= PAD_THRESHOLD else "spoof"
+        return self.decision
+
+    def probe_frames(self) -> List[FaceFrame]:
+        """
+        Frame dùng để embed: các frame nét nhất đã pass PAD. Không frame nào pass (pose bị
+        quyết định spoof) -> frame nét nhất, chỉ để báo similarity, pose vẫn fail PAD.
+        """
+        if self.accepted:
+            return [f for _, f in self.accepted]
+        if self.decision == "spoof" and self._fallback is not None:
+            return [self._fallback[1]]
+        return []
+
+    @property
+    def pad_prob(self) -> float:
+        return self._bounds()[0] if self.probs else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "pose": self.pose,
+            "decision": self.decision,
+            "early": self.early,
+            "pad_prob": self.pad_prob,
+            "frames_received": self.received,
+            "frames_scored": self.scored,
+            "frames_accepted": len(self.accepted),
+            "detections": self.detections,
+            "tracked": self.tracked,
+            "rejected": dict(self.rejected),
+        }
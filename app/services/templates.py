@@ -0,0 +1,119 @@
+# app/services/templates.py
+"""
+Gallery nhiều template / pose.
+
+- Ma trận template của 1 user = 3 template enroll (PoseEmbeddings) + tối đa
+  MAX_TEMPLATES_PER_POSE-1 template bổ sung mỗi pose (PoseTemplates).
+- Chấm điểm: services/scoring.pose_scores - 1 phép nhân ma trận probes (P, D) @ T.T (D, N),
+  mask theo pose, rồi max hoặc mean top-k theo từng probe.
+- Adaptation: sau ALLOW có độ tin cậy cao, thêm probe làm template; khi đầy thì bỏ
+  template bổ sung "thừa" nhất (giống các template khác nhất). Template enroll không bị thay.
+"""
+from __future__ import annotations
+
+import os
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from . import scoring
+
+MAX_TEMPLATES_PER_POSE = int(os.environ.get("GALLERY_MAX_TEMPLATES", "5"))
+TEMPLATE_SCORING = os.environ.get("TEMPLATE_SCORING", "max")   # max | topk
+TEMPLATE_TOPK = int(os.environ.get("TEMPLATE_TOPK", "2"))
+
+# Adaptation (tắt mặc định)
+ADAPTATION_ENABLED = os.environ.get("TEMPLATE_ADAPTATION", "0") == "1"
+ADAPT_MIN_SIM = float(os.environ.get("ADAPT_MIN_SIM", "0.88"))          # sim_min của lần verify
+ADAPT_MIN_PAD = float(os.environ.get("ADAPT_MIN_PAD", "0.90"))          # pad_prob_min
+ADAPT_MIN_ENROLL_SIM = float(os.environ.get("ADAPT_MIN_ENROLL_SIM", "0.80"))  # neo vào template enroll
+ADAPT_MAX_REDUNDANCY = float(os.environ.get("ADAPT_MAX_REDUNDANCY", "0.97"))  # quá giống -> không thêm
+
+POSES = ("front", "left", "right")
+
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    return scoring.l2_normalize(np.atleast_2d(m))
+
+
+def gallery_matrix(
+    enrolled: Dict[str, np.ndarray], extra: Tuple[np.ndarray, List[str]] | None = None
+) -> Tuple[np.ndarray, List[str]]:
+    """
+    Ghép template enroll (mỗi pose 1 dòng, đứng đầu) + template bổ sung -> (T (N, D), pose từng dòng).
+    """
+    poses = [p for p in POSES if p in enrolled]
+    rows = [np.asarray(enrolled[p], dtype=np.float32).reshape(-1) for p in poses]
+    mat = np.stack(rows, axis=0)
+    if extra is not None and len(extra[1]) and extra[0].shape[1] == mat.shape[1]:
+        mat = np.vstack([mat, extra[0]])
+        poses = poses + list(extra[1])
+    return scoring.ensure_unit(mat), poses
+
+
+def score(
+    probes: np.ndarray,
+    probe_poses: Sequence[str],
+    templates: np.ndarray,
+    template_poses: Sequence[str],
+    mode: str | None = None,
+    k: int | None = None,
+) -> np.ndarray:
+    """
+    Cosine của mỗi probe với các template cùng pose -> (P,).
+    mode='max': max; mode='topk': trung bình k điểm cao nhất.
+    """
+    return scoring.pose_scores(
+        probes, probe_poses, templates, template_poses, mode or TEMPLATE_SCORING, k or TEMPLATE_TOPK
+    )
+
+
+def adapt(
+    enrolled: Dict[str, np.ndarray],
+    extra: Tuple[np.ndarray, List[str]] | None,
+    probes: np.ndarray,
+    probe_poses: Sequence[str],
+) -> Tuple[np.ndarray, List[str]] | None:
+    """
+    Thêm probe vào template bổ sung theo chính sách có giới hạn.
+    Trả về (ma trận, poses) mới hoặc None nếu không có gì thay đổi.
+    """
+    dim = probes.shape[1]
+    if extra is None:
+        mat, poses = np.empty((0, dim), dtype=np.float32), []
+    else:
+        mat, poses = np.array(extra[0], dtype=np.float32), list(extra[1])
+    changed = False
+    cap = max(0, MAX_TEMPLATES_PER_POSE - 1)
+
+    for probe, pose in zip(_normalize(probes), probe_poses):
+        anchor = _normalize(np.asarray(enrolled[pose], dtype=np.float32).reshape(1, -1))[0]
+        if float(probe @ anchor) < ADAPT_MIN_ENROLL_SIM:
+            continue   # lệch khỏi template enroll -> không thêm (chống drift/poisoning)
+
+        idx = [i for i, p in enumerate(poses) if p == pose]
+        same = np.vstack([anchor[None, :], mat[idx]]) if idx else anchor[None, :]
+        same = _normalize(same)
+        if float(np.max(same @ probe)) >= ADAPT_MAX_REDUNDANCY:
+            continue   # gần như trùng template có sẵn -> không thêm thông tin
+
+        if len(idx) < cap:
+            mat = np.vstack([mat, probe[None, :]])
+            poses.append(pose)
+            changed = True
+            continue
+        if cap == 0:
+            continue
+
+        # Đầy: bỏ template (bổ sung hoặc probe mới) có độ tương đồng trung bình cao nhất
+        cand = _normalize(np.vstack([mat[idx], probe[None, :]]))
+        ref = np.vstack([anchor[None, :], cand])
+        sims = cand @ ref.T                                  # (cap+1, cap+2)
+        redundancy = (np.sum(sims, axis=1) - 1.0) / (ref.shape[0] - 1)
+        drop = int(np.argmax(redundancy))
+        if drop == len(idx):
+            continue   # probe mới là cái thừa nhất
+        mat[idx[drop]] = probe
+        changed = True
+
+    return (mat, poses) if changed else None
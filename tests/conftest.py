@@ -0,0 +1,23 @@
+# tests/conftest.py
+import os
+import shutil
+import tempfile
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def temp_db():
+    """
+    Gallery + audit DB tạm (không chạm biometric.db), dùng chung cả phiên test.
+    """
+    from app.database import db
+
+    old = (db.DB_PATH, db.AUDIT_DB_PATH)
+    d = tempfile.mkdtemp(prefix="test_db_")
+    db.DB_PATH = os.path.join(d, "gallery.db")
+    db.AUDIT_DB_PATH = os.path.join(d, "audit.db")
+    db.init_db()
+    yield db
+    db.DB_PATH, db.AUDIT_DB_PATH = old
+    shutil.rmtree(d, ignore_errors=True)
@@ -0,0 +1,177 @@
+# tests/perf/conftest.py
+"""
+Micro-benchmark kiểu pytest-benchmark, không cần plugin ngoài.
+
+    python -m pytest tests/perf -q                      # đo + in bảng so với baseline
+    python -m pytest tests/perf -q --perf-check         # fail test nào chậm hơn baseline > --perf-threshold
+    python -m pytest tests/perf -q --perf-save          # ghi kết quả làm baseline (baselines.json)
+
+- Mỗi phép đo: 1 lần warm-up, gom lời gọi thành round >= 2 ms, chạy tới khi đủ --perf-min-time giây
+  (>= 5 round). So sánh bằng median / lời gọi (ít nhiễu hơn mean).
+- Baseline phụ thuộc máy: ghi kèm CPU; đổi máy thì --perf-save lại trước khi dùng --perf-check.
+- 1 thread ORT/OpenCV để số đo ổn định và giống 1 worker của tools/serve.
+"""
+from __future__ import annotations
+
+import json
+import os
+import platform
+import time
+from pathlib import Path
+
+os.environ.setdefault("ORT_INTRA_OP_THREADS", "1")
+
+import cv2
+import numpy as np
+import pytest
+
+cv2.setNumThreads(1)
+
+BASELINES = Path(__file__).with_name("baselines.json")
+_ROUND_MIN_S = 0.002
+_MIN_ROUNDS = 5
+_MAX_ROUNDS = 1000
+
+
+def pytest_addoption(parser):
+    g = parser.getgroup("perf")
+    g.addoption("--perf-save", action="store_true", help="ghi kết quả làm baseline mới")
+    g.addoption("--perf-check", action="store_true", help="fail nếu chậm hơn baseline quá ngưỡng")
+    g.addoption("--perf-threshold", type=float, default=float(os.environ.get("PERF_THRESHOLD", "0.25")),
+                help="tỉ lệ chậm hơn cho phép so với baseline (mặc định 0.25)")
+    g.addoption("--perf-min-time", type=float, default=0.2, help="thời gian đo tối thiểu / benchmark (s)")
+    g.addoption("--perf-baselines", default=str(BASELINES), help="file baseline JSON")
+
+
+def _cpu() -> str:
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def _load(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+class Bench:
+    def __init__(self, name: str, config, results: dict, baselines: dict):
+        self.name = name
+        self.config = config
+        self.results = results
+        self.baselines = baselines
+
+    def __call__(self, fn, *args, **kwargs):
+        result = fn(*args, **kwargs)   # warm-up (nạp model, cache, ...)
+        t0 = time.perf_counter()
+        fn(*args, **kwargs)
+        once = max(time.perf_counter() - t0, 1e-7)
+        loops = max(1, int(_ROUND_MIN_S / once))
+        min_time = self.config.getoption("--perf-min-time")
+        samples = []
+        start = time.perf_counter()
+        while len(samples) < _MIN_ROUNDS or (time.perf_counter() - start < min_time and len(samples) < _MAX_ROUNDS):
+            t0 = time.perf_counter()
+            for _ in range(loops):
+                fn(*args, **kwargs)
+            samples.append((time.perf_counter() - t0) / loops)
+        us = np.asarray(samples) * 1e6
+        stats = {
+            "median_us": round(float(np.median(us)), 2),
+            "min_us": round(float(us.min()), 2),
+            "mean_us": round(float(us.mean()), 2),
+            "p95_us": round(float(np.percentile(us, 95)), 2),
+            "rounds": len(samples),
+            "loops": loops,
+        }
+        self.results[self.name] = stats
+        base = self.baselines.get("results", {}).get(self.name)
+        if base and self.config.getoption("--perf-check"):
+            limit = base["median_us"] * (1.0 + self.config.getoption("--perf-threshold"))
+            if stats["median_us"] > limit:
+                pytest.fail(
+                    f"PerfRegression:{self.name} median {stats['median_us']:.1f}us > "
+                    f"{limit:.1f}us (baseline {base['median_us']:.1f}us)",
+                    pytrace=False,
+                )
+        return result
+
+
+def pytest_configure(config):
+    config._perf_results = {}
+    config._perf_baselines = _load(config.getoption("--perf-baselines"))
+
+
+@pytest.fixture
+def bench(request):
+    """
+    bench(fn, *args) -> kết quả fn; ghi thống kê thời gian theo tên test.
+    """
+    cfg = request.config
+    return Bench(request.node.name, cfg, cfg._perf_results, cfg._perf_baselines)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    results = getattr(config, "_perf_results", None)
+    if not results:
+        return
+    base = config._perf_baselines.get("results", {})
+    tr = terminalreporter
+    tr.section("perf")
+    if config._perf_baselines and config._perf_baselines.get("machine", {}).get("cpu") != _cpu():
+        tr.write_line(f"baseline từ máy khác ({config._perf_baselines.get('machine', {}).get('cpu')}) -> chỉ tham khảo")
+    tr.write_line(f"{'benchmark':<40} {'median us':>12} {'baseline':>12} {'delta':>8}")
+    for name, st in sorted(results.items()):
+        b = base.get(name, {}).get("median_us")
+        delta = f"{(st['median_us'] / b - 1) * 100:+.0f}%" if b else "new"
+        tr.write_line(f"{name:<40} {st['median_us']:>12.1f} {b if b is not None else '-':>12} {delta:>8}")
+    if config.getoption("--perf-save"):
+        path = config.getoption("--perf-baselines")
+        data = _load(path)
+        data["machine"] = {"cpu": _cpu(), "cores": os.cpu_count(), "python": platform.python_version()}
+        data.setdefault("results", {}).update(results)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write("\n")
+        tr.write_line(f"baseline -> {path}")
+
+
+# ---------- fixtures dùng chung (temp_db: tests/conftest.py) ----------
+
+@pytest.fixture(scope="session")
+def yunet():
+    from app.services.face_embedding import DETECTOR_WEIGHTS
+
+    if not os.path.isfile(DETECTOR_WEIGHTS):
+        pytest.skip(f"thiếu {DETECTOR_WEIGHTS}")
+    return cv2.FaceDetectorYN.create(DETECTOR_WEIGHTS, "", (320, 320), score_threshold=0.6,
+                                     nms_threshold=0.3, top_k=5000)
+
+
+@pytest.fixture(scope="session")
+def pad_session():
+    from app.services import pad_model
+
+    if not os.path.isfile(pad_model._MODEL_PATH):
+        pytest.skip(f"thiếu {pad_model._MODEL_PATH}")
+    pad_model.init_pad_model()
+    return pad_model
+
+
+@pytest.fixture(scope="session")
+def face_models():
+    from app.services import face_embedding
+
+    try:
+        face_embedding.init_face_models()
+    except FileNotFoundError as e:
+        pytest.skip(f"thiếu recognizer (FACE_MODELS): {e}")
+    return face_embedding
@@ -0,0 +1,67 @@
+# tests/perf/synthetic.py
+"""
+Dữ liệu giả lập tất định cho perf test: ảnh mặt vẽ bằng OpenCV (YuNet detect được),
+JPEG, burst frame và embedding. Cùng seed -> cùng bytes trên mọi máy (không cần dataset).
+"""
+from __future__ import annotations
+
+from typing import List
+
+import cv2
+import numpy as np
+
+
+def face_bgr(seed: int = 0, size=(640, 480), yaw: float = 0.0) -> np.ndarray:
+    """
+    Ảnh BGR có 1 khuôn mặt hoạt hình ở giữa (nền gradient + nhiễu). yaw ~ [-1, 1] lệch các chi tiết ngang.
+    """
+    w, h = size
+    rng = np.random.default_rng(seed)
+    grad = np.linspace(60, 140, w, dtype=np.float32)[None, :, None]
+    img = (np.broadcast_to(grad, (h, w, 3)) + rng.normal(0, 6, (h, w, 3))).clip(0, 255).astype(np.uint8)
+
+    cx, cy = w // 2 + int(yaw * w * 0.06), h // 2
+    fw, fh = int(w * 0.16), int(h * 0.30)
+    skin = tuple(int(c + d) for c, d in zip((120, 150, 200), rng.integers(-10, 10, 3)))
+    cv2.ellipse(img, (cx, cy), (fw, fh), 0, 0, 360, skin, -1)
+    cv2.ellipse(img, (cx, cy - int(fh * 0.55)), (int(fw * 1.05), int(fh * 0.5)), 0, 180, 360, (30, 30, 40), -1)
+
+    ex, ey = int(fw * 0.42), cy - int(fh * 0.15)
+    for s in (-1, 1):
+        c = (cx + s * ex + int(yaw * 10), ey)
+        cv2.ellipse(img, c, (int(fw * 0.2), int(fh * 0.07)), 0, 0, 360, (255, 255, 255), -1)
+        cv2.circle(img, c, int(fh * 0.05), (40, 30, 20), -1)
+        cv2.line(img, (c[0] - int(fw * 0.22), c[1] - int(fh * 0.14)),
+                 (c[0] + int(fw * 0.22), c[1] - int(fh * 0.16)), (40, 40, 50), 4)
+    nose = (cx + int(yaw * 20), cy + int(fh * 0.15))
+    cv2.line(img, (nose[0], ey + 10), nose, (90, 110, 160), 3)
+    cv2.ellipse(img, (cx + int(yaw * 10), cy + int(fh * 0.45)), (int(fw * 0.35), int(fh * 0.08)),
+                0, 0, 180, (60, 60, 150), -1)
+    return cv2.GaussianBlur(img, (5, 5), 1.2)
+
+
+def face_jpeg(seed: int = 0, size=(640, 480), yaw: float = 0.0, quality: int = 90) -> bytes:
+    ok, buf = cv2.imencode(".jpg", face_bgr(seed, size, yaw), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    assert ok
+    return buf.tobytes()
+
+
+def burst(seed: int = 0, n: int = 10, size=(640, 480)) -> List[bytes]:
+    """
+    n frame JPEG liên tiếp: mặt dịch nhẹ + nhiễu khác nhau mỗi frame (như camera cầm tay).
+    """
+    out = []
+    for i in range(n):
+        img = face_bgr(seed * 1000 + i, size, yaw=0.05 * np.sin(i / 3.0))
+        m = np.float32([[1, 0, 2 * np.sin(i)], [0, 1, 2 * np.cos(i)]])
+        img = cv2.warpAffine(img, m, size, borderMode=cv2.BORDER_REPLICATE)
+        out.append(cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes())
+    return out
+
+
+def embeddings(n: int, dim: int = 128, seed: int = 0) -> np.ndarray:
+    """
+    n vector unit-norm float32 (n, dim).
+    """
+    x = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
@@ -0,0 +1,31 @@
+# tests/perf/test_perf_db.py
+import itertools
+
+import pytest
+
+from app.database import queries
+from tests.perf.synthetic import embeddings
+
+
+@pytest.fixture(scope="module")
+def enrolled_user(temp_db):
+    uid = queries.create_user(phone=None, email="perf@x", password="secret1")
+    for pose, vec in zip(("front", "left", "right"), embeddings(3, seed=7)):
+        queries.save_pose_embedding(uid, pose, vec)
+    return uid
+
+
+def test_add_log(bench, temp_db):
+    ids = itertools.count()
+    bench(lambda: queries.add_log(next(ids) % 100, 0.8, "ALLOW", "PASS", "LOGIN", ip="127.0.0.1",
+                                  pad_prob_min=0.9, pad_passed=1, duration_ms=120))
+
+
+def test_get_pose_embeddings(bench, enrolled_user):
+    poses = bench(queries.get_pose_embeddings, enrolled_user)
+    assert set(poses) == {"front", "left", "right"}
+
+
+def test_get_pose_embedding_sets(bench, enrolled_user):
+    sets = bench(queries.get_pose_embedding_sets, enrolled_user)
+    assert sets
@@ -0,0 +1,45 @@
+# tests/perf/test_perf_image.py
+import pytest
+
+from app.services import face_detect
+from tests.perf.synthetic import burst, face_bgr, face_jpeg
+
+JPEG_VGA = face_jpeg(seed=1, size=(640, 480))
+JPEG_HD = face_jpeg(seed=2, size=(1920, 1080))
+
+
+def test_decode_vga(bench):
+    img = bench(face_detect.decode_bgr, JPEG_VGA)
+    assert img.shape == (480, 640, 3)
+
+
+def test_decode_hd_reduced(bench):
+    img = bench(face_detect.decode_bgr, JPEG_HD, 2)
+    assert img.shape == (540, 960, 3)
+
+
+def test_jpeg_size_header(bench):
+    assert bench(face_detect.jpeg_size, JPEG_HD) == (1920, 1080)
+
+
+def test_detect_vga(bench, yunet):
+    f = bench(face_detect.detect_largest_face, yunet, face_bgr(seed=1))
+    assert f is not None and f[14] > 0.6
+
+
+def test_locate_hd(bench, yunet):
+    frame = bench(face_detect.locate_face, yunet, JPEG_HD)
+    assert frame.bbox is not None
+
+
+def test_track_burst_frame(bench, yunet):
+    frames = burst(seed=3, n=2)
+    prev = face_detect.normalized_box(face_detect.locate_face(yunet, frames[0]))
+    frame = bench(face_detect.track_face, yunet, frames[1], prev)
+    assert frame.bbox is not None
+
+
+@pytest.mark.parametrize("yaw", [-0.8, 0.8])
+def test_synthetic_pose_detected(yunet, yaw):
+    # generator phải cho ra mặt detect được ở các pose lệch (dùng cho các bench khác)
+    assert face_detect.detect_largest_face(yunet, face_bgr(seed=4, yaw=yaw)) is not None
@@ -0,0 +1,40 @@
+# tests/perf/test_perf_models.py
+import numpy as np
+
+from app.services import face_detect
+from tests.perf.synthetic import face_jpeg
+
+JPEG = face_jpeg(seed=5, size=(1280, 720))
+
+
+def test_pad_preprocess(bench, pad_session, yunet):
+    frame = face_detect.locate_face(yunet, JPEG)
+    x = bench(pad_session._preprocess, JPEG, frame)
+    size = pad_session._infer_target_size()
+    assert x.shape == (1, 3, size, size) and x.dtype == np.float32
+
+
+def test_pad_onnx_run(bench, pad_session):
+    size = pad_session._infer_target_size()
+    x = np.random.default_rng(0).random((1, 3, size, size), dtype=np.float32)
+    out = bench(pad_session._SESSION.run, [pad_session._OUTPUT_NAME], {pad_session._INPUT_NAME: x})
+    assert out[0].size >= 1
+
+
+def test_pad_predict_prob_live(bench, pad_session, yunet):
+    frame = face_detect.locate_face(yunet, JPEG)
+    p = bench(pad_session.predict_prob_live, JPEG, frame)
+    assert 0.0 <= p <= 1.0
+
+
+def test_align(bench, face_models):
+    frame = face_models.locate(JPEG)
+    aligned = bench(face_models.align, JPEG, frame)
+    assert aligned.shape[:2] == (112, 112)
+
+
+def test_embedding(bench, face_models):
+    frame = face_models.locate(JPEG)
+    aligned = face_models.align(JPEG, frame)
+    feat = bench(face_models.embed_aligned, aligned)
+    assert np.isfinite(feat).all()
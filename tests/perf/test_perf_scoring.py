@@ -0,0 +1,32 @@
+# tests/perf/test_perf_scoring.py
+import numpy as np
+
+from app.services import scoring
+from tests.perf.synthetic import embeddings
+
+PROBES = embeddings(3, seed=1)
+TEMPLATES = embeddings(15, seed=2)
+GALLERY = embeddings(50_000, seed=3)
+
+
+def test_cosine_pose_matrix(bench):
+    s = bench(scoring.score_matrix, PROBES, TEMPLATES)
+    assert s.shape == (3, 15) and np.all(np.abs(s) <= 1.0 + 1e-5)
+
+
+def test_pose_scores_topk(bench):
+    poses = ["front", "left", "right"]
+    tposes = [poses[i % 3] for i in range(len(TEMPLATES))]
+    s = bench(scoring.pose_scores, PROBES, poses, TEMPLATES, tposes, "topk", 2)
+    assert len(s) == 3
+
+
+def test_l2_normalize(bench):
+    x = np.random.default_rng(4).standard_normal((256, 128)).astype(np.float32)
+    y = bench(scoring.l2_normalize, x)
+    assert np.allclose(np.linalg.norm(y, axis=1), 1.0, atol=1e-5)
+
+
+def test_top_k_gallery_50k(bench):
+    idx, sims = bench(scoring.top_k, PROBES, GALLERY, 5)
+    assert idx.shape == (3, 5) and np.all(np.diff(sims, axis=1) <= 1e-6)
@@ -0,0 +1,16 @@
+# tests/test_calibrate_thresholds.py
+import numpy as np
+
+from app.services import risk_engine
+from tools.calibrate_thresholds import DEFAULT_TARGETS, calibrate
+
+
+def test_impostor_at_one_is_clamped_to_valid_policy():
+    gen = np.linspace(0.85, 1.0, 200)
+    imp = np.concatenate([np.linspace(-0.2, 0.5, 999), [1.0]])   # 1 impostor trùng khít
+    sims = {p: (gen, imp) for p in risk_engine.PURPOSES}
+    policy, _ = calibrate(sims, DEFAULT_TARGETS, ([], []), None, risk_engine.DEFAULT_POLICY)
+    for p in risk_engine.PURPOSES:
+        assert policy["purposes"][p]["pass"] <= 1.0
+        assert policy["purposes"][p]["stepup"] <= policy["purposes"][p]["pass"]
+    risk_engine.validate_policy(policy)   # không raise
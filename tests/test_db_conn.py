@@ -0,0 +1,46 @@
+# tests/test_db_conn.py
+"""
+Connection đọc gallery (db.get_read_conn): giữ lâu theo thread, pragma đọc, không ghi được.
+"""
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from app.database import queries
+
+
+def test_read_conn_reused_per_thread(temp_db):
+    c1 = temp_db.get_read_conn()
+    assert temp_db.get_read_conn() is c1
+    assert c1.execute("PRAGMA cache_size").fetchone()[0] == -temp_db.GALLERY_CACHE_KB
+    assert c1.execute("PRAGMA query_only").fetchone()[0] == 1
+
+    other = []
+    t = threading.Thread(target=lambda: other.append(temp_db.get_read_conn()))
+    t.start()
+    t.join()
+    assert other[0] is not c1
+
+
+def test_read_conn_is_read_only_and_sees_commits(temp_db):
+    with pytest.raises(sqlite3.OperationalError):
+        temp_db.get_read_conn().execute("INSERT INTO Meta(Key, Value) VALUES ('x', 'y')")
+    queries.set_meta("ReadConnTest", "1")
+    assert queries.get_meta("ReadConnTest") == "1"
+    queries.set_meta("ReadConnTest", "2")
+    assert queries.get_meta("ReadConnTest") == "2"
+
+
+def test_read_conn_follows_db_path(temp_db, tmp_path):
+    c1 = temp_db.get_read_conn()
+    old = temp_db.DB_PATH
+    temp_db.DB_PATH = os.path.join(tmp_path, "other.db")
+    try:
+        c2 = temp_db.get_read_conn()
+        assert c2 is not c1
+        assert c2.execute("PRAGMA database_list").fetchone()["file"] == temp_db.DB_PATH
+    finally:
+        temp_db.DB_PATH = old
+    assert temp_db.get_read_conn() is not c2
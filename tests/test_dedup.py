@@ -0,0 +1,94 @@
+# tests/test_dedup.py
+"""
+Kiểm tra trùng mặt lúc đăng ký (services/dedup): search 1:N đọc gallery theo trang từ DB.
+"""
+import importlib
+import uuid
+
+import numpy as np
+import pytest
+
+from app.database import queries
+from app.services import dedup
+
+
+def _unit(n, d=128, seed=0):
+    v = np.random.default_rng(seed).standard_normal((n, d)).astype(np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def gallery(temp_db, monkeypatch):
+    monkeypatch.setattr(dedup, "PAGE", 3)          # nhiều trang với gallery nhỏ
+    monkeypatch.setattr(dedup, "THRESHOLD", 0.8)
+    monkeypatch.setattr(dedup, "TOP_K", 5)
+    version = f"dedup-{uuid.uuid4().hex[:8]}"
+    vecs = _unit(10, seed=1)
+    ids = []
+    for v in vecs:
+        uid = queries.create_user(email=f"{uuid.uuid4().hex}@test")
+        queries.save_embedding(uid, v, version)
+        ids.append(uid)
+    return version, ids, vecs
+
+
+def _near(v, seed):
+    noise = np.random.default_rng(seed).standard_normal(v.size).astype(np.float32)
+    return v + 0.1 * noise / np.linalg.norm(noise)
+
+
+def test_default_is_off(monkeypatch):
+    monkeypatch.delenv("DEDUP_ACTION", raising=False)
+    try:
+        importlib.reload(dedup)
+        assert dedup.ACTION == "off" and not dedup.enabled()
+    finally:
+        monkeypatch.undo()
+        importlib.reload(dedup)
+
+
+def test_find_across_pages(gallery):
+    version, ids, vecs = gallery
+    for k in (0, 4, 9):                            # trang đầu, giữa, trang cuối không đủ PAGE
+        matches = dedup.find(_near(vecs[k], k), version)
+        assert [m for m, _ in matches] == [ids[k]]
+        assert matches[0][1] >= 0.8
+    assert dedup.find(_unit(1, seed=99)[0], version) == []
+    assert dedup.find(vecs[0][:64], version) == []  # Dim khác -> không so
+
+
+def test_find_many_and_top_k(gallery, monkeypatch):
+    version, ids, vecs = gallery
+    twin = queries.create_user(email=f"{uuid.uuid4().hex}@test")
+    queries.save_embedding(twin, _near(vecs[2], 7), version)
+    res = dedup.find_many([vecs[2], vecs[5]], version)
+    assert {m for m, _ in res[0]} == {ids[2], twin}
+    assert res[0][0][1] >= res[0][1][1]
+    assert [m for m, _ in res[1]] == [ids[5]]
+    monkeypatch.setattr(dedup, "TOP_K", 1)
+    assert dedup.find_many([vecs[2]], version)[0] == [(ids[2], pytest.approx(1.0, abs=1e-3))]
+
+
+def test_deleted_and_reembedded_users_are_current(gallery):
+    version, ids, vecs = gallery
+    assert dedup.find(vecs[1], version)
+    with queries.get_conn() as c:
+        c.execute("DELETE FROM Users WHERE UserId=?", (ids[1],))
+    assert dedup.find(vecs[1], version) == []
+    queries.save_embedding(ids[3], _unit(1, seed=42)[0], version)
+    assert dedup.find(vecs[3], version) == []
+
+
+def test_reject_log_not_attributed_to_matched_account(temp_db):
+    victim = queries.create_user(email=f"{uuid.uuid4().hex}@test")
+    count = "SELECT COUNT(*) FROM AuthLogs WHERE UserId=?"
+    with temp_db.get_audit_conn() as c:
+        before = c.execute(count, (victim,)).fetchone()[0]
+    queries.add_log(None, 0.93, "DENY", "PASS", purpose="ENROLL",
+                    attack_type="duplicate_face", match_user_id=victim)
+    with temp_db.get_audit_conn() as c:
+        row = c.execute("SELECT * FROM AuthLogs ORDER BY LogId DESC LIMIT 1").fetchone()
+        assert c.execute(count, (victim,)).fetchone()[0] == before
+    assert row["UserId"] is None
+    assert row["MatchUserId"] == victim
+    assert row["AttackType"] == "duplicate_face"
@@ -0,0 +1,90 @@
+# tests/test_embedding_codec.py
+"""
+Định dạng BLOB embedding (queries.encode_vector / decode_vector / decode_vectors / decode_matrix):
+header codec f32/f16/i8, BLOB float32 thô định dạng cũ, cận sai số cosine đã ghi trong queries.
+"""
+import numpy as np
+import pytest
+
+from app.database import queries as q
+
+
+def _unit(n, d, seed=0):
+    v = np.random.default_rng(seed).standard_normal((n, d)).astype(np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("codec,atol", [("f32", 0.0), ("f16", 1e-3), ("i8", 1e-2)])
+def test_vector_round_trip(codec, atol):
+    v = _unit(1, 128)[0]
+    blob = q.encode_vector(v, codec)
+    assert blob[0] == q.CODECS[codec]
+    assert len(blob) == q._blob_size(q.CODECS[codec], 128)
+    assert q.blob_codec(blob, 128) == q.CODECS[codec]
+    out = q.decode_vector(blob, 128)
+    assert out.dtype == np.float32 and out.shape == (128,)
+    np.testing.assert_allclose(out, v, atol=atol)
+
+
+def test_unknown_codec_name_rejected():
+    with pytest.raises(ValueError, match="UnknownEmbeddingCodec"):
+        q.encode_vector(np.zeros(4, dtype=np.float32), "bf16")
+
+
+def test_legacy_headerless_float32():
+    v = _unit(1, 128)[0]
+    legacy = v.astype("<f4").tobytes()          # định dạng cũ: float32 thô, không header
+    assert q.blob_codec(legacy, 128) is None
+    np.testing.assert_array_equal(q.decode_vector(legacy, 128), v)
+    # Dim sai / không có -> lấy theo độ dài BLOB
+    np.testing.assert_array_equal(q.decode_vector(legacy, 0), v)
+
+
+def test_decode_vectors_mixed_codecs():
+    vs = _unit(8, 128, seed=1)
+    codecs = [None, "f32", "f16", "i8", None, "i8", "f16", "f32"]
+    blobs = [v.astype("<f4").tobytes() if c is None else q.encode_vector(v, c) for v, c in zip(vs, codecs)]
+    mat = q.decode_vectors(blobs, 128)
+    assert mat.shape == (8, 128) and mat.dtype == np.float32
+    for row, blob in zip(mat, blobs):
+        np.testing.assert_array_equal(row, q.decode_vector(blob, 128))   # giữ đúng thứ tự dòng
+
+
+def test_decode_vectors_legacy_dim_mismatch_falls_back_per_row():
+    short = np.arange(64, dtype="<f4").tobytes()
+    mat = q.decode_vectors([short, q.encode_vector(_unit(1, 128)[0], "f32")], 128)
+    np.testing.assert_array_equal(mat[0, :64], np.arange(64, dtype=np.float32))
+    assert not mat[0, 64:].any()
+
+
+@pytest.mark.parametrize("codec", ["f32", "f16", "i8"])
+def test_matrix_round_trip(codec):
+    m = _unit(5, 128, seed=2)
+    out = q.decode_matrix(q.encode_matrix(m, codec), 128)
+    assert out.shape == (5, 128)
+    for row, v in zip(out, m):
+        np.testing.assert_array_equal(row, q.decode_vector(q.encode_vector(v, codec), 128))
+    assert q.decode_matrix(b"", 128).shape == (0, 128)
+
+
+def test_decode_matrix_rejects_unknown_header_and_bad_length():
+    blob = q.encode_matrix(_unit(3, 128), "f16")
+    with pytest.raises(ValueError, match="UnknownEmbeddingCodec"):
+        q.decode_matrix(bytes([9]) + blob[1:], 128)
+    with pytest.raises(ValueError, match="BadEmbeddingMatrix"):
+        q.decode_matrix(blob[:-1], 128)
+
+
+@pytest.mark.parametrize("dim", [128, 512])
+def test_cosine_error_bound(dim):
+    gallery = _unit(200, dim, seed=3)
+    probes = _unit(50, dim, seed=4)
+    exact = gallery @ probes.T
+    for codec in ("f16", "i8"):
+        dec = q.decode_vectors([q.encode_vector(g, codec) for g in gallery], dim)
+        err = np.abs(dec @ probes.T - exact)
+        if codec == "f16":
+            bound = np.full(len(gallery), 2 * 2.0 ** -11)
+        else:
+            bound = 2 * np.sqrt(dim) * np.abs(gallery).max(axis=1) / 254
+        assert (err <= bound[:, None]).all(), codec
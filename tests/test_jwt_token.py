@@ -0,0 +1,129 @@
+# tests/test_jwt_token.py
+"""
+Verify HS256 tự viết (services/jwt_token): mọi token không hợp lệ phải ra ValueError, không 500.
+"""
+import base64
+import json
+import time
+
+import pytest
+
+from app.services import jwt_token as jt
+from app.services import revocation
+
+K1 = "k1:" + "a" * 32
+K2 = "k2:" + "b" * 32
+
+
+@pytest.fixture(autouse=True)
+def ring(temp_db):
+    jt.load_keys(f"{K1},{K2}")
+    yield
+    jt.load_keys()
+
+
+def _b64(obj) -> str:
+    return base64.urlsafe_b64encode(json.dumps(obj).encode()).rstrip(b"=").decode()
+
+
+def _claims(**over):
+    now = int(time.time())
+    c = {"sub": "7", "iss": jt.ISS, "aud": jt.AUD, "iat": now, "exp": now + 60, "jti": f"j{time.time_ns()}"}
+    c.update(over)
+    return c
+
+
+def test_roundtrip_and_rotation():
+    old = jt.issue("7")
+    assert jt.verify(old)["sub"] == "7"
+    jt.load_keys(f"{K2},{K1}")   # xoay key: k2 ký, k1 chỉ còn để verify
+    new = jt.issue("8")
+    assert json.loads(jt._b64d(new.split(".")[0]))["kid"] == "k2"
+    assert jt.verify(old)["sub"] == "7"
+    assert jt.verify(new)["sub"] == "8"
+
+
+def test_tampered_payload_and_signature():
+    h, p, s = jt.issue("7").split(".")
+    forged = _b64({**json.loads(jt._b64d(p)), "sub": "1"})
+    with pytest.raises(ValueError, match="BadSignature"):
+        jt.verify(f"{h}.{forged}.{s}")
+    with pytest.raises(ValueError, match="BadSignature"):
+        jt.verify(f"{h}.{p}.{s[:-4]}AAAA")
+
+
+def test_expired_and_not_yet_valid():
+    with pytest.raises(ValueError, match="TokenExpired"):
+        jt.verify(jt._sign(_claims(exp=int(time.time()) - 5)))
+    with pytest.raises(ValueError, match="TokenExpired"):
+        jt.verify(jt._sign(_claims(exp="never")))
+    with pytest.raises(ValueError, match="TokenNotYetValid"):
+        jt.verify(jt._sign(_claims(nbf=int(time.time()) + 600)))
+
+
+def test_unknown_kid():
+    token = jt.issue("7")
+    jt.load_keys(K2)
+    with pytest.raises(ValueError, match="UnknownKid:k1"):
+        jt.verify(token)
+
+
+@pytest.mark.parametrize("header", [
+    {"alg": "HS256", "kid": [1]},
+    {"alg": "HS256", "kid": {"a": 1}},
+    {"alg": "HS256", "kid": 5},
+])
+def test_non_string_kid_is_malformed(header):
+    _, p, s = jt.issue("7").split(".")
+    with pytest.raises(ValueError, match="MalformedToken"):
+        jt.verify(f"{_b64(header)}.{p}.{s}")
+
+
+@pytest.mark.parametrize("token, code", [
+    ("x.y", "MalformedToken"),
+    ("not-b64!.e30.e30", "MalformedToken"),
+    (_b64([1, 2]) + ".e30.e30", "UnsupportedAlg"),
+    (_b64({"alg": "none", "kid": "k1"}) + ".e30.", "UnsupportedAlg"),
+    (_b64({"alg": "RS256", "kid": "k1"}) + ".e30.e30", "UnsupportedAlg"),
+])
+def test_malformed_header(token, code):
+    with pytest.raises(ValueError, match=code):
+        jt.verify(token)
+
+
+def test_non_string_jti_is_malformed():
+    with pytest.raises(ValueError, match="MalformedToken"):
+        jt.verify(jt._sign(_claims(jti=["a"])))
+
+
+def test_wrong_audience_and_issuer():
+    with pytest.raises(ValueError, match="BadAudience"):
+        jt.verify(jt.issue_challenge(1, ["front"], "LOGIN"))
+    with pytest.raises(ValueError, match="BadIssuer"):
+        jt.verify(jt._sign(_claims(iss="evil")))
+
+
+def test_revoked():
+    token = jt.issue("7")
+    claims = jt.verify(token)
+    assert revocation.revoke(claims["jti"], claims["exp"], "test") is True
+    with pytest.raises(ValueError, match="TokenRevoked"):
+        jt.verify(token)
+    assert jt.verify(token, check_revoked=False)["jti"] == claims["jti"]
+    assert revocation.revoke(claims["jti"], claims["exp"]) is False
+
+
+def test_token_routes_return_401_not_500():
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.routes.tokens import router
+
+    app = FastAPI()
+    app.include_router(router)
+    c = TestClient(app)
+    _, p, s = jt.issue("7").split(".")
+    bad = f"{_b64({'alg': 'HS256', 'kid': [1]})}.{p}.{s}"
+    for path in ("/auth/token/verify", "/auth/token/revoke"):
+        r = c.post(path, json={"token": bad})
+        assert r.status_code == 401
+        assert r.json()["detail"] == "MalformedToken"
@@ -0,0 +1,129 @@
+# tests/test_nonce_ledger.py
+"""
+Chống replay challenge ký (CHALLENGE_MODE=signed): nonce_ledger cả 2 backend + đường submit.
+"""
+import time
+import uuid
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routes import verify
+from app.services import jwt_token as jt
+from app.services import nonce_ledger
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def ledger(request, temp_db, monkeypatch):
+    monkeypatch.setattr(nonce_ledger, "BACKEND", request.param)
+    monkeypatch.setattr(nonce_ledger, "_buckets", {})
+    return nonce_ledger
+
+
+@pytest.fixture
+def signed(ledger, monkeypatch):
+    monkeypatch.setattr(verify, "CHALLENGE_MODE", "signed")
+    app = FastAPI()
+    app.include_router(verify.router)
+    return TestClient(app)
+
+
+def _nonce() -> str:
+    return uuid.uuid4().hex
+
+
+def test_consume_once(ledger):
+    n, exp = _nonce(), int(time.time()) + 60
+    assert not ledger.consumed(n)
+    assert ledger.consume(n, exp) is True
+    assert ledger.consume(n, exp) is False
+    assert ledger.consumed(n)
+
+
+def test_memory_buckets_are_pruned(monkeypatch):
+    monkeypatch.setattr(nonce_ledger, "BACKEND", "memory")
+    monkeypatch.setattr(nonce_ledger, "_buckets", {})
+    ledger = nonce_ledger
+    now = time.time()
+    old = _nonce()
+    assert ledger.consume(old, int(now) - 120)          # token đã hết hạn -> bucket quá hạn
+    assert ledger.consume(_nonce(), int(now) + 60)      # lần consume sau prune bucket cũ
+    assert all(end >= now for end in ledger._buckets)
+    assert not ledger.consumed(old)
+
+
+def test_sqlite_rows_are_pruned(temp_db, monkeypatch):
+    monkeypatch.setattr(nonce_ledger, "BACKEND", "sqlite")
+    monkeypatch.setattr(nonce_ledger, "PRUNE_INTERVAL_S", 0.0)
+    ledger = nonce_ledger
+    old = _nonce()
+    assert ledger.consume(old, int(time.time()) - 120)
+    assert ledger.consume(_nonce(), int(time.time()) + 60)
+    assert not ledger.consumed(old)
+
+
+def _submit(client, cid):
+    r = client.post("/auth/verify/submit", json={"challengeId": cid, "frames": []})
+    return r.status_code, r.json().get("detail")
+
+
+def test_signed_challenge_consumed_twice(signed):
+    cid = jt.issue_challenge(1, ["front", "left", "right"], "LOGIN")
+    ch = verify._get_challenge(cid)
+    assert ch["userId"] == 1
+    assert verify._consume_challenge(cid, ch) is True
+    assert verify._consume_challenge(cid, ch) is False      # submit song song thua cuộc
+    assert verify._get_challenge(cid) is None
+    assert _submit(signed, cid) == (400, "InvalidChallenge")
+
+
+def test_expired_challenge_rejected(signed, monkeypatch):
+    monkeypatch.setattr(jt, "CHALLENGE_TTL", -1)
+    cid = jt.issue_challenge(1, ["front", "left", "right"], "LOGIN")
+    assert verify._get_challenge(cid) is None
+    assert _submit(signed, cid) == (400, "InvalidChallenge")
+
+
+def test_tampered_challenge_rejected(signed):
+    cid = jt.issue_challenge(1, ["front", "left", "right"], "LOGIN")
+    h, p, s = cid.split(".")
+    assert _submit(signed, f"{h}.{p}.{s[:-4]}AAAA") == (400, "InvalidChallenge")
+    assert _submit(signed, jt.issue("1")) == (400, "InvalidChallenge")   # access token != challenge
+
+
+def test_binary_resolves_challenge_once_and_limits_before_body(signed, monkeypatch):
+    from fastapi import HTTPException
+
+    calls = {"get": 0, "enforce": 0, "split": 0}
+    get, split = verify._get_challenge, verify._split_frames
+
+    def counting_get(cid):
+        calls["get"] += 1
+        return get(cid)
+
+    def counting_split(body):
+        calls["split"] += 1
+        return split(body)
+
+    def enforce(*a, **kw):
+        calls["enforce"] += 1
+        if limited:
+            raise HTTPException(status_code=429, detail="RateLimited")
+
+    monkeypatch.setattr(verify, "_get_challenge", counting_get)
+    monkeypatch.setattr(verify, "_split_frames", counting_split)
+    monkeypatch.setattr(verify.rate_limit, "enforce", enforce)
+    body = b"".join(len(b"x").to_bytes(4, "big") + b"x" for _ in range(3))
+
+    limited = True
+    cid = jt.issue_challenge(987654321, ["front", "left", "right"], "LOGIN")   # user chưa enroll
+    r = signed.post(f"/auth/verify/submit/binary?challengeId={cid}", content=body)
+    assert r.status_code == 429
+    assert calls == {"get": 1, "enforce": 1, "split": 0}    # body chưa được tách
+
+    limited = False
+    calls.update(get=0, enforce=0, split=0)
+    r = signed.post(f"/auth/verify/submit/binary?challengeId={cid}", content=body)
+    assert (r.status_code, r.json()["detail"]) == (404, "UserNotEnrolled")   # đã vào _submit
+    assert calls == {"get": 1, "enforce": 1, "split": 1}
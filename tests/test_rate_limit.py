@@ -0,0 +1,97 @@
+# tests/test_rate_limit.py
+"""
+Token bucket (services/rate_limit + queries.take_rate_tokens) với đồng hồ giả, cả 2 backend.
+"""
+import math
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import rate_limit
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def rl(request, temp_db, monkeypatch):
+    clock = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(time=lambda: clock.now))
+    monkeypatch.setattr(rate_limit, "ENABLED", True)
+    monkeypatch.setattr(rate_limit, "BACKEND", request.param)
+    monkeypatch.setattr(rate_limit, "LIMITS", {"ip": (2.0, 0.5), "user": (3.0, 1.0), "email": (2.0, 1.0)})
+    monkeypatch.setattr(rate_limit, "_buckets", {})
+    monkeypatch.setattr(rate_limit, "_logged", {})
+    monkeypatch.setattr(rate_limit, "_swept_at", 0.0)
+    monkeypatch.setattr(rate_limit, "clock", clock, raising=False)   # test chỉnh rl.clock.now
+    return rate_limit
+
+
+def _key() -> str:
+    return uuid.uuid4().hex   # DB dùng chung cả phiên -> mỗi test key riêng
+
+
+def test_burst_then_reject_with_retry_after(rl):
+    ip = _key()
+    assert rl.check(ip=ip) is None
+    assert rl.check(ip=ip) is None
+    rej = rl.check(ip=ip)
+    assert rej.scope == "ip" and rej.key == f"ip:{ip}"
+    assert rej.retry_after == pytest.approx(2.0)   # thiếu 1 token, hồi 0.5 token/s
+
+
+def test_refill(rl):
+    ip = _key()
+    rl.check(ip=ip)
+    rl.check(ip=ip)
+    rl.clock.now += 1.0                            # +0.5 token
+    assert rl.check(ip=ip).retry_after == pytest.approx(1.0)
+    rl.clock.now += 1.0                            # đủ 1 token
+    assert rl.check(ip=ip) is None
+    assert rl.check(ip=ip).retry_after == pytest.approx(2.0)
+    rl.clock.now += 3600                           # không vượt capacity
+    assert [rl.check(ip=ip) for _ in range(3)][:2] == [None, None]
+
+
+def test_rejection_consumes_nothing_when_later_bucket_empty(rl):
+    ip, email = _key(), f"{_key()}@x"
+    rl.check(email=email)
+    rl.check(email=email)
+    # ip pass nhưng email cạn -> cả request bị chặn, ip không bị trừ
+    for _ in range(3):
+        assert rl.check(ip=ip, email=email).scope == "email"
+    assert rl.check(ip=ip) is None
+    assert rl.check(ip=ip) is None
+    assert rl.check(ip=ip).scope == "ip"
+
+
+def test_rejection_consumes_nothing_when_earlier_bucket_empty(rl):
+    ip, user = _key(), int(uuid.uuid4().int % 10**9)
+    rl.check(ip=ip)
+    rl.check(ip=ip)
+    for _ in range(5):
+        assert rl.check(ip=ip, user_id=user).scope == "ip"
+    other = _key()
+    assert [rl.check(ip=other if i < 2 else _key(), user_id=user) for i in range(3)] == [None, None, None]
+    assert rl.check(ip=_key(), user_id=user).scope == "user"
+
+
+def test_email_is_normalized(rl):
+    e = _key()
+    rl.check(email=f" {e.upper()}@X ")
+    rl.check(email=f"{e}@x")
+    assert rl.check(email=f"{e}@x").scope == "email"
+
+
+def test_enforce_raises_429_with_retry_after_header(rl, monkeypatch):
+    from app.main import _rate_limited
+
+    monkeypatch.setattr(rate_limit.queries, "add_log", lambda *a, **k: None)
+    ip = _key()
+    rl.enforce("LOGIN", ip=ip)
+    rl.enforce("LOGIN", ip=ip)
+    rl.clock.now += 0.3
+    with pytest.raises(rate_limit.RateLimited) as ei:
+        rl.enforce("LOGIN", ip=ip)
+    assert ei.value.detail == {"error": "RateLimited", "scope": "ip", "retry_after": 1.7}   # (1 - 0.3 * 0.5) / 0.5
+    resp = _rate_limited(None, ei.value)
+    assert resp.status_code == 429
+    assert resp.headers["retry-after"] == str(math.ceil(1.7))
@@ -0,0 +1,100 @@
+# tests/test_stream_liveness.py
+"""
+PoseStream với model giả: frame = chỉ số vào bảng (p_live, blur), không chạy YuNet/PAD/SFace.
+"""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app.services import face_embedding, frame_quality, stream_liveness as sl
+from app.services.face_detect import FaceFrame
+
+
+def _frame(i: int) -> FaceFrame:
+    bgr = np.full((48, 64, 3), i, dtype=np.uint8)
+    return FaceFrame(bgr, np.array([8, 8, 32, 32], np.float32), np.zeros((5, 2), np.float32), 0.9)
+
+
+@pytest.fixture
+def burst(monkeypatch):
+    """
+    burst(frames) -> PoseStream đã nhận các frame [(p_live, blur), ...] cho tới khi quyết định.
+    """
+    table = {}
+    monkeypatch.setattr(sl, "SAMPLE_EVERY", 1)
+    monkeypatch.setattr(sl, "MIN_FRAMES", 3)
+    monkeypatch.setattr(sl, "PAD_THRESHOLD", 0.5)
+    monkeypatch.setattr(sl, "EMBED_FRAMES", 2)
+    monkeypatch.setattr(face_embedding, "locate", lambda i: _frame(i))
+    monkeypatch.setattr(face_embedding, "track", lambda i, box: _frame(i))
+    monkeypatch.setattr(frame_quality, "assess", lambda f, pose: SimpleNamespace(
+        ok=True, reason=None, metrics={"blur": table[int(f.bgr[0, 0, 0])][1]}))
+    monkeypatch.setattr(sl, "predict_prob_live", lambda i, f: table[i][0])
+
+    def run(frames):
+        table.update(enumerate(frames))
+        ps = sl.PoseStream("front")
+        for i in range(len(frames)):
+            if ps.feed(i) is not None:
+                break
+        ps.finish()
+        return ps
+
+    return run
+
+
+def _ids(ps):
+    return [int(f.bgr[0, 0, 0]) for f in ps.probe_frames()]
+
+
+def test_sharp_spoof_frame_never_becomes_probe(burst):
+    # Mặt thật + 1 ảnh in nét của nạn nhân chen giữa: pose vẫn live nhưng frame spoof không được embed
+    ps = burst([(0.95, 100), (0.95, 110), (0.05, 900), (0.95, 120), (0.95, 105), (0.95, 90)])
+    assert ps.decision == "live"
+    assert 2 not in _ids(ps)
+    assert _ids(ps) == [3, 1]   # 2 frame nét nhất đã pass PAD
+
+
+def test_spoof_pose_falls_back_to_sharpest_frame(burst):
+    ps = burst([(0.05, 100), (0.1, 300), (0.02, 200), (0.08, 150)])
+    assert ps.decision == "spoof"
+    assert _ids(ps) == [1]
+
+
+def test_stream_finish_scores_min_over_accepted_frames(burst, monkeypatch):
+    from app.routes import verify
+
+    ps = burst([(0.95, 100), (0.95, 300), (0.05, 900), (0.95, 200)])
+    ch = {"userId": 1, "sequence": ["front"], "purpose": "LOGIN"}
+    monkeypatch.setattr(verify, "_get_challenge", lambda cid: ch)
+    monkeypatch.setattr(verify, "_enrolled_sets", lambda uid: {"v": {"front": np.ones(4, np.float32)}})
+    monkeypatch.setattr(verify, "extract_versions",
+                        lambda img, versions, frame: ({"v": np.full(4, float(frame.bgr[0, 0, 0]))}, None))
+    seen = {}
+
+    def finish(challenge_id, ch, enrolled, probes, pad_probs, pad_flags, ip, gt, atk, t0, fields, groups):
+        seen.update(probes=probes, groups=groups, pad_flags=pad_flags)
+
+    monkeypatch.setattr(verify, "_finish", finish)
+    verify._stream_finish("c", [ps], None, None, None, 0.0)
+    assert seen["groups"] == [0, 0]
+    assert [float(p[0]) for p in seen["probes"]["v"]] == [1.0, 3.0]
+    assert seen["pad_flags"] == [True]
+
+
+def test_finish_takes_min_similarity_per_pose(monkeypatch):
+    from app.routes import verify
+
+    monkeypatch.setattr(verify, "_consume_challenge", lambda cid, ch: True)
+    monkeypatch.setattr(verify.auth_cache, "get_pose_templates", lambda uid, v: None)
+    monkeypatch.setattr(verify, "add_log", lambda *a, **k: None)
+    monkeypatch.setattr(verify.templates, "ADAPTATION_ENABLED", False)
+    e = np.eye(4, dtype=np.float32)
+    enrolled = {"v": {"front": e[0], "left": e[1]}}
+    probes = [e[0], (e[0] + e[2]) / np.sqrt(2), e[1]]   # front: 1.0 và 0.707, left: 1.0
+    ch = {"userId": 1, "sequence": ["front", "left"], "purpose": "LOGIN"}
+    out = verify._finish("c", ch, enrolled, {"v": probes}, [0.9, 0.9], [True, True],
+                         None, None, None, 0.0, None, [0, 0, 1])
+    assert out["stepUp"] == "OTP_REQUIRED"   # 0.707: dưới ngưỡng pass LOGIN, dù frame kia = 1.0
+    assert out["similarities"] == pytest.approx([0.7071, 1.0], abs=1e-3)
@@ -0,0 +1,74 @@
+"""
+Retention AuthLogs: chuyển log cũ hơn N ngày ra archive .npz theo ngày rồi xóa khỏi SQLite
+theo batch giới hạn (services/log_archive). Chạy định kỳ (cron).
+
+- Cập nhật rollup metrics trước, và chỉ archive tới high-water mark của rollup
+  -> không log nào bị xóa trước khi được đếm vào /metrics/rollup.
+- /metrics/export và compute_metrics --db đọc chung archive + AuthLogs.
+
+Chạy từ root project:
+    python -m tools.archive_logs --days 30
+    python -m tools.archive_logs --days 30 --dry-run
+"""
+import argparse
+import os
+import time
+
+from app.database import db
+from app.services import log_archive, metrics_rollup
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--days", type=float, default=float(os.environ.get("AUTHLOG_RETENTION_DAYS", "30")),
+                    help="giữ log N ngày gần nhất trong SQLite")
+    ap.add_argument("--archive-dir", default=None, help="mặc định AUTHLOG_ARCHIVE_DIR")
+    ap.add_argument("--batch", type=int, default=5000, help="số dòng mỗi lần ghi/xóa")
+    ap.add_argument("--vacuum", action="store_true", help="VACUUM sau khi xóa (khóa DB trong lúc chạy)")
+    ap.add_argument("--dry-run", action="store_true", help="chỉ đếm số dòng sẽ archive")
+    ap.add_argument("--db", default=None, help="đường dẫn DB (mặc định db.DB_PATH)")
+    ap.add_argument("--audit-db", default=None, help="DB audit chứa AuthLogs (mặc định AUDIT_DB_PATH)")
+    args = ap.parse_args()
+
+    if args.db:
+        db.DB_PATH = args.db
+    if args.audit_db:
+        db.AUDIT_DB_PATH = args.audit_db
+    cutoff = int(time.time() - args.days * 86400)
+    archive_dir = args.archive_dir or log_archive.ARCHIVE_DIR
+
+    st = metrics_rollup.update()
+    hw = st["high_water"]
+    print(f"[ARCHIVE] rollup up to LogId {hw} (+{st['rows']} rows)")
+
+    if args.dry_run:
+        with db.get_audit_conn() as c:
+            n = c.execute("SELECT COUNT(*) FROM AuthLogs WHERE LogId <= ? AND At < ?", (hw, cutoff)).fetchone()[0]
+        print(f"[ARCHIVE] {n} rows older than {args.days:g} days would be archived to {archive_dir}")
+        return
+
+    total = 0
+    files = set()
+    t0 = time.perf_counter()
+    for b in log_archive.archive_before(cutoff, hw, args.batch, archive_dir):
+        total += b["deleted"]
+        files.update(b["files"])
+        print(f"[ARCHIVE] LogId {b['first']}..{b['last']}: {b['rows']} archived, {b['deleted']} deleted")
+
+    with db.get_audit_conn() as c:
+        # trả WAL về kích thước nhỏ sau đợt xóa lớn
+        c.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    if args.vacuum and total:
+        c = db.get_audit_conn()
+        try:
+            c.execute("VACUUM")
+        finally:
+            c.close()
+
+    print("=== AuthLogs archive ===")
+    print(f"Archived : {total} rows -> {len(files)} files under {archive_dir}")
+    print(f"Time     : {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
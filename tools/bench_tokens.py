@@ -0,0 +1,84 @@
+"""
+Benchmark issue/verify token (services/jwt_token) trên 1 core.
+
+- verify: đường nóng thật (key ring cache + HMAC + claims + index thu hồi trong bộ nhớ).
+- pyjwt: jwt.decode cùng token, để so sánh.
+- revoked: verify token đã thu hồi (phải bị từ chối), index chứa --revoked jti.
+Mặc định chạy trên DB tạm (không ghi RevokedTokens vào DB thật).
+
+Chạy từ root project:
+    python -m tools.bench_tokens --n 100000 --revoked 100000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import jwt
+
+from app.database import db
+
+
+def _rate(fn, items):
+    t0 = time.perf_counter()
+    for x in items:
+        fn(x)
+    dt = time.perf_counter() - t0
+    return {"ops_per_s": round(len(items) / dt), "us_per_op": round(dt / len(items) * 1e6, 2)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark issue/verify token")
+    ap.add_argument("--n", type=int, default=50000, help="số token mỗi phép đo")
+    ap.add_argument("--revoked", type=int, default=10000, help="số jti trong index thu hồi")
+    ap.add_argument("--db", default=None, help="đường dẫn DB (mặc định DB tạm)")
+    ap.add_argument("--json", default=None, help="ghi kết quả ra file JSON")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_tokens_")
+    db.DB_PATH = args.db or os.path.join(tmp, "gallery.db")
+    db.AUDIT_DB_PATH = os.path.join(tmp, "audit.db")
+    db.init_db()
+
+    from app.services import jwt_token, revocation
+
+    kid, keys = jwt_token._keyring()
+    exp = int(time.time()) + jwt_token.EXP
+    for i in range(args.revoked):
+        revocation.add_local(f"bench-{i}", exp)
+
+    ids = [str(i) for i in range(args.n)]
+    report = {"n": args.n, "revoked_index": args.revoked, "kid": kid}
+    report["issue"] = _rate(jwt_token.issue, ids)
+    tokens = [jwt_token.issue(u) for u in ids]
+    report["verify"] = _rate(jwt_token.verify, tokens)
+    report["pyjwt"] = _rate(
+        lambda t: jwt.decode(t, keys[kid], algorithms=["HS256"], audience=jwt_token.AUD, issuer=jwt_token.ISS),
+        tokens,
+    )
+
+    victims = tokens[: min(len(tokens), 1000)]
+    for t in victims:
+        c = jwt_token.verify(t)
+        revocation.add_local(c["jti"], c["exp"])
+    rejected = 0
+    for t in victims:
+        try:
+            jwt_token.verify(t)
+        except ValueError:
+            rejected += 1
+    report["revoked_rejected"] = f"{rejected}/{len(victims)}"
+
+    print(f"[BENCH] kid={kid} n={args.n} revoked_index={len(revocation._revoked)}")
+    for name in ("issue", "verify", "pyjwt"):
+        r = report[name]
+        print(f"  {name:<7} {r['ops_per_s']:>10} ops/s  {r['us_per_op']:>8} us/op")
+    print(f"  revoked tokens rejected: {report['revoked_rejected']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Enroll hàng loạt offline từ manifest (CSV hoặc JSONL), không qua HTTP.
+
+Mỗi record: email, password, phone (tùy chọn), front, left, right (đường dẫn ảnh,
+tương đối so với thư mục chứa manifest).
+
+- Decode + detect 1 lần / ảnh, gate chất lượng (frame_quality, như /auth/register),
+  PAD + embedding + PBKDF2 chạy song song trên process pool.
+- Embed bằng model active + model đang migrate (MigratingModelVersion, nếu có): bản migrate vào
+  EmbeddingsStaging như enroll._register để switch_model_version không bỏ sót user mới.
+- Mỗi chunk ghi Users/embeddings/crops/log ENROLL trong 1 transaction, kèm checkpoint
+  (Meta 'BulkEnroll:<manifest>') trong cùng transaction -> chạy lại là tiếp tục đúng chỗ.
+- Record lỗi (pad_failed, no_face, bad_image, TooBlurry, ...) ghi vào file báo cáo CSV.
+- DEDUP_ACTION=flag|reject (services/dedup): mỗi chunk được search 1:N với gallery (gồm các chunk
+  trước) và với nhau; cặp trùng ghi vào báo cáo (stage duplicate_face). flag: vẫn enroll, cặp
+  ghi FaceDuplicates (Source='bulk') cùng transaction; reject: record không được enroll.
+
+Chạy từ root project:
+    python -m tools.bulk_enroll --manifest data/partner.csv --workers 16 --report errors.csv
+"""
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import time
+from itertools import islice
+
+import cv2
+import numpy as np
+
+from app.database import db
+from app.database.queries import (
+    _hash_password,
+    bulk_enroll_users,
+    get_active_model_version,
+    get_meta,
+    get_migrating_model_version,
+)
+from app.routes.enroll import liveness_decision
+from app.services import crop_store, dedup, frame_quality, scoring
+from app.services.face_embedding import MODEL_VERSION, available_versions, extract_versions, init_face_models, locate
+from app.services.pad_model import init_pad_model, predict_prob_live
+
+POSES = ("front", "left", "right")
+REPORT_FIELDS = ["record", "email", "stage", "detail"]
+
+
+def read_manifest(path: str):
+    """
+    Sinh (chỉ số record, dict) từ CSV (có header) hoặc JSONL.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            idx = 0
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield idx, json.loads(line)
+                    idx += 1
+        else:
+            for idx, row in enumerate(csv.DictReader(f)):
+                yield idx, row
+
+
+def _init_worker():
+    # 1 process = 1 core: tránh oversubscription giữa các worker
+    os.environ["ORT_INTRA_OP_THREADS"] = "1"
+    cv2.setNumThreads(1)
+    init_pad_model()
+    init_face_models()
+
+
+def _fail(idx, rec, stage, detail):
+    return {"ok": False, "record": idx, "email": rec.get("email"), "stage": stage, "detail": detail}
+
+
+def _process(item):
+    idx, rec, base_dir, versions, keep_crops = item
+    email = (rec.get("email") or "").strip()
+    password = rec.get("password") or ""
+    if not email or len(password) < 6:
+        return _fail(idx, rec, "invalid_record", "EmailAndPasswordRequired")
+    try:
+        images = {}
+        for pose in POSES:
+            path = rec.get(pose)
+            if not path:
+                return _fail(idx, rec, "missing_image", pose)
+            try:
+                with open(os.path.join(base_dir, path), "rb") as f:
+                    images[pose] = f.read()
+            except OSError as e:
+                return _fail(idx, rec, "missing_image", f"{pose}:{e}")
+
+        # Decode/detect 1 lần / pose + gate chất lượng trước khi chạy model (như enroll._register)
+        frames = {}
+        for pose in POSES:
+            try:
+                frames[pose] = locate(images[pose])
+            except ValueError as e:
+                stage = "no_face" if "NoFaceDetected" in str(e) else "bad_image"
+                return _fail(idx, rec, stage, f"{e}:{pose}")
+            q = frame_quality.assess(frames[pose], pose)
+            if q.reason == "NoFaceDetected":
+                return _fail(idx, rec, "no_face", f"NoFaceDetected:{pose}")
+            if not q.ok:
+                return _fail(idx, rec, q.reason, f"{pose}:{json.dumps(q.metrics)}")
+
+        pad_scores = {pose: float(predict_prob_live(images[pose], frames[pose])) for pose in POSES}
+        _, live = liveness_decision(pad_scores)
+        if not live:
+            return _fail(idx, rec, "pad_failed", json.dumps(pad_scores))
+
+        vecs, crops = {}, {}
+        staged = {v: {} for v in versions[1:]}
+        for pose in POSES:
+            try:
+                feats, aligned = extract_versions(images[pose], versions, frames[pose])
+            except ValueError as e:
+                stage = "no_face" if "NoFaceDetected" in str(e) else "bad_image"
+                return _fail(idx, rec, stage, f"{e}:{pose}")
+            vecs[pose] = feats[versions[0]].reshape(-1)
+            for v in staged:
+                staged[v][pose] = feats[v].reshape(-1)
+            if keep_crops:
+                crops[pose] = crop_store.encode_crop(aligned)
+
+        pw_salt, pw_hash = _hash_password(password)
+        return {
+            "ok": True,
+            "record": idx,
+            "email": email,
+            "phone": rec.get("phone") or None,
+            "pw_salt": pw_salt,
+            "pw_hash": pw_hash,
+            "vecs": vecs,
+            "mean": sum(vecs.values()) / len(vecs),
+            "crops": crops or None,
+            "staged": [
+                (pose, v, vec)
+                for v, p in staged.items()
+                for pose, vec in list(p.items()) + [("mean", sum(p.values()) / len(p))]
+            ],
+        }
+    except Exception as e:
+        return _fail(idx, rec, "error", f"{type(e).__name__}:{e}")
+
+
+def find_duplicates(ok, version: str) -> None:
+    """
+    Gắn r["dup_users"] (trùng user đã có trong DB) và r["dup_records"] (trùng record đứng trước
+    trong cùng chunk, theo vị trí trong ok) cho từng record.
+    """
+    if not ok:
+        return
+    means = np.stack([np.asarray(r["mean"], dtype=np.float32).reshape(-1) for r in ok])
+    for r, found in zip(ok, dedup.find_many(means, version)):
+        r["dup_users"] = found
+    unit = scoring.l2_normalize(means)
+    idx, sims = scoring.top_k(unit, unit, dedup.TOP_K + 1)
+    for i, r in enumerate(ok):
+        r["dup_records"] = [(int(j), float(s)) for j, s in zip(idx[i], sims[i]) if j < i and s >= dedup.THRESHOLD]
+
+
+def _dup_report(r, ok) -> dict:
+    detail = {
+        "action": dedup.ACTION,
+        "users": [[m, round(s, 4)] for m, s in r["dup_users"]],
+        "records": [[ok[j]["record"], round(s, 4)] for j, s in r["dup_records"]],
+    }
+    return {"record": r["record"], "email": r["email"], "stage": "duplicate_face", "detail": json.dumps(detail)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--manifest", required=True, help="file .csv hoặc .jsonl")
+    ap.add_argument("--workers", type=int, default=mp.cpu_count())
+    ap.add_argument("--chunk", type=int, default=2000, help="số record mỗi transaction")
+    ap.add_argument("--report", default="bulk_enroll_errors.csv", help="CSV các record lỗi")
+    ap.add_argument("--db", default=None, help="đường dẫn DB (mặc định db.DB_PATH)")
+    args = ap.parse_args()
+
+    if args.db:
+        db.DB_PATH = args.db
+    db.init_db()
+
+    manifest = os.path.abspath(args.manifest)
+    base_dir = os.path.dirname(manifest)
+    ckpt_key = f"BulkEnroll:{manifest}"
+    start = int(get_meta(ckpt_key, "0"))
+    version = get_active_model_version(MODEL_VERSION)
+    versions = [version]
+    migrating = get_migrating_model_version()
+    if migrating and migrating != version:
+        if migrating not in available_versions():
+            raise SystemExit(f"MigratingModelVersion {migrating} has no configured recognizer (FACE_MODELS)")
+        versions.append(migrating)
+        print(f"[BULK] migration in progress: also staging {migrating}")
+    keep_crops = crop_store.enabled()
+    encrypt = crop_store.encrypt_png if keep_crops else None
+    if start:
+        print(f"[BULK] resuming at record {start}")
+
+    new_report = not (start and os.path.exists(args.report))
+    report_f = open(args.report, "w" if new_report else "a", encoding="utf-8", newline="")
+    report = csv.DictWriter(report_f, fieldnames=REPORT_FIELDS, extrasaction="ignore")
+    if new_report:
+        report.writeheader()
+
+    enrolled = failed = flagged = 0
+    t0 = time.perf_counter()
+    records = islice(read_manifest(manifest), start, None)
+    try:
+        with mp.Pool(args.workers, initializer=_init_worker) as pool:
+            while True:
+                chunk = [(i, r, base_dir, versions, keep_crops) for i, r in islice(records, args.chunk)]
+                if not chunk:
+                    break
+                results = pool.map(_process, chunk, chunksize=max(1, len(chunk) // (args.workers * 4)))
+                ok = [r for r in results if r["ok"]]
+                bad = [r for r in results if not r["ok"]]
+
+                flags = []   # flag: vẫn enroll, chỉ báo cáo
+                if dedup.enabled():
+                    find_duplicates(ok, version)
+                    dups = [_dup_report(r, ok) for r in ok if r["dup_users"] or r["dup_records"]]
+                    if dedup.ACTION == "reject":
+                        ok = [r for r in ok if not (r["dup_users"] or r["dup_records"])]
+                        bad += dups
+                    else:
+                        flags = dups
+                        flagged += len(dups)
+
+                bulk_enroll_users(ok, version, checkpoint=(ckpt_key, str(chunk[-1][0] + 1)), encrypt_crop=encrypt)
+                for r in bad + flags:
+                    report.writerow(r)
+                report_f.flush()
+
+                enrolled += len(ok)
+                failed += len(bad)
+                dt = time.perf_counter() - t0
+                print(f"[BULK] record={chunk[-1][0] + 1} enrolled={enrolled} failed={failed} flagged={flagged} "
+                      f"{(enrolled + failed) / dt:.1f} records/s")
+    finally:
+        report_f.close()
+
+    dt = time.perf_counter() - t0
+    print("=== Bulk enroll ===")
+    print(f"Enrolled : {enrolled}")
+    print(f"Failed   : {failed} (see {args.report})")
+    if dedup.enabled():
+        print(f"Flagged  : {flagged} duplicate faces (DEDUP_ACTION={dedup.ACTION}, see {args.report})")
+    print(f"Time     : {dt:.1f}s ({(enrolled + failed) / dt if dt > 0 else 0.0:.1f} records/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Hiệu chỉnh ngưỡng risk_engine theo FAR mục tiêu từ dữ liệu có nhãn, ghi file ngưỡng
+có version mà các worker tự nạp lại (RISK_THRESHOLDS_FILE).
+
+Nguồn điểm:
+- authlogs: AuthLogs có nhãn lab (IsBonaFide 1 = genuine, 0 = impostor/attack), tách theo Purpose.
+- cache:    cache điểm offline của tools/eval_offline (cặp genuine/impostor từ verify/<identity>,
+            PAD bona/spoof từ pad/...), dùng chung cho mọi purpose.
+
+Mỗi ngưỡng = ngưỡng nhỏ nhất có FAR <= mục tiêu (sort 1 lần, không quét lưới).
+Purpose thiếu dữ liệu giữ nguyên ngưỡng đang dùng.
+
+Chạy từ root project:
+    python -m tools.calibrate_thresholds --source authlogs --dry-run
+    python -m tools.calibrate_thresholds --source cache --root data/eval --pad-apcer 0.01
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from app.database import db
+from app.services import risk_engine
+from tools.compute_metrics import eer_from_scores, rates_at, threshold_at_far
+
+DEFAULT_TARGETS = {
+    ("LOGIN", "pass"): 1e-3,
+    ("LOGIN", "stepup"): 1e-2,
+    ("PAYMENT", "pass"): 1e-4,
+    ("PAYMENT", "stepup"): 1e-3,
+}
+
+
+def scores_from_authlogs(since_days: float | None):
+    """
+    -> ({purpose: (genuine, impostor)}, (pad_bona, pad_spoof))
+    """
+    sql = """
+    SELECT Purpose, Similarity, IsBonaFide, PadProbMin
+    FROM AuthLogs
+    WHERE IsBonaFide IN (0, 1) AND Purpose IN ('LOGIN', 'PAYMENT')
+    """
+    args = []
+    if since_days:
+        sql += " AND At >= ?"
+        args.append(int(time.time() - since_days * 86400))
+    with db.get_audit_conn() as c:
+        rows = c.execute(sql, args).fetchall()
+
+    sims = {p: ([], []) for p in risk_engine.PURPOSES}
+    pad_bona, pad_spoof = [], []
+    for r in rows:
+        if r["Similarity"] is not None:
+            sims[r["Purpose"]][0 if r["IsBonaFide"] else 1].append(r["Similarity"])
+        if r["PadProbMin"] is not None:
+            (pad_bona if r["IsBonaFide"] else pad_spoof).append(r["PadProbMin"])
+    return {p: (np.array(g, np.float32), np.array(i, np.float32)) for p, (g, i) in sims.items()}, (pad_bona, pad_spoof)
+
+
+def scores_from_cache(root: str, cache_path: str | None, version: str | None, max_impostors: int):
+    from app.services.face_embedding import FACE_MODELS
+    from tools import eval_offline
+
+    version = version or next(iter(FACE_MODELS))
+    root = os.path.abspath(root)
+    cache_path = cache_path or os.path.join(root, f".eval_cache_{version}.npz")
+    cache = eval_offline.load_cache(cache_path, eval_offline.fingerprint(version))
+    if not cache:
+        raise SystemExit(f"No usable cache at {cache_path}; run tools.eval_offline first")
+    items = eval_offline.scan(root)
+    gen, imp = eval_offline.verify_scores(items, cache, max_impostors)
+
+    pad_bona, pad_spoof = [], []
+    for path, kind, label in items:
+        rec = cache.get(path)
+        if kind == "pad" and rec is not None and np.isfinite(rec["pad_prob"]):
+            (pad_bona if label == "bona" else pad_spoof).append(rec["pad_prob"])
+    return {p: (gen, imp) for p in risk_engine.PURPOSES}, (pad_bona, pad_spoof)
+
+
+def calibrate(sims: dict, targets: dict, pad: tuple, pad_apcer: float | None, current: dict):
+    """
+    -> policy mới (chưa có version) + cảnh báo.
+    """
+    warnings = []
+    purposes = {}
+    for purpose in risk_engine.PURPOSES:
+        gen, imp = sims[purpose]
+        cur = current["purposes"][purpose]
+        if gen.size == 0 or imp.size == 0:
+            warnings.append(f"{purpose}: no labeled genuine/impostor scores, keeping current thresholds")
+            purposes[purpose] = dict(cur)
+            continue
+        out = {"n_genuine": int(gen.size), "n_impostor": int(imp.size),
+               "eer": eer_from_scores(gen, imp)["eer"], "target_far": {}, "far": {}, "frr": {}}
+        for level in ("pass", "stepup"):
+            target = targets[(purpose, level)]
+            # impostor ~1.0 -> threshold_at_far trả nextafter(1.0) > 1, validate_policy sẽ từ chối
+            thr = min(1.0, threshold_at_far(imp, target))
+            far, frr = rates_at(gen, imp, thr)
+            out[level] = thr
+            out["target_far"][level] = target
+            out["far"][level] = far
+            out["frr"][level] = frr
+            # luật "rule of 3": cần ~3/target impostor để ước lượng FAR đáng tin
+            if imp.size * target < 3:
+                warnings.append(f"{purpose}/{level}: only {imp.size} impostors for FAR {target:g}, "
+                                f"need ~{int(np.ceil(3 / target))}")
+        out["stepup"] = min(out["stepup"], out["pass"])
+        purposes[purpose] = out
+
+    pose_pad = dict(current["pose_pad"])
+    if pad_apcer is not None:
+        bona, spoof = pad
+        if bona and spoof:
+            # APCER = tỉ lệ spoof có prob >= ngưỡng -> cùng phép tính với FAR
+            thr = threshold_at_far(spoof, pad_apcer)
+            pose_pad["front"] = min(1.0, thr)
+            bpcer = float(np.mean(np.asarray(bona) < thr))
+            print(f"[CALIB] PAD front thr={thr:.4f} APCER<={pad_apcer:g} BPCER={bpcer:.4f} "
+                  f"(bona={len(bona)} spoof={len(spoof)})")
+        else:
+            warnings.append("PAD: no labeled bona/spoof scores, keeping current pose thresholds")
+    return {"purposes": purposes, "pose_pad": pose_pad, "quality": current["quality"]}, warnings
+
+
+def write_atomic(path: str, payload: dict) -> None:
+    """
+    Ghi file tạm cùng thư mục rồi os.replace -> worker không bao giờ đọc file ghi dở.
+    """
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--source", choices=["authlogs", "cache"], default="authlogs")
+    ap.add_argument("--db", default=None, help="đường dẫn DB (mặc định db.DB_PATH)")
+    ap.add_argument("--audit-db", default=None, help="DB audit chứa AuthLogs (mặc định AUDIT_DB_PATH)")
+    ap.add_argument("--since-days", type=float, default=None, help="chỉ dùng log trong N ngày gần nhất")
+    ap.add_argument("--root", default=None, help="dataset của tools.eval_offline (source=cache)")
+    ap.add_argument("--cache", default=None, help="file cache .npz (source=cache)")
+    ap.add_argument("--version", default=None, help="ModelVersion của cache (source=cache)")
+    ap.add_argument("--max-impostors", type=int, default=5_000_000)
+    for (purpose, level), target in DEFAULT_TARGETS.items():
+        ap.add_argument(f"--far-{level}-{purpose.lower()}", type=float, default=target,
+                        help=f"FAR mục tiêu cho {level} {purpose} (mặc định {target:g})")
+    ap.add_argument("--pad-apcer", type=float, default=None, help="APCER mục tiêu cho ngưỡng PAD pose front")
+    ap.add_argument("--out", default=None, help="file ngưỡng (mặc định RISK_THRESHOLDS_FILE)")
+    ap.add_argument("--dry-run", action="store_true", help="chỉ in kết quả, không ghi file")
+    args = ap.parse_args()
+
+    out_path = args.out or risk_engine.THRESHOLDS_FILE
+    if args.source == "authlogs":
+        if args.db:
+            db.DB_PATH = args.db
+        if args.audit_db:
+            db.AUDIT_DB_PATH = args.audit_db
+        sims, pad = scores_from_authlogs(args.since_days)
+        source = f"authlogs:{os.path.basename(db.audit_db_path())}"
+    else:
+        if not args.root:
+            raise SystemExit("--root is required with --source cache")
+        sims, pad = scores_from_cache(args.root, args.cache, args.version, args.max_impostors)
+        source = f"cache:{os.path.abspath(args.root)}"
+
+    current = risk_engine.DEFAULT_POLICY
+    if os.path.exists(out_path):
+        with open(out_path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        try:
+            current = risk_engine.validate_policy(raw)
+        except (ValueError, KeyError, TypeError) as e:
+            # File hỏng (worker đang bỏ qua nó): tính lại từ mặc định thay vì kẹt ở đây
+            print(f"[CALIB] WARNING {out_path} is invalid ({e}), starting from defaults")
+            version = raw.get("version", 0) if isinstance(raw, dict) else 0
+            current = {**risk_engine.DEFAULT_POLICY, "version": int(version) if isinstance(version, int) else 0}
+
+    targets = {(p, lvl): getattr(args, f"far_{lvl}_{p.lower()}") for p, lvl in DEFAULT_TARGETS}
+    policy, warnings = calibrate(sims, targets, pad, args.pad_apcer, current)
+    policy = {"version": current["version"] + 1, "created_at": int(time.time()), "source": source, **policy}
+
+    print(f"=== Thresholds v{policy['version']} ({source}) ===")
+    for purpose, m in policy["purposes"].items():
+        old = current["purposes"][purpose]
+        line = f"{purpose:<8} pass {old['pass']:.4f} -> {m['pass']:.4f}  stepup {old['stepup']:.4f} -> {m['stepup']:.4f}"
+        if "frr" in m:
+            line += f"  FRR(pass)={m['frr']['pass']:.4f} EER={m['eer']:.4f}"
+        print(line)
+    print(f"pose_pad {current['pose_pad']} -> {policy['pose_pad']}")
+    for w in warnings:
+        print(f"[CALIB] WARNING {w}")
+
+    try:
+        risk_engine.validate_policy(policy)
+    except (ValueError, KeyError, TypeError) as e:
+        raise SystemExit(f"Refusing to write invalid thresholds: {e}")
+    if args.dry_run:
+        return
+    write_atomic(out_path, policy)
+    print(f"Wrote {out_path}; workers reload within {risk_engine.RELOAD_INTERVAL_S:g}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,45 @@ def far_frr_eer(items):
     i = int(np.argmin(np.abs(fars - frrs)))
     return {"eer": float((fars[i]+frrs[i])/2), "thr_at_eer": float(ths[i])}
 
+def eer_from_scores(genuine, impostor):
+    """
+    EER chính xác từ 2 mảng điểm (sort 1 lần, không quét lưới ngưỡng) -> dùng được
+    cho hàng triệu cặp impostor.
+    """
+    gen = np.sort(np.asarray(genuine, dtype=np.float32))
+    imp = np.sort(np.asarray(impostor, dtype=np.float32))
+    if gen.size == 0 or imp.size == 0:
+        return {"eer": None, "thr_at_eer": None}
+    ths = np.unique(np.concatenate([gen, imp]))
+    frrs = np.searchsorted(gen, ths, side="left") / gen.size          # gen < t
+    fars = 1.0 - np.searchsorted(imp, ths, side="left") / imp.size    # imp >= t
+    i = int(np.argmin(np.abs(fars - frrs)))
+    return {"eer": float((fars[i] + frrs[i]) / 2), "thr_at_eer": float(ths[i])}
+
+def rates_at(genuine, impostor, thr):
+    """
+    (FAR, FRR) tại 1 ngưỡng.
+    """
+    gen = np.asarray(genuine, dtype=np.float32)
+    imp = np.asarray(impostor, dtype=np.float32)
+    far = float(np.mean(imp >= thr)) if imp.size else None
+    frr = float(np.mean(gen < thr)) if gen.size else None
+    return far, frr
+
+def threshold_at_far(impostor, target_far):
+    """
+    Ngưỡng nhỏ nhất có FAR (imp >= t) <= target_far, tính bằng 1 lần sort.
+    """
+    imp = np.sort(np.asarray(impostor, dtype=np.float32))
+    n = imp.size
+    if n == 0:
+        return None
+    k = int(np.floor(target_far * n))      # số impostor được phép lọt
+    if k >= n:
+        return float(imp[0])
+    # ngay trên điểm impostor cao thứ k+1 -> chỉ còn tối đa k điểm >= t
+    return float(np.nextafter(imp[n - k - 1], np.float32(np.inf)))
+
 def apcer_bpcer_acer(items, pad_thr=0.85):
     # APCER: % spoof bị nhận nhầm là live (pad_ok True)
     # BPCER: % bona-fide bị nhận nhầm là spoof (pad_ok False)
@@ -52,13 +91,25 @@ def apcer_bpcer_acer(items, pad_thr=0.85):
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--json", required=True, help="metrics export JSON file")
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--json", help="metrics export JSON file")
+    src.add_argument("--db", help="đọc trực tiếp AuthLogs + archive (không qua /metrics/export)")
+    ap.add_argument("--audit-db", default=None, help="DB audit chứa AuthLogs nếu tách riêng")
+    ap.add_argument("--archive-dir", default=None, help="thư mục archive AuthLogs (mặc định AUTHLOG_ARCHIVE_DIR)")
     ap.add_argument("--pad-thr", type=float, default=0.85)
     args = ap.parse_args()
 
-    with open(args.json, "r", encoding="utf-8") as f:
-        payload = json.load(f)
-    items = payload["items"] if isinstance(payload, dict) and "items" in payload else payload
+    if args.db:
+        from app.database import db
+        from app.services import log_archive
+        db.DB_PATH = args.db
+        if args.audit_db:
+            db.AUDIT_DB_PATH = args.audit_db
+        items = log_archive.export_items(archive_dir=args.archive_dir)
+    else:
+        with open(args.json, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        items = payload["items"] if isinstance(payload, dict) and "items" in payload else payload
 
     m1 = far_frr_eer(items)
     m2 = apcer_bpcer_acer(items, pad_thr=args.pad_thr)
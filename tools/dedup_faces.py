@@ -0,0 +1,200 @@
+"""
+Quét trùng khuôn mặt giữa các tài khoản (fraud ring): similarity join toàn bộ UserEmbeddings
+của model đang active, gom các tài khoản trùng mặt thành cụm.
+
+- Gallery nạp theo trang (UserId tăng dần) vào 1 ma trận (N, Dim) float32 unit-norm.
+- Join theo khối: --block dòng x --chunk cột mỗi phép matmul (services/scoring.score_matrix),
+  chỉ nửa tam giác (cột < dòng) -> bộ nhớ giới hạn ở block x chunk, không có vòng lặp Python O(N^2).
+- Cặp có cosine >= --threshold là cạnh; --max-neighbors giữ tối đa k cạnh mạnh nhất mỗi tài khoản
+  (xấp xỉ: cụm vẫn liên thông, số cạnh không bùng nổ khi có cụm rất lớn). Union-find -> cụm.
+- --since-user-id: chỉ join user mới (UserId > N) với toàn bộ gallery -> chạy định kỳ (cron)
+  sau lần quét đầy đủ.
+- --save ghi các cạnh vào FaceDuplicates (Source='batch'), cùng bảng với kiểm tra lúc đăng ký
+  (services/dedup).
+
+Chạy từ root project:
+    python -m tools.dedup_faces --db biometric.db --threshold 0.8 --json clusters.json
+    python -m tools.dedup_faces --since-user-id 120000 --save
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.database import db
+from app.database.queries import (
+    count_user_embeddings,
+    get_active_model_version,
+    get_user_embeddings_page,
+    get_user_emails,
+    save_face_duplicates,
+)
+from app.services import scoring
+from app.services.dedup import THRESHOLD
+from app.services.face_embedding import MODEL_VERSION
+
+
+def load_gallery(model_version: str, page: int = 50000):
+    """
+    -> (ids (N,) int64 tăng dần, ma trận (N, Dim) float32 unit-norm), cấp phát 1 lần.
+    """
+    total = count_user_embeddings(model_version)
+    ids = np.empty(total, dtype=np.int64)
+    mat = None
+    n, last = 0, 0
+    while n < total:
+        pid, pmat = get_user_embeddings_page(model_version, last, page)
+        if not len(pid):
+            break
+        k = min(len(pid), total - n)   # user mới ghi trong lúc nạp -> bỏ, lần chạy sau sẽ thấy
+        if mat is None:
+            mat = np.empty((total, pmat.shape[1]), dtype=np.float32)
+        ids[n:n + k] = pid[:k]
+        mat[n:n + k] = scoring.ensure_unit(pmat[:k])
+        n += k
+        last = int(pid[k - 1])
+    if mat is None:
+        return ids[:0], np.empty((0, 0), dtype=np.float32)
+    return ids[:n], mat[:n]
+
+
+def _cap(rows: np.ndarray, cols: np.ndarray, sims: np.ndarray, k: int):
+    """
+    Giữ tối đa k cạnh điểm cao nhất cho mỗi dòng.
+    """
+    order = np.lexsort((-sims, rows))
+    rows, cols, sims = rows[order], cols[order], sims[order]
+    first = np.searchsorted(rows, rows, side="left")
+    keep = (np.arange(len(rows)) - first) < k
+    return rows[keep], cols[keep], sims[keep]
+
+
+def similarity_join(mat: np.ndarray, threshold: float, start: int = 0, block: int = 1024,
+                    chunk: int | None = None, max_neighbors: int = 0, progress: bool = True):
+    """
+    Mọi cặp (i, j), j < i, i >= start có mat[i] . mat[j] >= threshold -> (i, j, sim) dạng mảng.
+    """
+    n = mat.shape[0]
+    chunk = chunk or scoring.SEARCH_CHUNK
+    out_i, out_j, out_s = [], [], []
+    t0 = time.time()
+    done = 0
+    for a in range(start, n, block):
+        b = min(a + block, n)
+        bi, bj, bs = [], [], []
+        for c in range(0, b, chunk):
+            d = min(c + chunk, b)
+            s = scoring.score_matrix(mat[a:b], mat[c:d])
+            if d > a:   # khối chứa đường chéo: chỉ lấy cột < dòng
+                s[np.arange(b - a)[:, None] + a <= np.arange(c, d)[None, :]] = -np.inf
+            r, col = np.nonzero(s >= threshold)
+            if len(r):
+                bi.append(r + a)
+                bj.append(col + c)
+                bs.append(s[r, col])
+        if bi:
+            i, j, sv = np.concatenate(bi), np.concatenate(bj), np.concatenate(bs)
+            if max_neighbors > 0:
+                i, j, sv = _cap(i, j, sv, max_neighbors)
+            out_i.append(i)
+            out_j.append(j)
+            out_s.append(sv)
+        done += b - a
+        if progress and (b == n or (a // block) % 50 == 49):
+            el = time.time() - t0
+            print(f"[DEDUP] {done}/{n - start} users joined, {sum(len(x) for x in out_i)} pairs, "
+                  f"{done / max(el, 1e-9):.0f} users/s")
+    if not out_i:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+    return np.concatenate(out_i), np.concatenate(out_j), np.concatenate(out_s)
+
+
+def clusters(n: int, rows: np.ndarray, cols: np.ndarray):
+    """
+    Union-find trên các cạnh -> danh sách cụm (chỉ số dòng), chỉ cụm >= 2 phần tử, lớn trước.
+    """
+    parent = list(range(n))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in zip(rows.tolist(), cols.tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    nodes = np.unique(np.concatenate([rows, cols])) if len(rows) else np.empty(0, np.int64)
+    groups: dict = {}
+    for x in nodes.tolist():
+        groups.setdefault(find(x), []).append(x)
+    return sorted((g for g in groups.values() if len(g) > 1), key=len, reverse=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Tìm tài khoản trùng khuôn mặt (similarity join + union-find)")
+    ap.add_argument("--db", default=None, help="đường dẫn DB (mặc định db.DB_PATH)")
+    ap.add_argument("--version", default=None, help="ModelVersion (mặc định: đang active)")
+    ap.add_argument("--threshold", type=float, default=THRESHOLD, help="cosine tối thiểu (mặc định DEDUP_THRESHOLD)")
+    ap.add_argument("--since-user-id", type=int, default=0, help="chỉ join user có UserId > N với toàn bộ gallery")
+    ap.add_argument("--block", type=int, default=1024, help="số dòng mỗi khối join")
+    ap.add_argument("--chunk", type=int, default=0, help="số cột mỗi phép nhân (0 = SEARCH_CHUNK_ROWS)")
+    ap.add_argument("--max-neighbors", type=int, default=50, help="tối đa k cạnh / tài khoản (0 = không giới hạn)")
+    ap.add_argument("--save", action="store_true", help="ghi các cặp vào FaceDuplicates")
+    ap.add_argument("--json", default=None, help="ghi danh sách cụm ra file JSON")
+    ap.add_argument("--top", type=int, default=20, help="số cụm in ra màn hình")
+    args = ap.parse_args()
+
+    if args.db:
+        db.DB_PATH = args.db
+    version = args.version or get_active_model_version(MODEL_VERSION)
+
+    t0 = time.time()
+    ids, mat = load_gallery(version)
+    print(f"[DEDUP] {len(ids)} users ({version}, dim={mat.shape[1] if mat.size else 0}) loaded in {time.time() - t0:.1f}s")
+    if len(ids) < 2:
+        return
+    start = int(np.searchsorted(ids, args.since_user_id, side="right"))
+
+    t1 = time.time()
+    rows, cols, sims = similarity_join(mat, args.threshold, start, args.block, args.chunk or None, args.max_neighbors)
+    print(f"[DEDUP] {len(rows)} pairs >= {args.threshold} in {time.time() - t1:.1f}s")
+
+    groups = clusters(len(ids), rows, cols)
+    pair_sims: dict = {}
+    for a, b, s in zip(rows.tolist(), cols.tolist(), sims.tolist()):
+        pair_sims[a] = max(pair_sims.get(a, -1.0), s)
+        pair_sims[b] = max(pair_sims.get(b, -1.0), s)
+    emails = get_user_emails([int(ids[x]) for g in groups for x in g])
+    report = []
+    for g in groups:
+        users = sorted(int(ids[x]) for x in g)
+        report.append({
+            "size": len(g),
+            "max_similarity": round(max(pair_sims[x] for x in g), 4),
+            "users": [{"userId": u, "email": emails.get(u)} for u in users],
+        })
+
+    print(f"=== Face dedup ({version}, threshold {args.threshold}) ===")
+    print(f"Users     : {len(ids)} ({len(ids) - start} joined)")
+    print(f"Pairs     : {len(rows)}")
+    print(f"Clusters  : {len(report)} ({sum(c['size'] for c in report)} accounts)")
+    for c in report[:args.top]:
+        users = ", ".join(f"{u['userId']}:{u['email']}" for u in c["users"][:8])
+        more = f" (+{c['size'] - 8})" if c["size"] > 8 else ""
+        print(f"  size={c['size']:<4} max_sim={c['max_similarity']:.3f}  {users}{more}")
+
+    if args.save and len(rows):
+        n = save_face_duplicates(zip(ids[rows].tolist(), ids[cols].tolist(), sims.tolist()), "batch")
+        print(f"Saved     : {n} pairs -> FaceDuplicates")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"model_version": version, "threshold": args.threshold, "users": len(ids),
+                       "pairs": int(len(rows)), "clusters": report}, f, indent=2, ensure_ascii=False)
+        print(f"Report    : {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+"""
+Đánh giá offline PAD + verification trên bộ ảnh local, không cần log /metrics/export.
+
+Cấu trúc dataset (--root):
+    pad/bona/**.jpg              ảnh người thật
+    pad/spoof/<attack>/**.jpg    ảnh tấn công, mỗi thư mục con = 1 loại (print, replay, mask, ...)
+    verify/<identity>/**.jpg     ảnh theo danh tính: cặp cùng thư mục = genuine, khác = impostor
+
+- Chấm điểm (PAD prob, embedding, latency) chạy song song trên process pool theo batch.
+- Điểm từng ảnh được cache vào file .npz dạng cột, key = path + mtime + size, kèm
+  fingerprint model -> đổi ngưỡng (--pad-thr, ...) chạy lại gần như tức thì; đổi model
+  thì cache tự bị bỏ.
+- Báo cáo: APCER theo từng loại tấn công, BPCER, ACER, EER của PAD và verification,
+  FAR/FRR tại ngưỡng risk_engine đang áp dụng, phân bố latency.
+
+Chạy từ root project:
+    python -m tools.eval_offline --root data/eval --workers 8
+    python -m tools.eval_offline --root data/eval --pad-thr 0.6 --json report.json
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import cv2
+
+from app.services import risk_engine, scoring
+from app.services.face_embedding import FACE_MODELS, extract_versions, init_face_models
+from app.services.pad_model import _MODEL_PATH as PAD_MODEL_PATH, init_pad_model, predict_prob_live
+from tools.compute_metrics import apcer_bpcer_acer, eer_from_scores, rates_at
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+_VERSION = None
+
+
+def scan(root: str):
+    """
+    -> [(path, kind, label)]; kind = 'pad' (label 'bona' | loại tấn công) hoặc 'verify' (label = danh tính).
+    """
+    items = []
+
+    def walk(base, kind, label):
+        for d, _, files in os.walk(base):
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTS):
+                    items.append((os.path.join(d, name), kind, label))
+
+    walk(os.path.join(root, "pad", "bona"), "pad", "bona")
+    spoof = os.path.join(root, "pad", "spoof")
+    if os.path.isdir(spoof):
+        for atk in sorted(os.listdir(spoof)):
+            walk(os.path.join(spoof, atk), "pad", atk)
+    verify = os.path.join(root, "verify")
+    if os.path.isdir(verify):
+        for ident in sorted(os.listdir(verify)):
+            walk(os.path.join(verify, ident), "verify", ident)
+    return sorted(items)
+
+
+def fingerprint(version: str) -> str:
+    """
+    Định danh model đang dùng; khác fingerprint = cache cũ không còn giá trị.
+    """
+    parts = []
+    for path in (PAD_MODEL_PATH, FACE_MODELS[version]):
+        st = os.stat(path) if os.path.exists(path) else None
+        parts.append(f"{path}:{st.st_size if st else 0}:{st.st_mtime_ns if st else 0}")
+    return f"{version}|" + "|".join(parts)
+
+
+# ------------------------------------------------------------
+# Cache cột (.npz)
+# ------------------------------------------------------------
+def load_cache(path: str, fp: str) -> dict:
+    """
+    -> {path: {mtime, size, pad_prob, pad_ms, emb_ms, emb, err}}
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with np.load(path, allow_pickle=False) as z:
+        if str(z["fingerprint"]) != fp:
+            print("[EVAL] model changed, cache ignored")
+            return {}
+        cols = {k: z[k] for k in z.files if k != "fingerprint"}
+    cache = {}
+    for i, p in enumerate(cols["path"]):
+        emb = cols["emb"][i] if cols["emb"].shape[1] else None
+        cache[str(p)] = {
+            "mtime": int(cols["mtime"][i]),
+            "size": int(cols["size"][i]),
+            "pad_prob": float(cols["pad_prob"][i]),
+            "pad_ms": float(cols["pad_ms"][i]),
+            "emb_ms": float(cols["emb_ms"][i]),
+            "emb": emb if emb is not None and np.all(np.isfinite(emb)) else None,
+            "err": str(cols["err"][i]),
+        }
+    return cache
+
+
+def save_cache(path: str, fp: str, cache: dict) -> None:
+    keys = sorted(cache)
+    dims = {r["emb"].shape[0] for r in cache.values() if r["emb"] is not None}
+    dim = dims.pop() if len(dims) == 1 else 0
+    emb = np.full((len(keys), dim), np.nan, dtype=np.float32)
+    for i, k in enumerate(keys):
+        if dim and cache[k]["emb"] is not None:
+            emb[i] = cache[k]["emb"]
+    tmp = path + ".tmp.npz"
+    np.savez(
+        tmp,
+        fingerprint=np.array(fp),
+        path=np.array(keys, dtype=str),
+        mtime=np.array([cache[k]["mtime"] for k in keys], dtype=np.int64),
+        size=np.array([cache[k]["size"] for k in keys], dtype=np.int64),
+        pad_prob=np.array([cache[k]["pad_prob"] for k in keys], dtype=np.float32),
+        pad_ms=np.array([cache[k]["pad_ms"] for k in keys], dtype=np.float32),
+        emb_ms=np.array([cache[k]["emb_ms"] for k in keys], dtype=np.float32),
+        emb=emb,
+        err=np.array([cache[k]["err"] for k in keys], dtype=str),
+    )
+    os.replace(tmp, path)   # ghi atomic: dừng giữa chừng không làm hỏng cache
+
+
+def _fresh(rec: dict | None, st: os.stat_result, need_pad: bool, need_emb: bool) -> bool:
+    if rec is None or rec["mtime"] != st.st_mtime_ns or rec["size"] != st.st_size:
+        return False
+    if need_pad and not np.isfinite(rec["pad_prob"]):
+        return False
+    if need_emb and rec["emb"] is None and not rec["err"]:
+        return False
+    return True
+
+
+# ------------------------------------------------------------
+# Worker
+# ------------------------------------------------------------
+def _init_worker(version: str):
+    global _VERSION
+    _VERSION = version
+    os.environ["ORT_INTRA_OP_THREADS"] = "1"
+    cv2.setNumThreads(1)
+    init_pad_model()
+    init_face_models()
+
+
+def _score_batch(batch):
+    """
+    batch: [(path, need_pad, need_emb)] -> [(path, record)]
+    """
+    out = []
+    for path, need_pad, need_emb in batch:
+        rec = {"pad_prob": np.nan, "pad_ms": np.nan, "emb_ms": np.nan, "emb": None, "err": ""}
+        try:
+            st = os.stat(path)
+            rec["mtime"], rec["size"] = st.st_mtime_ns, st.st_size
+            with open(path, "rb") as f:
+                data = f.read()
+            if need_pad:
+                t0 = time.perf_counter()
+                rec["pad_prob"] = float(predict_prob_live(data))
+                rec["pad_ms"] = (time.perf_counter() - t0) * 1000.0
+            if need_emb:
+                t0 = time.perf_counter()
+                try:
+                    feats, _ = extract_versions(data, [_VERSION])
+                    rec["emb"] = feats[_VERSION].reshape(-1).astype(np.float32)
+                except ValueError as e:
+                    rec["err"] = str(e)
+                rec["emb_ms"] = (time.perf_counter() - t0) * 1000.0
+        except Exception as e:
+            rec.setdefault("mtime", 0)
+            rec.setdefault("size", 0)
+            rec["err"] = f"{type(e).__name__}:{e}"
+        out.append((path, rec))
+    return out
+
+
+def score_all(items, cache: dict, version: str, workers: int, batch: int, cache_path: str, fp: str):
+    """
+    Chấm điểm các ảnh chưa có trong cache (hoặc đã đổi), cập nhật cache tại chỗ.
+    """
+    need = {}
+    for path, kind, _ in items:
+        p, e = need.get(path, (False, False))
+        need[path] = (p or kind == "pad", e or kind == "verify")
+    todo = []
+    for path, (need_pad, need_emb) in need.items():
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        rec = cache.get(path)
+        if not _fresh(rec, st, need_pad, need_emb):
+            # giữ phần đã có khi chỉ thiếu 1 loại điểm
+            if rec is not None and rec["mtime"] == st.st_mtime_ns and rec["size"] == st.st_size:
+                need_pad = need_pad and not np.isfinite(rec["pad_prob"])
+                need_emb = need_emb and rec["emb"] is None and not rec["err"]
+            todo.append((path, need_pad, need_emb))
+    print(f"[EVAL] {len(need)} images, {len(need) - len(todo)} cached, {len(todo)} to score")
+    if not todo:
+        return
+
+    batches = [todo[i:i + batch] for i in range(0, len(todo), batch)]
+    done = 0
+    t0 = time.perf_counter()
+    with mp.Pool(workers, initializer=_init_worker, initargs=(version,)) as pool:
+        for n, part in enumerate(pool.imap_unordered(_score_batch, batches), 1):
+            for path, rec in part:
+                old = cache.get(path)
+                if old is not None and old["mtime"] == rec["mtime"] and old["size"] == rec["size"]:
+                    # gộp với điểm cũ còn hợp lệ
+                    for k in ("pad_prob", "pad_ms"):
+                        if not np.isfinite(rec[k]):
+                            rec[k] = old[k]
+                    if rec["emb"] is None and not rec["err"]:
+                        rec["emb"], rec["err"], rec["emb_ms"] = old["emb"], old["err"], old["emb_ms"]
+                cache[path] = rec
+            done += len(part)
+            if n % 20 == 0:
+                save_cache(cache_path, fp, cache)   # checkpoint: dừng giữa chừng vẫn giữ được phần đã chấm
+                dt = time.perf_counter() - t0
+                print(f"[EVAL] scored {done}/{len(todo)} ({done / dt:.1f} img/s)")
+    save_cache(cache_path, fp, cache)
+
+
+# ------------------------------------------------------------
+# Metrics
+# ------------------------------------------------------------
+def pad_report(items, cache: dict, pad_thr: float) -> dict:
+    bona, spoof = [], {}
+    for path, kind, label in items:
+        rec = cache.get(path)
+        if kind != "pad" or rec is None or not np.isfinite(rec["pad_prob"]):
+            continue
+        if label == "bona":
+            bona.append(rec["pad_prob"])
+        else:
+            spoof.setdefault(label, []).append(rec["pad_prob"])
+    if not bona and not spoof:
+        return {}
+
+    bona_items = [{"bona": 1, "pad_prob": p} for p in bona]
+    per_attack = {}
+    for atk, probs in sorted(spoof.items()):
+        m = apcer_bpcer_acer(bona_items + [{"bona": 0, "pad_prob": p} for p in probs], pad_thr=pad_thr)
+        per_attack[atk] = {"n": len(probs), "APCER": m["APCER"]}
+    all_spoof = [p for probs in spoof.values() for p in probs]
+    overall = apcer_bpcer_acer(bona_items + [{"bona": 0, "pad_prob": p} for p in all_spoof], pad_thr=pad_thr)
+    # ISO/IEC 30107-3: ACER tính theo loại tấn công tệ nhất
+    apcers = [v["APCER"] for v in per_attack.values() if v["APCER"] is not None]
+    worst = max(apcers) if apcers else None
+    return {
+        "pad_thr": pad_thr,
+        "n_bona": len(bona),
+        "n_spoof": len(all_spoof),
+        "per_attack": per_attack,
+        "APCER": overall["APCER"],
+        "APCER_max": worst,
+        "BPCER": overall["BPCER"],
+        "ACER": (worst + overall["BPCER"]) / 2.0 if worst is not None and overall["BPCER"] is not None else None,
+        "eer": eer_from_scores(bona, all_spoof),
+    }
+
+
+def verify_scores(items, cache: dict, max_impostors: int, seed: int = 0, chunk: int = 2048):
+    """
+    -> (genuine, impostor) cosine của mọi cặp ảnh; impostor được lấy mẫu đều nếu quá max_impostors.
+    """
+    paths, labels = [], []
+    for path, kind, label in items:
+        rec = cache.get(path)
+        if kind == "verify" and rec is not None and rec["emb"] is not None:
+            paths.append(path)
+            labels.append(label)
+    if len(paths) < 2:
+        return np.empty(0, np.float32), np.empty(0, np.float32)
+
+    emb = scoring.l2_normalize(np.stack([cache[p]["emb"] for p in paths]))
+    _, ids = np.unique(np.asarray(labels), return_inverse=True)
+    n = len(paths)
+
+    n_gen = int(sum(c * (c - 1) // 2 for c in np.bincount(ids)))
+    n_imp = n * (n - 1) // 2 - n_gen
+    keep = min(1.0, max_impostors / n_imp) if n_imp else 1.0
+    rng = np.random.default_rng(seed)
+
+    gen, imp = [], []
+    for i in range(0, n, chunk):
+        s = scoring.score_matrix(emb[i:i + chunk], emb)      # (c, n): 1 phép nhân / chunk
+        rows = np.arange(i, min(i + chunk, n))[:, None]
+        upper = np.arange(n)[None, :] > rows                  # mỗi cặp đếm 1 lần
+        same = ids[i:i + chunk][:, None] == ids[None, :]
+        gen.append(s[upper & same])
+        d = s[upper & ~same]
+        if keep < 1.0:
+            d = d[rng.random(d.shape[0]) < keep]
+        imp.append(d)
+    return np.concatenate(gen), np.concatenate(imp)
+
+
+def verify_report(items, cache: dict, max_impostors: int) -> dict:
+    gen, imp = verify_scores(items, cache, max_impostors)
+    if gen.size == 0 or imp.size == 0:
+        return {}
+    at = {}
+    for purpose, th in risk_engine.current_policy()["purposes"].items():
+        for level in ("pass", "stepup"):
+            far, frr = rates_at(gen, imp, th[level])
+            at[f"{level.upper()}_{purpose}"] = {"thr": th[level], "FAR": far, "FRR": frr}
+    return {"n_genuine": int(gen.size), "n_impostor": int(imp.size), "eer": eer_from_scores(gen, imp), "at": at}
+
+
+def latency_report(items, cache: dict) -> dict:
+    out = {}
+    for key in ("pad_ms", "emb_ms"):
+        v = np.array([cache[p][key] for p, _, _ in items if p in cache], dtype=np.float64)
+        v = v[np.isfinite(v)]
+        if v.size:
+            p50, p90, p99 = np.percentile(v, [50, 90, 99])
+            out[key] = {"n": int(v.size), "mean": float(v.mean()), "p50": float(p50),
+                        "p90": float(p90), "p99": float(p99), "max": float(v.max())}
+    return out
+
+
+def _fmt(x):
+    return "n/a" if x is None else f"{x:.4f}"
+
+
+def print_report(rep: dict) -> None:
+    pad = rep["pad"]
+    print("=== PAD (anti-spoof) ===")
+    if pad:
+        print(f"bona={pad['n_bona']} spoof={pad['n_spoof']} thr={pad['pad_thr']}")
+        for atk, m in pad["per_attack"].items():
+            print(f"  APCER[{atk}] : {_fmt(m['APCER'])} (n={m['n']})")
+        print(f"APCER (all) : {_fmt(pad['APCER'])}")
+        print(f"APCER (max) : {_fmt(pad['APCER_max'])}")
+        print(f"BPCER       : {_fmt(pad['BPCER'])}")
+        print(f"ACER        : {_fmt(pad['ACER'])}")
+        print(f"EER         : {_fmt(pad['eer']['eer'])} @ thr={_fmt(pad['eer']['thr_at_eer'])}")
+    else:
+        print("No data")
+
+    ver = rep["verify"]
+    print("\n=== Verification (matching) ===")
+    if ver:
+        print(f"genuine={ver['n_genuine']} impostor={ver['n_impostor']}")
+        print(f"EER : {_fmt(ver['eer']['eer'])} @ thr={_fmt(ver['eer']['thr_at_eer'])}")
+        for name, m in ver["at"].items():
+            print(f"  {name:<15} thr={m['thr']:.2f} FAR={_fmt(m['FAR'])} FRR={_fmt(m['FRR'])}")
+    else:
+        print("No data")
+
+    print("\n=== Latency (ms / image, 1 thread) ===")
+    for key, m in rep["latency"].items():
+        print(f"{key:<7} n={m['n']} mean={m['mean']:.1f} p50={m['p50']:.1f} "
+              f"p90={m['p90']:.1f} p99={m['p99']:.1f} max={m['max']:.1f}")
+    if rep["errors"]:
+        print(f"\nErrors: {sum(rep['errors'].values())} images {rep['errors']}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--root", required=True, help="thư mục dataset (pad/..., verify/...)")
+    ap.add_argument("--cache", default=None, help="file cache .npz (mặc định <root>/.eval_cache_<version>.npz)")
+    ap.add_argument("--version", default=None, help="ModelVersion trong FACE_MODELS (mặc định model chính)")
+    ap.add_argument("--workers", type=int, default=mp.cpu_count())
+    ap.add_argument("--batch", type=int, default=32, help="số ảnh mỗi task của worker")
+    ap.add_argument("--pad-thr", type=float, default=0.5, help="ngưỡng live của PAD (mặc định như is_live)")
+    ap.add_argument("--max-impostors", type=int, default=5_000_000, help="lấy mẫu cặp impostor nếu nhiều hơn")
+    ap.add_argument("--json", default=None, help="ghi báo cáo ra file JSON")
+    args = ap.parse_args()
+
+    version = args.version or next(iter(FACE_MODELS))
+    if version not in FACE_MODELS:
+        raise SystemExit(f"Unknown model version {version}; FACE_MODELS has {list(FACE_MODELS)}")
+    root = os.path.abspath(args.root)
+    cache_path = args.cache or os.path.join(root, f".eval_cache_{version}.npz")
+    fp = fingerprint(version)
+
+    items = scan(root)
+    if not items:
+        raise SystemExit(f"No images under {root}/pad or {root}/verify")
+    cache = load_cache(cache_path, fp)
+    score_all(items, cache, version, args.workers, args.batch, cache_path, fp)
+
+    errors = {}
+    for path, _, _ in items:
+        err = cache.get(path, {}).get("err")
+        if err:
+            code = err.split(":")[0]
+            errors[code] = errors.get(code, 0) + 1
+    rep = {
+        "version": version,
+        "pad": pad_report(items, cache, args.pad_thr),
+        "verify": verify_report(items, cache, args.max_impostors),
+        "latency": latency_report(items, cache),
+        "errors": errors,
+    }
+    print_report(rep)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Mã hóa lại BLOB Vector của PoseEmbeddings/UserEmbeddings sang codec mới (f32/f16/i8),
+cập nhật tại chỗ theo từng batch (mỗi batch 1 transaction).
+--normalize: chuẩn hóa L2 các vector cũ chưa unit-norm (services/scoring giả định unit-norm);
+không có --codec thì giữ codec hiện tại của từng dòng.
+
+Chạy từ root project:
+    python -m tools.migrate_embeddings --codec f16
+    python -m tools.migrate_embeddings --codec i8 --batch 2000 --dry-run
+    python -m tools.migrate_embeddings --normalize
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.database import db
+from app.database.queries import CODECS, blob_codec, decode_vectors, encode_vector
+from app.services.scoring import UNIT_TOL, l2_normalize
+
+TABLES = ("PoseEmbeddings", "UserEmbeddings")
+
+
+def _cos_err(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    |cos(a_i, b_i) - 1| theo từng dòng: sai số cosine do mã hóa lại.
+    """
+    na = np.linalg.norm(a, axis=1) + 1e-9
+    nb = np.linalg.norm(b, axis=1) + 1e-9
+    return np.abs(1.0 - np.sum(a * b, axis=1) / (na * nb))
+
+
+def migrate_table(
+    conn, table: str, codec: str | None, batch: int, dry_run: bool = False, normalize: bool = False
+) -> dict:
+    cid = CODECS[codec] if codec else None
+    last = 0
+    stats = {"rows": 0, "rewritten": 0, "normalized": 0, "bytes_before": 0, "bytes_after": 0, "max_cos_err": 0.0}
+    while True:
+        rows = conn.execute(
+            f"SELECT rowid AS rid, Vector, Dim FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last, batch),
+        ).fetchall()
+        if not rows:
+            break
+        last = rows[-1]["rid"]
+
+        # Gom theo Dim để decode/encode vector hóa
+        by_dim: dict = {}
+        for r in rows:
+            by_dim.setdefault(int(r["Dim"]), []).append(r)
+
+        updates = []
+        for dim, grp in by_dim.items():
+            blobs = [bytes(r["Vector"]) for r in grp]
+            old = decode_vectors(blobs, dim)
+            src = old
+            off = np.zeros(len(grp), dtype=bool)
+            if normalize:
+                off = np.abs(np.linalg.norm(old, axis=1) - 1.0) > UNIT_TOL
+                src = np.where(off[:, None], l2_normalize(old), old)
+            cids = [cid if cid is not None else blob_codec(b, dim) for b in blobs]
+            encoded = [encode_vector(v, c) for v, c in zip(src, cids)]
+            new = decode_vectors(encoded, dim)
+            stats["max_cos_err"] = max(stats["max_cos_err"], float(_cos_err(old, new).max()))
+            for r, b, nb, c, o in zip(grp, blobs, encoded, cids, off):
+                stats["rows"] += 1
+                stats["bytes_before"] += len(b)
+                if blob_codec(b, dim) == c and not o:
+                    stats["bytes_after"] += len(b)
+                    continue
+                stats["normalized"] += int(o)
+                stats["bytes_after"] += len(nb)
+                updates.append((nb, r["rid"]))
+
+        if updates and not dry_run:
+            with conn:
+                conn.executemany(f"UPDATE {table} SET Vector=? WHERE rowid=?", updates)
+        stats["rewritten"] += len(updates)
+    return stats
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--codec", choices=sorted(CODECS), default=None)
+    ap.add_argument("--normalize", action="store_true", help="chuẩn hóa L2 vector chưa unit-norm")
+    ap.add_argument("--batch", type=int, default=1000, help="số dòng mỗi transaction")
+    ap.add_argument("--db", default=None, help="đường dẫn DB (mặc định db.DB_PATH)")
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+    if not args.codec and not args.normalize:
+        ap.error("cần --codec và/hoặc --normalize")
+
+    if args.db:
+        db.DB_PATH = args.db
+
+    t0 = time.perf_counter()
+    conn = db.get_conn()
+    try:
+        for table in TABLES:
+            st = migrate_table(conn, table, args.codec, args.batch, args.dry_run, args.normalize)
+            ratio = (st["bytes_before"] / st["bytes_after"]) if st["bytes_after"] else 0.0
+            print(
+                f"{table}: rows={st['rows']} rewritten={st['rewritten']} normalized={st['normalized']} "
+                f"bytes {st['bytes_before']} -> {st['bytes_after']} (x{ratio:.2f}) "
+                f"max|dcos|={st['max_cos_err']:.2e}"
+            )
+    finally:
+        conn.close()
+    print(f"Done in {time.perf_counter() - t0:.2f}s{' (dry-run)' if args.dry_run else ''}")
+
+
+if __name__ == "__main__":
+    main()
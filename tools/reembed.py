@@ -0,0 +1,133 @@
+"""
+Re-embed toàn bộ user bằng model nhận dạng mới từ crop 112x112 đã lưu lúc enroll
+(EnrollmentCrops, cần CROP_STORE_KEY), ghi vào EmbeddingsStaging dưới ModelVersion mới.
+
+- Chạy theo chunk UserId tăng dần, mỗi chunk ghi 1 transaction -> dừng giữa chừng thì
+  chạy lại là tiếp tục (user đã đủ embedding staging được bỏ qua).
+- Decrypt + embed chạy song song trên process pool.
+- --switch: khi xong, chuyển staging -> PoseEmbeddings/UserEmbeddings + ActiveModelVersion
+  trong 1 transaction. Trong lúc migrate, verify chấm điểm cả 2 version
+  (cần FACE_MODELS chứa cả model cũ và mới).
+
+Chạy từ root project:
+    CROP_STORE_KEY=... python -m tools.reembed --version arcface-512 --weights models/arcface.onnx --workers 8
+    CROP_STORE_KEY=... python -m tools.reembed --version arcface-512 --weights models/arcface.onnx --switch
+"""
+import argparse
+import multiprocessing as mp
+import time
+
+import numpy as np
+import cv2
+
+from app.database import db
+from app.database.queries import (
+    count_users_without_crops,
+    get_crop_blobs,
+    list_reembed_candidates,
+    save_staged_embeddings,
+    set_meta,
+    switch_model_version,
+)
+from app.services import crop_store
+from app.services.face_embedding import embed_aligned, load_recognizer
+
+POSES = ("front", "left", "right")
+
+_REC = None
+
+
+def _init_worker(weights: str):
+    global _REC
+    cv2.setNumThreads(1)
+    _REC = load_recognizer(weights)
+
+
+def _embed_users(items):
+    """
+    items: [(user_id, {pose: blob})] -> [(user_id, {pose: vec, 'mean': vec} | None, error)]
+    """
+    out = []
+    for user_id, blobs in items:
+        try:
+            vecs = {}
+            for pose in POSES:
+                crop = crop_store.decrypt_crop(user_id, pose, blobs[pose])
+                vecs[pose] = embed_aligned(crop, recognizer=_REC).reshape(-1)
+            vecs["mean"] = np.mean(np.stack([vecs[p] for p in POSES], axis=0), axis=0)
+            out.append((user_id, vecs, None))
+        except Exception as e:
+            out.append((user_id, None, f"{type(e).__name__}:{e}"))
+    return out
+
+
+def _split(items, parts: int):
+    k = max(1, (len(items) + parts - 1) // parts)
+    return [items[i:i + k] for i in range(0, len(items), k)]
+
+
+def run(version: str, weights: str, workers: int, chunk: int) -> dict:
+    set_meta("MigratingModelVersion", version)
+    done = 0
+    errors = []
+    after = 0
+    t0 = time.perf_counter()
+    with mp.Pool(workers, initializer=_init_worker, initargs=(weights,)) as pool:
+        while True:
+            ids = list_reembed_candidates(version, after, chunk)
+            if not ids:
+                break
+            after = ids[-1]
+            blobs = get_crop_blobs(ids)
+            items = [(uid, blobs[uid]) for uid in ids if uid in blobs]
+
+            rows = []
+            for part in pool.map(_embed_users, _split(items, workers * 4)):
+                for user_id, vecs, err in part:
+                    if err is not None:
+                        errors.append((user_id, err))
+                        continue
+                    rows.extend((user_id, pose, version, v) for pose, v in vecs.items())
+                    done += 1
+            save_staged_embeddings(rows)   # 1 transaction / chunk
+
+            dt = time.perf_counter() - t0
+            print(f"[REEMBED] users={done} errors={len(errors)} last_user={after} {done / dt:.1f} users/s")
+
+    dt = time.perf_counter() - t0
+    return {"users": done, "errors": errors, "seconds": dt, "users_per_s": (done / dt) if dt > 0 else 0.0}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--version", required=True, help="ModelVersion mới, vd. arcface-512")
+    ap.add_argument("--weights", required=True, help="file ONNX của model mới")
+    ap.add_argument("--workers", type=int, default=mp.cpu_count())
+    ap.add_argument("--chunk", type=int, default=512, help="số user mỗi chunk/transaction")
+    ap.add_argument("--switch", action="store_true", help="switch ActiveModelVersion khi xong")
+    ap.add_argument("--force", action="store_true", help="switch kể cả khi còn user lỗi")
+    ap.add_argument("--db", default=None, help="đường dẫn DB (mặc định db.DB_PATH)")
+    args = ap.parse_args()
+
+    if args.db:
+        db.DB_PATH = args.db
+    if not crop_store.enabled():
+        raise SystemExit("CROP_STORE_KEY is required to read enrollment crops")
+
+    res = run(args.version, args.weights, args.workers, args.chunk)
+    print(f"=== Re-embed {args.version} ===")
+    print(f"Users     : {res['users']} in {res['seconds']:.1f}s ({res['users_per_s']:.1f} users/s)")
+    print(f"Errors    : {len(res['errors'])}")
+    for user_id, err in res["errors"][:20]:
+        print(f"  user {user_id}: {err}")
+    print(f"No crops  : {count_users_without_crops()} users (keep old model in FACE_MODELS or re-enroll)")
+
+    if args.switch:
+        if res["errors"] and not args.force:
+            raise SystemExit("Not switching: some users failed (use --force to switch anyway)")
+        st = switch_model_version(args.version)
+        print(f"Switched ActiveModelVersion -> {args.version}: {st}")
+
+
+if __name__ == "__main__":
+    main()
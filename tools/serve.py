@@ -0,0 +1,179 @@
+"""
+Chạy production: nạp model 1 lần ở process cha rồi fork N worker uvicorn dùng chung 1 socket.
+
+- YuNet, các recognizer và session PAD được nạp trước khi fork -> trọng số nằm trong các trang
+  copy-on-write dùng chung, mỗi worker chỉ tốn bộ nhớ riêng cho buffer suy luận.
+  gc.freeze() trước khi fork để GC không ghi vào header của các object đã nạp (làm vỡ trang dùng chung).
+- Mỗi worker dùng --threads thread ORT/OpenCV (mặc định số core / số worker) -> không oversubscription.
+  ORT tạo thread pool lúc tạo session và thread không sống qua fork, nên session PAD chỉ được
+  nạp trước khi fork khi --threads 1; ngược lại mỗi worker tự nạp PAD sau fork.
+- --pin: gắn worker i vào --threads core riêng (sched_setaffinity, Linux).
+- Process cha giám sát: worker chết thì fork lại; SIGTERM -> dừng các worker rồi thoát.
+  In RSS/PSS từng worker (services/proc_stats) sau khi khởi động và mỗi --report-s giây.
+
+Chạy từ root project:
+    python -m tools.serve --workers 8 --port 8000
+    python -m tools.serve --workers 4 --threads 2 --pin
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import time
+
+from app.services import proc_stats
+
+
+def _cpus():
+    return sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+
+
+def _bind(host: str, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(index: int, sock: socket.socket, args) -> None:
+    import cv2
+    import uvicorn
+    from app.main import app
+
+    cv2.setNumThreads(args.threads)
+    if args.pin and hasattr(os, "sched_setaffinity"):
+        cpus = _cpus()
+        start = index * args.threads
+        os.sched_setaffinity(0, {cpus[(start + k) % len(cpus)] for k in range(args.threads)})
+    config = uvicorn.Config(app, log_level=args.log_level, access_log=args.access_log)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _spawn(index: int, sock: socket.socket, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            _run_worker(index, sock, args)
+        except BaseException as e:
+            print(f"[SERVE] worker {index} crashed: {e!r}")
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def _report(workers: dict) -> None:
+    total = 0.0
+    for pid, index in sorted(workers.items(), key=lambda kv: kv[1]):
+        m = proc_stats.memory(pid)
+        total += m.get("pss_mb", m.get("rss_mb", 0.0))
+        print(f"[SERVE] worker {index} pid={pid} rss={m.get('rss_mb')}MB pss={m.get('pss_mb')}MB "
+              f"private={m.get('private_mb')}MB")
+    m = proc_stats.memory()
+    total += m.get("pss_mb", m.get("rss_mb", 0.0))
+    print(f"[SERVE] master pid={os.getpid()} rss={m.get('rss_mb')}MB pss={m.get('pss_mb')}MB | "
+          f"total pss={total:.1f}MB for {len(workers)} workers")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Production launcher: preload model + fork worker")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--workers", type=int, default=len(_cpus()), help="số worker (mặc định = số core)")
+    ap.add_argument("--threads", type=int, default=0, help="thread ORT/OpenCV mỗi worker (0 = core / worker)")
+    ap.add_argument("--pin", action="store_true", help="gắn mỗi worker vào core riêng")
+    ap.add_argument("--no-preload", dest="preload", action="store_false", help="mỗi worker tự nạp model")
+    ap.add_argument("--report-s", type=float, default=300, help="chu kỳ in bộ nhớ worker (0 = chỉ lúc khởi động)")
+    ap.add_argument("--backlog", type=int, default=2048)
+    ap.add_argument("--log-level", default="info")
+    ap.add_argument("--access-log", action="store_true")
+    ap.add_argument("--db", default=None, help="đường dẫn DB (mặc định db.DB_PATH)")
+    ap.add_argument("--audit-db", default=None, help="DB audit (mặc định AUDIT_DB_PATH)")
+    args = ap.parse_args()
+
+    args.workers = max(1, args.workers)
+    args.threads = args.threads or max(1, len(_cpus()) // args.workers)
+    # Phải đặt trước khi tạo session ORT (pad_model đọc lúc nạp)
+    os.environ["ORT_INTRA_OP_THREADS"] = str(args.threads)
+    os.environ.setdefault("OMP_NUM_THREADS", str(args.threads))
+
+    import cv2
+    cv2.setNumThreads(1)   # process cha không được tạo thread pool trước khi fork
+    from app.database import db
+    from app.main import app  # noqa: F401  (import route/service trước fork -> dùng chung)
+    from app.routes.verify import CHALLENGE_MODE
+    from app.services.face_embedding import init_face_models
+    from app.services.pad_model import init_pad_model
+    from app.services import rate_limit
+
+    if args.db:
+        db.DB_PATH = args.db
+    if args.audit_db:
+        db.AUDIT_DB_PATH = args.audit_db
+    db.init_db()
+    if args.preload:
+        init_face_models()
+        if args.threads == 1:
+            init_pad_model()
+        else:
+            print(f"[SERVE] --threads {args.threads}: PAD session nạp riêng trong từng worker (ORT thread pool không qua được fork)")
+    if args.workers > 1 and CHALLENGE_MODE != "signed":
+        print("[SERVE] WARN: CHALLENGE_MODE=memory cần sticky session giữa start/submit; dùng CHALLENGE_MODE=signed")
+    if args.workers > 1 and rate_limit.ENABLED and rate_limit.BACKEND == "memory":
+        print("[SERVE] WARN: RATE_LIMIT_BACKEND=memory -> mỗi worker đếm riêng (giới hạn thực tế x số worker)")
+
+    gc.collect()
+    gc.freeze()
+    sock = _bind(args.host, args.port, args.backlog)
+    print(f"[SERVE] {args.host}:{args.port} workers={args.workers} threads/worker={args.threads} "
+          f"preload={args.preload} pin={args.pin}")
+
+    workers = {}   # pid -> index
+    for i in range(args.workers):
+        workers[_spawn(i, sock, args)] = i
+
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    next_report = time.monotonic() + 10.0
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        if pid == 0:
+            if not stopping and next_report and time.monotonic() >= next_report:
+                _report(workers)
+                next_report = time.monotonic() + args.report_s if args.report_s > 0 else 0
+            time.sleep(0.5)
+            continue
+        index = workers.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f"[SERVE] worker {index} pid={pid} exited ({status}), restarting")
+        time.sleep(1.0)
+        workers[_spawn(index, sock, args)] = index
+    print("[SERVE] stopped")
+
+
+if __name__ == "__main__":
+    main()
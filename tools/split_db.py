@@ -0,0 +1,126 @@
+"""
+Tách 1 file DB cũ thành DB gallery (Users, embeddings, ...) + DB audit (AuthLogs, MetricsRollup).
+
+- Copy AuthLogs theo batch LogId (giữ nguyên LogId, INSERT OR IGNORE -> chạy lại được),
+  copy MetricsRollup + high-water mark của rollup.
+- Đếm lại 2 bên khớp mới DROP bảng audit khỏi DB gallery (bỏ qua với --keep).
+- Dừng app trước khi chạy; sau đó khởi động với AUDIT_DB_PATH=<file audit>.
+
+Chạy từ root project:
+    python -m tools.split_db --audit audit.db
+    python -m tools.split_db --db biometric.db --audit audit.db --vacuum
+"""
+import argparse
+import sqlite3
+import time
+
+from app.database import db
+from app.services.metrics_rollup import HIGH_WATER_KEY
+
+AUDIT_TABLES = ("AuthLogs", "MetricsRollup")
+
+
+def _columns(conn, schema: str, table: str):
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _has_table(conn, schema: str, table: str) -> bool:
+    row = conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    return row is not None
+
+
+def split(gallery: str, audit: str, batch: int) -> dict:
+    db.DB_PATH = gallery
+    db.AUDIT_DB_PATH = audit
+    if not db.audit_is_separate():
+        raise SystemExit("--audit must be a different file than the gallery DB")
+    db.init_db()   # tạo schema audit (không FK sang Users) trong file mới
+
+    conn = sqlite3.connect(audit)
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute("ATTACH DATABASE ? AS src", (gallery,))
+    if not _has_table(conn, "src", "AuthLogs"):
+        conn.close()
+        return {"copied": 0, "note": "gallery DB has no AuthLogs (already split?)"}
+
+    # cột mở rộng có ở DB cũ mà DB audit chưa có
+    dst_cols = _columns(conn, "main", "AuthLogs")
+    for col in _columns(conn, "src", "AuthLogs"):
+        if col not in dst_cols:
+            conn.execute(f"ALTER TABLE main.AuthLogs ADD COLUMN {col}")
+    cols = ", ".join(_columns(conn, "src", "AuthLogs"))
+
+    copied = 0
+    after = 0
+    t0 = time.perf_counter()
+    while True:
+        with conn:
+            last = conn.execute(
+                "SELECT MAX(LogId) FROM (SELECT LogId FROM src.AuthLogs WHERE LogId > ? ORDER BY LogId LIMIT ?)",
+                (after, batch),
+            ).fetchone()[0]
+            if last is None:
+                break
+            copied += conn.execute(
+                f"INSERT OR IGNORE INTO main.AuthLogs({cols}) SELECT {cols} FROM src.AuthLogs WHERE LogId > ? AND LogId <= ?",
+                (after, last),
+            ).rowcount
+        after = last
+        print(f"[SPLIT] AuthLogs up to LogId {after} ({copied} rows, {time.perf_counter() - t0:.1f}s)")
+
+    with conn:
+        if _has_table(conn, "src", "MetricsRollup"):
+            rcols = ", ".join(_columns(conn, "src", "MetricsRollup"))
+            conn.execute(f"INSERT OR REPLACE INTO main.MetricsRollup({rcols}) SELECT {rcols} FROM src.MetricsRollup")
+        conn.execute(
+            "INSERT OR REPLACE INTO main.Meta(Key, Value) SELECT Key, Value FROM src.Meta WHERE Key=?",
+            (HIGH_WATER_KEY,),
+        )
+
+    n_src = conn.execute("SELECT COUNT(*) FROM src.AuthLogs").fetchone()[0]
+    n_dst = conn.execute("SELECT COUNT(*) FROM main.AuthLogs WHERE LogId <= ?", (after,)).fetchone()[0]
+    conn.close()
+    return {"copied": copied, "src_rows": n_src, "dst_rows": n_dst, "ok": n_src == n_dst}
+
+
+def drop_from_gallery(gallery: str, vacuum: bool) -> None:
+    conn = sqlite3.connect(gallery)
+    try:
+        with conn:
+            for table in AUDIT_TABLES:
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute("DELETE FROM Meta WHERE Key=?", (HIGH_WATER_KEY,))
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if vacuum:
+            conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=None, help="DB hiện tại, giữ làm DB gallery (mặc định db.DB_PATH)")
+    ap.add_argument("--audit", required=True, help="file DB audit mới")
+    ap.add_argument("--batch", type=int, default=50000, help="số dòng AuthLogs mỗi transaction")
+    ap.add_argument("--keep", action="store_true", help="không xóa bảng audit khỏi DB gallery")
+    ap.add_argument("--vacuum", action="store_true", help="VACUUM DB gallery sau khi xóa")
+    args = ap.parse_args()
+
+    gallery = str(args.db or db.DB_PATH)
+    res = split(gallery, args.audit, args.batch)
+    print("=== Split DB ===")
+    print(f"Gallery : {gallery}")
+    print(f"Audit   : {args.audit}")
+    print(f"Result  : {res}")
+    if "ok" not in res:
+        return
+    if not res["ok"]:
+        raise SystemExit("Row counts differ; gallery tables left in place")
+    if not args.keep:
+        drop_from_gallery(gallery, args.vacuum)
+        print(f"Dropped {', '.join(AUDIT_TABLES)} from gallery DB")
+    print(f"Start the app with AUDIT_DB_PATH={args.audit}")
+
+
+if __name__ == "__main__":
+    main()